@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Compares the in-memory aspect matcher with the SQL matching algorithms.
+
+Both implementations are run against all posts in the database (regardless
+of absa.post_aspect) and their timings are reported. The results are
+compared by their keys only because the SQL algorithms choose just any word
+of each aspect for the target_aspect_word column.
+
+Usage: scripts/benchmarks/aspect_matching.py
+Requires all absa tables to be filled already.
+"""
+
+import logging
+import os
+import tempfile
+import time
+
+import luigi
+import pandas as pd
+
+from _utils import logger
+from absa.post_aspects import (
+    CollectPostAspectsEquality, CollectPostAspectsLevenshtein,
+    MatchPostAspects)
+
+# Pretend that no post has been matched yet
+EMPTY_TABLE = '(SELECT * FROM absa.post_aspect WHERE FALSE) AS post_aspect'
+KEY_COLUMNS = [
+    'source', 'post_id', 'word_index', 'aspect_id', 'match_algorithm'
+]
+
+
+def run_task(task):
+    """Run a task and its explicit requirements, but not its _requires()."""
+    for requirement in luigi.task.flatten(task.requires()):
+        if not requirement.complete():
+            run_task(requirement)
+    task.run()
+
+
+def time_task(task):
+    """Run a task and return its duration and its result."""
+    start = time.perf_counter()
+    run_task(task)
+    duration = time.perf_counter() - start
+    with task.output().open('r') as stream:
+        return duration, pd.read_csv(stream, dtype={'post_id': str})
+
+
+def main():  # noqa: D103
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        os.environ['OUTPUT_DIR'] = output_dir
+
+        sql_duration, sql_results = 0, []
+        for task_class in [
+                CollectPostAspectsEquality, CollectPostAspectsLevenshtein]:
+            duration, results = time_task(task_class(table=EMPTY_TABLE))
+            logger.info(f"{task_class.__name__}: {duration:.1f} s")
+            sql_duration += duration
+            sql_results.append(results)
+        sql_results = pd.concat(sql_results)
+
+        memory_duration, memory_results = time_task(
+            MatchPostAspects(table=EMPTY_TABLE))
+        logger.info(f"MatchPostAspects: {memory_duration:.1f} s")
+
+    logger.info(f"Speedup: {sql_duration / memory_duration:.1f}x")
+
+    sql_keys = set(sql_results[KEY_COLUMNS].itertuples(index=False))
+    memory_keys = set(memory_results[KEY_COLUMNS].itertuples(index=False))
+    logger.info(f"Matches only found by SQL: {len(sql_keys - memory_keys)}")
+    logger.info(
+        f"Matches only found in memory: {len(memory_keys - sql_keys)}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
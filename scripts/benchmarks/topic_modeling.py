@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Compares the vectorized GSDMM implementation with the gsdmm library.
+
+Both implementations are trained on the same corpus with the same seed and
+their timings are reported. The quality of the labels is measured as the
+normalized mutual information (NMI) with the planted topics of a synthetic
+corpus, or between both implementations if a real corpus is given.
+
+Usage: scripts/benchmarks/topic_modeling.py [corpus_preprocessed.pkl]
+The corpus can be generated using TopicModelingPreprocessCorpus.
+"""
+
+import logging
+import pickle  # nosec: We only use pickle for self-generated files.
+import random
+import sys
+import time
+
+import gsdmm
+import numpy as np
+from sklearn.metrics import normalized_mutual_info_score
+
+from _utils import StreamToLogger, logger
+import topic_modeling_gsdmm
+
+SEED = 42
+K = 12
+
+
+def synthetic_corpus(n_docs=5000, n_topics=8, n_terms=50, noise=0.2):
+    """Generate short docs from planted topics and answer them by topic."""
+    rng = random.Random(SEED)
+    topics = [
+        [f'topic{topic}_term{term}' for term in range(n_terms)]
+        for topic in range(n_topics)
+    ]
+    noise_terms = [f'noise{term}' for term in range(n_terms * n_topics)]
+    truth = [rng.randrange(n_topics) for _ in range(n_docs)]
+    docs = [
+        [
+            rng.choice(noise_terms if rng.random() < noise else topics[topic])
+            for _ in range(rng.randint(3, 15))
+        ]
+        for topic in truth
+    ]
+    return docs, truth
+
+
+def load_corpus(path):
+    """Load the tokens of a corpus generated by the topic modeling."""
+    with open(path, 'rb') as stream:
+        return [doc.tokens for doc in pickle.load(stream)]  # nosec
+
+
+def fit(model_class, docs):
+    """Train a model and answer its labels and duration."""
+    np.random.seed(SEED)
+    model = model_class(K=K, alpha=0.1, beta=0.1, n_iters=30)
+    vocab_size = len({term for doc in docs for term in doc})
+    start = time.perf_counter()
+    with StreamToLogger(log_level=logging.DEBUG).activate():
+        model.fit(docs, vocab_size)
+    duration = time.perf_counter() - start
+    return [model.choose_best_label(doc)[0] for doc in docs], duration
+
+
+def main():  # noqa: D103
+
+    if len(sys.argv) > 1:
+        docs, truth = load_corpus(sys.argv[1]), None
+    else:
+        docs, truth = synthetic_corpus()
+    logger.info(f"Benchmarking on {len(docs)} docs")
+
+    library_labels, library_duration = fit(gsdmm.MovieGroupProcess, docs)
+    logger.info(f"gsdmm: {library_duration:.1f} s")
+    labels, duration = fit(topic_modeling_gsdmm.MovieGroupProcess, docs)
+    logger.info(f"topic_modeling_gsdmm: {duration:.1f} s")
+    logger.info(f"Speedup: {library_duration / duration:.1f}x")
+
+    if truth:
+        for name, labels_ in [
+                ('gsdmm', library_labels),
+                ('topic_modeling_gsdmm', labels)]:
+            logger.info(
+                f"NMI of {name} with planted topics: "
+                f"{normalized_mutual_info_score(truth, labels_):.3f}")
+    logger.info(
+        "NMI between implementations: "
+        f"{normalized_mutual_info_score(library_labels, labels):.3f}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
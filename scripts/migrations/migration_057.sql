@@ -0,0 +1,12 @@
+-- Cache detected languages of posts
+
+BEGIN;
+
+    CREATE TABLE post_language (
+        source TEXT, post_id TEXT,
+        text_hash TEXT,  -- md5 of the text the language was detected for
+        language TEXT,  -- NULL if the language could not be detected
+        PRIMARY KEY (source, post_id, text_hash)
+    );
+
+COMMIT;
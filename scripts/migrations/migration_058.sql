@@ -0,0 +1,16 @@
+-- Visitor prediction - store backtesting results of candidate models
+
+BEGIN;
+
+    CREATE TABLE visitor_prediction_backtest (
+        model TEXT,
+        cutoff_date DATE,  -- last day known to the model
+        days_to_predict INT,
+        mae REAL,
+        rmse REAL,
+        fit_cpu_seconds REAL,
+        predict_cpu_seconds REAL,
+        PRIMARY KEY (model, cutoff_date, days_to_predict)
+    );
+
+COMMIT;
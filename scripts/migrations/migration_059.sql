@@ -0,0 +1,13 @@
+-- Adaptive polling of post performance values - store next poll times
+
+BEGIN;
+
+    CREATE TABLE performance_poll (
+        performance_table TEXT,
+        post_key TEXT,  -- key columns of the post, joined by '_'
+        next_poll TIMESTAMP NOT NULL,
+        poll_interval INTERVAL NOT NULL,
+        PRIMARY KEY (performance_table, post_key)
+    );
+
+COMMIT;
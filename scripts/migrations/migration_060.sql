@@ -0,0 +1,14 @@
+-- Checkpointed harvesting of Facebook comments - store harvest progress
+
+BEGIN;
+
+    CREATE TABLE fb_post_comment_harvest (
+        page_id TEXT,
+        post_id TEXT,
+        PRIMARY KEY (page_id, post_id),
+        comment_count INTEGER,  -- comments in fb_post_performance at start
+        after_cursor TEXT,  -- cursor of next page, NULL if harvest complete
+        comments TEXT NOT NULL  -- JSON list of all comments fetched so far
+    );
+
+COMMIT;
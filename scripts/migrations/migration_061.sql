@@ -0,0 +1,16 @@
+-- Cache Instagram thumbnails - store when they need to be refreshed
+
+BEGIN;
+
+    CREATE TABLE ig_post_thumbnail_refresh (
+        ig_post_id TEXT PRIMARY KEY,
+        next_refresh TIMESTAMP NOT NULL
+    );
+
+    -- Spread the refreshes of existing thumbnails over the next 90 days
+    INSERT INTO ig_post_thumbnail_refresh
+        SELECT ig_post_id, now() + random() * INTERVAL '90 days'
+        FROM ig_post
+        WHERE length(thumbnail_uri) > 0;
+
+COMMIT;
@@ -0,0 +1,13 @@
+-- Cache twint searches for extended tweet collection
+
+BEGIN;
+
+    CREATE TABLE twitter_search_cache (
+        term TEXT,
+        since DATE,  -- tweets were searched from this day to the next one
+        PRIMARY KEY (term, since),
+        tweet_limit INT,
+        tweets TEXT NOT NULL  -- JSON list of all tweets found
+    );
+
+COMMIT;
@@ -0,0 +1,17 @@
+-- Match extended tweet candidates to terms without regular expressions
+
+BEGIN;
+
+    -- all terms that a candidate contains as a whole word
+    CREATE TABLE twitter_extended_candidate_term (
+        term TEXT,
+        tweet_id TEXT,
+        PRIMARY KEY (term, tweet_id),
+        post_date TIMESTAMP
+    );
+
+    CREATE INDEX ON twitter_extended_candidate_term (term, post_date);
+    CREATE INDEX ON twitter_extended_candidates (term, post_date);
+    CREATE INDEX ON twitter_extended_candidates (tweet_id);
+
+COMMIT;
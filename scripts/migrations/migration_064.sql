@@ -0,0 +1,8 @@
+-- Back off from refreshing Instagram thumbnails that could not be fetched
+
+BEGIN;
+
+    ALTER TABLE ig_post_thumbnail_refresh
+        ADD COLUMN failures INTEGER NOT NULL DEFAULT 0;
+
+COMMIT;
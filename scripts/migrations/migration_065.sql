@@ -0,0 +1,10 @@
+-- Repeat old Facebook comment harvests and drop the comments of complete ones
+
+BEGIN;
+
+    ALTER TABLE fb_post_comment_harvest
+        ADD COLUMN harvested_at TIMESTAMP,  -- start of the latest harvest
+        -- NULL once the comments of a complete harvest are in fb_post_comment
+        ALTER COLUMN comments DROP NOT NULL;
+
+COMMIT;
@@ -9,6 +9,10 @@ case $1 in
         TASK=FillDbHourly
         export OUTPUT_DIR="output_hourly"
         ;;
+    weekly)
+        TASK=FillDbWeekly
+        export OUTPUT_DIR="output_weekly"
+        ;;
     *)
         TASK=FillDb
         ;;
@@ -8,7 +8,7 @@ from diagnostics import Diagnostics
 from extended_twitter_collection import TwitterExtendedDatasetToDB
 from gomus import GomusToDb
 from topic_modeling import TopicModeling
-from visitor_prediction.predict import PredictionsToDb
+from visitor_prediction import BacktestResultsToDb, PredictionsToDb
 
 
 class FillDb(luigi.WrapperTask):
@@ -18,6 +18,7 @@ class FillDb(luigi.WrapperTask):
 
         yield FillDbDaily()
         yield FillDbHourly()
+        yield FillDbWeekly()
 
 
 class FillDbDaily(luigi.WrapperTask):
@@ -50,3 +51,12 @@ class FillDbHourly(luigi.WrapperTask):
 
         # Public sources
         yield PostPerformanceToDb()
+
+
+class FillDbWeekly(luigi.WrapperTask):
+    """Runs all tasks that are too expensive for the daily execution."""
+
+    def requires(self):
+
+        # Analysis tasks
+        yield BacktestResultsToDb()
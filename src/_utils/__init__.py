@@ -24,6 +24,7 @@ from ._database import DbConnector                             # noqa: E402
 from .database import CsvToDb, QueryDb, QueryCacheToDb         # noqa: E402
 from .json_converters import JsonToCsv, JsoncToJson            # noqa: E402
 from .museum_facts import MuseumFacts                          # noqa: E402
+from . import http_client                                      # noqa: E402
 
 # Backwards compatibility
 from ._database import db_connector                            # noqa: E402
@@ -35,6 +36,7 @@ __all__ = [
     ConcatCsvs, CsvToDb, DbConnector, QueryCacheToDb, QueryDb,
     JsonToCsv, JsoncToJson,
     MuseumFacts,
+    http_client,
     ObjectParameter, StreamToLogger,
 
     db_connector, minimal_mode, output_dir
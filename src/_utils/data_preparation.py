@@ -1,8 +1,10 @@
+import datetime as dt
 import sys
 from functools import reduce
 from typing import Callable, Dict, List, Tuple
 
 import luigi
+from luigi.format import UTF8
 import pandas as pd
 from tqdm import tqdm
 
@@ -53,6 +55,41 @@ class DataPreparationTask(luigi.Task):
         condenser.delta_function = delta_function
         return condenser.condense_performance_values(df)
 
+    def poll_scheduler(self):
+        """Answer a scheduler for polling the performance values of posts."""
+        if not self.table:
+            raise RuntimeError("Table not set in poll_scheduler")
+
+        return PerformancePollScheduler(self.db_connector, self.table)
+
+    def poll_schedule_target(self):
+        """
+        Answer the target for the next poll times of all polled posts.
+
+        The next poll times must not be stored before the performance values
+        of the posts have been stored. Otherwise, a post whose values could
+        not be stored would not be polled again before its next poll time.
+        """
+        return luigi.LocalTarget(
+            f'{self.output_dir}/performance_poll/{self.table}.csv',
+            format=UTF8)
+
+    def write_poll_schedule(self, next_polls: pd.DataFrame):
+        """Write next poll times to the poll_schedule_target()."""
+        with self.poll_schedule_target().open('w') as schedule_file:
+            next_polls.to_csv(schedule_file, index=False, header=True)
+
+    def store_poll_schedule(self):
+        """Store the next poll times from the poll_schedule_target()."""
+        with self.poll_schedule_target().open('r') as schedule_file:
+            next_polls = pd.read_csv(
+                schedule_file,
+                dtype={'post_key': str},
+                parse_dates=['next_poll'])
+        next_polls['poll_interval'] = pd.to_timedelta(
+            next_polls['poll_interval'])
+        self.poll_scheduler().store(next_polls)
+
     def encode_strings(self, df):
         r"""
         Apply necessary encodings to all string columns of the dataframe.
@@ -363,3 +400,110 @@ class PerformanceValueCondenser():
     @staticmethod
     def linear_delta(old_row, new_row):
         return (new_row - old_row).fillna(0).astype(int)
+
+
+class PerformancePollScheduler():
+    """
+    Decide which posts are due for polling their performance values.
+
+    Young posts are polled every hour, older posts in an interval that grows
+    with their age. Whenever the performance values of a post did not change
+    since its last poll, its interval is doubled. The next poll time of every
+    post is stored in the performance_poll table. All times are in UTC.
+    """
+
+    min_interval = dt.timedelta(hours=1)
+    max_interval = dt.timedelta(days=7)
+    # A post that is n days old is polled at least every n hours
+    age_ratio = 24
+    # Polls are not exactly one hour apart, so allow them to be a bit early
+    tolerance = dt.timedelta(minutes=10)
+
+    def __init__(self, db_connector, table):
+        super().__init__()
+        self.db_connector = db_connector
+        self.table = table
+        self.now = dt.datetime.utcnow()
+
+        # lazy properties
+        self._schedule = None
+
+    @property
+    def schedule(self) -> Dict[str, Tuple[dt.datetime, dt.timedelta]]:
+
+        if self._schedule is None:
+            self._schedule = {
+                post_key: (next_poll, poll_interval)
+                for post_key, next_poll, poll_interval
+                in self.db_connector.query('''
+                    SELECT post_key, next_poll, poll_interval
+                    FROM performance_poll
+                    WHERE performance_table = %s
+                ''', self.table)
+            }
+        return self._schedule
+
+    def is_due(self, post_keys: List[str]) -> List[bool]:
+        """Tell for each post whether it should be polled now."""
+        return [
+            post_key not in self.schedule
+            or self.schedule[post_key][0] <= self.now + self.tolerance
+            for post_key in post_keys
+        ]
+
+    def next_polls(
+            self,
+            post_keys: List[str],
+            post_dates: List[dt.datetime],
+            changed_post_keys: List[str]) -> pd.DataFrame:
+        """
+        Compute the next poll times of all polled posts.
+
+        post_dates must be in UTC. changed_post_keys are the posts whose
+        performance values have changed, i.e., that were not dropped by
+        condense_performance_values(). Pass the result to store() once the
+        performance values have been stored.
+        """
+        changed_post_keys = set(changed_post_keys)
+        intervals = []
+        for post_key, post_date in zip(post_keys, post_dates):
+            interval = min(self.max_interval, max(
+                self.min_interval,
+                (self.now - post_date) / self.age_ratio))
+            if post_key not in changed_post_keys \
+                    and post_key in self.schedule:
+                interval = max(interval, min(
+                    self.max_interval,
+                    self.schedule[post_key][1] * 2))
+            intervals.append(interval)
+        logger.info(f"Rescheduling {len(intervals)} posts for {self.table}, "
+                    f"{len(changed_post_keys)} of them have changed")
+        return pd.DataFrame({
+            'post_key': list(post_keys),
+            'next_poll': [self.now + interval for interval in intervals],
+            'poll_interval': intervals
+        }, columns=['post_key', 'next_poll', 'poll_interval'])
+
+    def store(self, next_polls: pd.DataFrame):
+        """Store the next poll times computed by next_polls()."""
+        queries = [
+            ('''
+                INSERT INTO performance_poll
+                    (performance_table, post_key, next_poll, poll_interval)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (performance_table, post_key) DO UPDATE
+                    SET next_poll = EXCLUDED.next_poll,
+                        poll_interval = EXCLUDED.poll_interval
+            ''', (
+                self.table,
+                post_key,
+                pd.Timestamp(next_poll).to_pydatetime(),
+                pd.Timedelta(poll_interval).to_pytimedelta()
+            ))
+            for post_key, next_poll, poll_interval in zip(
+                next_polls['post_key'],
+                next_polls['next_poll'],
+                next_polls['poll_interval'])
+        ]
+        if queries:
+            self.db_connector.execute(*queries)
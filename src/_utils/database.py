@@ -154,7 +154,15 @@ class CsvToDb(CopyToTable):
                     DO UPDATE SET {', '.join(
                         f'{column[0]} = EXCLUDED.{column[0]}'
                         for column in self.columns
-                    )};
+                    )}
+                    -- Don't touch rows that have not changed
+                    WHERE ({', '.join(
+                        f'{table}.{column[0]}'
+                        for column in self.columns
+                    )}) IS DISTINCT FROM ({', '.join(
+                        f'EXCLUDED.{column[0]}'
+                        for column in self.columns
+                    )});
                 {f"""
                 DELETE FROM {table}
                     WHERE NOT EXISTS (
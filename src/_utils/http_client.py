@@ -0,0 +1,284 @@
+"""
+Provides a shared HTTP client for all tasks that fetch data from the web.
+
+All requests to the same host share a keep-alive session. Failed requests
+(connection errors, timeouts, and HTTP 429 or 5xx) are repeated with a
+jittered exponential backoff, respecting any Retry-After header. For the
+Facebook Graph API, the rate limit usage reported in the X-App-Usage and
+X-Business-Use-Case-Usage headers is used to adapt the number of concurrent
+requests to the host. Per-host metrics are written to the log after every
+task that sent any requests.
+"""
+
+from contextlib import contextmanager
+import email.utils
+import json
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import luigi
+import requests
+import requests.adapters
+
+import _utils
+
+logger = _utils.logger
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 1  # seconds
+BACKOFF_MAX = 60  # seconds
+
+# Rate limit usage (in percent) above which concurrency is reduced
+HIGH_USAGE = 75
+# Rate limit usage (in percent) below which concurrency is increased again
+LOW_USAGE = 50
+
+
+def get(url, **kwargs) -> requests.Response:
+    """Send a GET request. See request()."""
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs) -> requests.Response:
+    """Send a POST request. See request()."""
+    return request('POST', url, **kwargs)
+
+
+def request(method, url, attempts=4, **kwargs) -> requests.Response:
+    """
+    Send a request using the shared session of the host.
+
+    Transient failures are retried up to attempts times in total. Unlike
+    requests.request(), the response of the last attempt is answered even if
+    it failed, so callers still need to check its status. All other kwargs
+    are passed to requests.
+    """
+    host = _host(url)
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        with host.slot():
+            start = time.perf_counter()
+            try:
+                response = host.session.request(method, url, **kwargs)
+            except requests.RequestException as error:
+                host.record(time.perf_counter() - start, error=True)
+                if last_attempt:
+                    raise
+                logger.warning(
+                    f"Request to {host.name} failed, retrying: {error}")
+            else:
+                host.record(
+                    time.perf_counter() - start,
+                    error=not response.ok)
+                host.adapt(response)
+                if response.status_code not in RETRY_STATUS_CODES \
+                        or last_attempt:
+                    return response
+                logger.warning(
+                    f"Request to {host.name} failed with HTTP "
+                    f"{response.status_code}, retrying")
+        with host.condition:
+            host.retries += 1
+        time.sleep(backoff(attempt))
+
+
+def configure_host(
+        host: str,
+        max_concurrency: Optional[int] = None,
+        min_interval: Optional[float] = None,
+        burst: Optional[int] = None):
+    """
+    Configure the limits for all requests to the given host.
+
+    max_concurrency is the maximum number of requests in flight. Requests are
+    started according to a token bucket: min_interval is the number of
+    seconds until a new token is available, and up to burst tokens can be
+    saved up and spent at once. By default, burst is 1, so min_interval is
+    the minimum number of seconds between the start of two requests.
+    """
+    host = _host(f'//{host}')
+    with host.condition:
+        if max_concurrency is not None:
+            host.max_concurrency = host.concurrency = max_concurrency
+        if min_interval is not None:
+            host.min_interval = min_interval
+        if burst is not None:
+            host.burst = host.tokens = burst
+
+
+def backoff(attempt: int) -> float:
+    """Answer a random delay in seconds before repeating a request."""
+    return random.uniform(  # nosec - no cryptographic purpose
+        0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Answer the number of seconds to wait from a Retry-After header."""
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, date.timestamp() - time.time())
+
+
+def parse_usage(headers) -> Tuple[Optional[float], float]:
+    """
+    Answer the rate limit usage reported by the Facebook Graph API.
+
+    Answer the highest usage (in percent) of any limit (or None if it is not
+    reported) and the number of seconds until the access is regained.
+    """
+    usages = []
+    regain_seconds = 0
+    try:
+        if 'X-App-Usage' in headers:
+            usages.extend(json.loads(headers['X-App-Usage']).values())
+        if 'X-Business-Use-Case-Usage' in headers:
+            business_usage = json.loads(headers['X-Business-Use-Case-Usage'])
+            for use_cases in business_usage.values():
+                for use_case in use_cases:
+                    usages.extend(
+                        use_case.get(key, 0)
+                        for key in ['call_count', 'total_cputime',
+                                    'total_time'])
+                    regain_seconds = max(
+                        regain_seconds,
+                        use_case.get('estimated_time_to_regain_access', 0)
+                        * 60)
+    except (ValueError, AttributeError, TypeError) as error:
+        logger.warning(f"Failed to parse rate limit usage: {error}")
+    return (max(usages) if usages else None), regain_seconds
+
+
+def log_metrics():
+    """Write the metrics of all hosts to the log and reset them."""
+    with _hosts_lock:
+        hosts = list(_hosts.values())
+    for host in hosts:
+        with host.condition:
+            if not host.requests:
+                continue
+            logger.info(
+                f"HTTP {host.name}: {host.requests} requests, "
+                f"{host.errors} errors, {host.retries} retries, "
+                f"{host.latency / host.requests:.2f} s average latency")
+            host.requests = host.errors = host.retries = 0
+            host.latency = 0.0
+
+
+class _Host:
+    """The shared session, limits, and metrics of a single host."""
+
+    def __init__(self, name, max_concurrency=8):
+
+        self.name = name
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.condition = threading.Condition()
+        self.max_concurrency = self.concurrency = max_concurrency
+        self.min_interval = 0.0
+        self.burst = self.tokens = 1
+        self.last_refill = 0.0  # time.monotonic()
+        self.paused_until = 0.0  # time.monotonic()
+        self.active = 0
+
+        self.requests = self.errors = self.retries = 0
+        self.latency = 0.0
+
+    @contextmanager
+    def slot(self):
+        """Wait for a free request slot and occupy it during the context."""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                delay = max(
+                    self.paused_until - now,
+                    (1 - self.tokens) * self.min_interval)
+                if self.active < self.concurrency and delay <= 0:
+                    break
+                self.condition.wait(delay if delay > 0 else None)
+            self.active += 1
+            self.tokens -= 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify_all()
+
+    def _refill(self, now):
+
+        if self.min_interval:
+            self.tokens = min(
+                self.burst,
+                self.tokens + (now - self.last_refill) / self.min_interval)
+        else:
+            self.tokens = self.burst
+        self.last_refill = now
+
+    def record(self, latency, error):
+
+        with self.condition:
+            self.requests += 1
+            self.errors += error
+            self.latency += latency
+
+    def adapt(self, response: requests.Response):
+        """Adapt the limits to the rate limit state reported by the host."""
+        pause = parse_retry_after(response.headers) \
+            if response.status_code in RETRY_STATUS_CODES else None
+        usage, regain_seconds = parse_usage(response.headers)
+
+        with self.condition:
+            if usage is not None:
+                if usage >= HIGH_USAGE:
+                    self.concurrency = max(1, self.concurrency // 2)
+                    logger.warning(
+                        f"Rate limit usage of {self.name} is at "
+                        f"{usage}%, reducing concurrency to "
+                        f"{self.concurrency}")
+                elif usage < LOW_USAGE:
+                    self.concurrency = min(
+                        self.max_concurrency, self.concurrency + 1)
+                if usage >= 100:
+                    pause = max(pause or 0, regain_seconds, BACKOFF_MAX)
+            if pause:
+                logger.warning(
+                    f"Pausing requests to {self.name} for {pause:.0f} s")
+                self.paused_until = max(
+                    self.paused_until, time.monotonic() + pause)
+            self.condition.notify_all()
+
+
+_hosts: Dict[str, _Host] = {}
+_hosts_lock = threading.Lock()
+
+
+def _host(url) -> _Host:
+
+    name = urlparse(url).netloc
+    with _hosts_lock:
+        if name not in _hosts:
+            _hosts[name] = _Host(name)
+        return _hosts[name]
+
+
+@luigi.Task.event_handler(luigi.Event.SUCCESS)
+@luigi.Task.event_handler(luigi.Event.FAILURE)
+def _log_metrics_after_task(task, *args):
+
+    log_metrics()
@@ -0,0 +1,142 @@
+"""Provides an in-memory matcher to find target aspect words in posts."""
+
+from collections import defaultdict
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class AspectMatcher:
+    """
+    Find phrases in word sequences that match any target aspect word.
+
+    All target aspect words are compiled into a trie over their lowercased
+    words once, so every sequence can be scanned for exact matches in a single
+    pass. For fuzzy matching, target words are indexed by their length, so
+    only candidates that could possibly satisfy the threshold have to be
+    compared using the Levenshtein distance.
+
+    All matches are returned as dicts mapping (position, aspect_id) to the
+    matched target aspect word. If multiple words of the same aspect match at
+    the same position, the lexicographically smallest one is chosen.
+    """
+
+    # Key of the aspects that end at a trie node. Tokens are always strings,
+    # so this key cannot collide with any child node.
+    _LEAF = None
+
+    def __init__(
+            self,
+            aspect_words: Iterable[Tuple[int, str]],
+            n_max: int = 4):
+
+        self.n_max = n_max
+        self.trie = {}
+        self.words_by_length = defaultdict(list)
+
+        for aspect_id, word in aspect_words:
+            lower = word.lower()
+            self.words_by_length[len(lower)].append((lower, aspect_id, word))
+
+            tokens = lower.split(' ')
+            if len(tokens) > n_max:
+                continue
+            node = self.trie
+            for token in tokens:
+                node = node.setdefault(token, {})
+            node.setdefault(self._LEAF, []).append((aspect_id, word))
+
+    def match_exact(self, words: List[str]) -> Dict[Tuple[int, int], str]:
+        """Find all phrases that equal a target aspect word."""
+        words = [word.lower() for word in words]
+        matches = {}
+        for start in range(len(words)):
+            node = self.trie
+            for word in words[start:start + self.n_max]:
+                node = node.get(word)
+                if node is None:
+                    break
+                for aspect_id, aspect_word in node.get(self._LEAF, ()):
+                    _add_match(matches, start, aspect_id, aspect_word)
+        return matches
+
+    def match_levenshtein(
+            self,
+            words: List[str],
+            threshold: float,
+            max_length: int = 255) -> Dict[Tuple[int, int], str]:
+        """
+        Find all phrases that are similar to a target aspect word.
+
+        The similarity of a phrase and a target word is measured as their
+        Levenshtein distance relative to the length of the phrase. For every
+        position, only the aspects with the best similarity are returned.
+        """
+        words = [word.lower() for word in words]
+        matches = {}
+        for start in range(len(words)):
+            best_value, best_matches = math.inf, []
+            last_end = min(start + self.n_max, len(words))
+            for end in range(start + 1, last_end + 1):
+                phrase = ' '.join(words[start:end])
+                length = len(phrase)
+                if length > max_length:
+                    break
+                max_distance = math.floor(threshold * length)
+                for candidate_length in range(
+                        length - max_distance,
+                        length + max_distance + 1):
+                    for lower, aspect_id, aspect_word \
+                            in self.words_by_length.get(candidate_length, ()):
+                        distance = levenshtein_distance(
+                            phrase, lower, max_distance)
+                        if distance is None:
+                            continue
+                        value = distance / length
+                        if value < best_value:
+                            best_value, best_matches = value, []
+                        if value == best_value:
+                            best_matches.append((aspect_id, aspect_word))
+            for aspect_id, aspect_word in best_matches:
+                _add_match(matches, start, aspect_id, aspect_word)
+        return matches
+
+
+def levenshtein_distance(
+        a: str,
+        b: str,
+        max_distance: Optional[int] = None) -> Optional[int]:
+    """
+    Compute the Levenshtein distance between two strings.
+
+    If max_distance is given, the computation is stopped as soon as the
+    distance is known to exceed it, and None is returned in this case.
+    """
+    if max_distance is None:
+        max_distance = max(len(a), len(b))
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    if len(a) < len(b):
+        a, b = b, a
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            ))
+        if min(current) > max_distance:
+            return None
+        previous = current
+
+    distance = previous[-1]
+    return distance if distance <= max_distance else None
+
+
+def _add_match(matches, position, aspect_id, aspect_word):
+
+    key = (position, aspect_id)
+    if key not in matches or aspect_word < matches[key]:
+        matches[key] = aspect_word
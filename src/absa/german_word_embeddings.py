@@ -1,8 +1,10 @@
 """Provides tasks to fetch German word embeddings model data."""
 
+from functools import lru_cache
 import logging
 from urllib.request import urlopen
 
+import gensim
 import luigi
 from luigi.format import Nop
 
@@ -12,6 +14,48 @@ logger = logging.getLogger('luigi-interface')
 
 
 class FetchGermanWordEmbeddings(DataPreparationTask):
+    """
+    Provide the German word embeddings in gensim's native format.
+
+    The original model is distributed in the binary word2vec format which
+    has to be parsed completely whenever it is loaded. Instead, we convert it
+    once into gensim's native format where the vectors are stored as a
+    separate numpy array. This allows consumers to memory-map the vectors (see
+    load_word_embeddings()) so loading is almost instantaneous and multiple
+    workers can share the same pages.
+    """
+
+    def requires(self):
+
+        return DownloadGermanWordEmbeddings()
+
+    def output(self):
+
+        # The vectors are stored next to this file as
+        # german_word_embeddings.kv.vectors.npy. Both files are cached in
+        # secret_files because they are about 600 MB large.
+        return luigi.LocalTarget(
+            'secret_files/absa/german_word_embeddings.kv',
+            format=Nop
+        )
+
+    def run(self):
+
+        logger.info("Converting german_word_embeddings")
+        model = gensim.models.KeyedVectors.load_word2vec_format(
+            self.input().path,
+            binary=True
+        )
+
+        # NB: gensim writes the separate vector file before the main file, so
+        # the output will only exist once the conversion has been completed.
+        # Always store the vectors separately to enable memory mapping.
+        model.save(self.output().path, sep_limit=0)
+
+        logger.info("Conversion of german_word_embeddings completed.")
+
+
+class DownloadGermanWordEmbeddings(DataPreparationTask):
 
     url = 'http://cloud.devmount.de/d2bc5672c523b086/german.model'
 
@@ -40,3 +84,15 @@ class FetchGermanWordEmbeddings(DataPreparationTask):
                     break
 
         logger.info("Fetching of german_word_embeddings completed.")
+
+
+@lru_cache(maxsize=None)
+def load_word_embeddings(path) -> gensim.models.KeyedVectors:
+    """
+    Load a word embeddings model stored by FetchGermanWordEmbeddings.
+
+    The vectors are memory-mapped read-only, so the model must not be
+    modified. Models are cached per worker process, so multiple tasks using
+    the same model will share it.
+    """
+    return gensim.models.KeyedVectors.load(path, mmap='r')
@@ -8,17 +8,18 @@ the phrase "leider" (ger.: "I'm afraid", "what a pity") will rather be tagged
 with a low polarity value near -1.0.
 """
 
-from io import BytesIO, TextIOWrapper
+import hashlib
+from io import TextIOWrapper
+import os
+from urllib.parse import urlparse
 from urllib.request import urlopen
 from zipfile import ZipFile
 
 import luigi
-from luigi.format import UTF8
+from luigi.format import Nop, UTF8
 import pandas as pd
-import regex
 
-from .post_words import regex_compile
-from _utils import CsvToDb, DataPreparationTask
+from _utils import CsvToDb, DataPreparationTask, logger
 
 
 class PhrasePolaritiesToDb(luigi.WrapperTask):
@@ -30,7 +31,27 @@ class PhrasePolaritiesToDb(luigi.WrapperTask):
         yield SeplToDb()
 
 
-class SentiWsToDb(CsvToDb):
+class LexiconToDb(CsvToDb):
+    """
+    The abstract superclass for tasks storing a static lexicon into the DB.
+
+    Lexicons only change when their source file changes. Thus, every load is
+    identified by the checksum of the source file, and the task is complete
+    as soon as the same version of the lexicon has been loaded before. To
+    enforce a reload, delete the cached source file.
+    """
+
+    @property
+    def update_id(self):
+
+        checksum = self.requires().checksum()
+        if not checksum:
+            # Source not yet available, cannot be complete
+            return super().update_id
+        return f'{self.table}_{checksum}'
+
+
+class SentiWsToDb(LexiconToDb):
     """Store the SentiWS dataset for phrase polarities into the database."""
 
     table = 'absa.phrase_polarity_sentiws'
@@ -40,7 +61,7 @@ class SentiWsToDb(CsvToDb):
         return FetchSentiWs()
 
 
-class SeplToDb(CsvToDb):
+class SeplToDb(LexiconToDb):
     """Store the SePL dataset for phrase polarities into the database."""
 
     table = 'absa.phrase_polarity_sepl'
@@ -55,7 +76,12 @@ class FetchSentiWs(DataPreparationTask):
     Download and process the SentiWS dataset for phrase polarities.
 
     Processing includes unzipping the download file and parsing the
-    proprietary file format.
+    proprietary file format. Every line of the format looks like this:
+
+        word|POS_TAG<TAB>weight[<TAB>inflection,inflection,...]
+
+    Inflections are stored as an array within the polarity table and are
+    exposed to the inflection view of the database from there.
     """
 
     url = luigi.Parameter(
@@ -63,24 +89,9 @@ class FetchSentiWs(DataPreparationTask):
         'SentiWS/SentiWS_v2.0.zip'
     )
 
-    format_float = regex.compile(r'[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?')
-
-    format = regex_compile(rf'''
-            ^
-            (?<word>\p{{L}}+)
-            \|
-            (?<pos_tag>[A-Z]+)
-            \t
-            (?<weight>{format_float.pattern})
-            \t?
-            ((?<=\t)
-                (?<inflection>\p{{L}}+)
-                (\s*,\s*
-                    (?<inflection>\p{{L}}+)
-                )*
-            )?
-            $
-        ''')
+    def requires(self):
+
+        return DownloadLexicon(url=self.url)
 
     def output(self):
         return luigi.LocalTarget(
@@ -90,17 +101,20 @@ class FetchSentiWs(DataPreparationTask):
 
     def run(self):
 
-        response = urlopen(self.url)
-        archive = ZipFile(BytesIO(response.read()))
-        rows = self.load_polarities(archive)
-        df = pd.DataFrame(
-            rows,
-            columns=['word', 'pos_tag', 'weight', 'inflections']
-        )
+        with ZipFile(self.input().path) as archive:
+            rows = self.load_polarities(archive)
+            df = pd.DataFrame(
+                rows,
+                columns=['word', 'pos_tag', 'weight', 'inflections']
+            )
 
         with self.output().open('w') as output:
             df.to_csv(output, index=False)
 
+    def checksum(self):
+
+        return self.requires().checksum()
+
     def load_polarities(self, archive):
 
         for way in ['Positive', 'Negative']:
@@ -111,12 +125,17 @@ class FetchSentiWs(DataPreparationTask):
 
     def load_polarity(self, line):
 
-        match = self.format.search(line)
+        entry, weight, *inflections = line.rstrip('\r\n').split('\t')
+        word, pos_tag = entry.split('|')
         return dict(
-            word=match.group('word'),
-            pos_tag=match.group('pos_tag'),
-            weight=float(match.group('weight')),
-            inflections=match.captures('inflection')
+            word=word,
+            pos_tag=pos_tag,
+            weight=float(weight),
+            inflections=[
+                inflection.strip()
+                for inflection in ','.join(inflections).split(',')
+                if inflection.strip()
+            ]
         )
 
 
@@ -174,3 +193,71 @@ class FetchSepl(DataPreparationTask):
         if value == 'm':
             return True
         raise ValueError(f"Unknow manual_correction: {value}")
+
+    def checksum(self):
+
+        if not self.input().exists():
+            return None
+        return file_checksum(self.input().path)
+
+
+class DownloadLexicon(DataPreparationTask):
+    """
+    Download a lexicon file and cache it in the secret_files folder.
+
+    Lexicons are static datasets, so they are only downloaded once. The cached
+    file is keyed by the URL, and its checksum is stored next to it.
+    """
+
+    url = luigi.Parameter(description="The URL of the lexicon file")
+
+    def output(self):
+
+        url_hash = hashlib.sha256(self.url.encode()).hexdigest()[:16]
+        name = os.path.basename(urlparse(self.url).path)
+        return luigi.LocalTarget(
+            f'secret_files/absa/lexicons/{url_hash}_{name}',
+            format=Nop
+        )
+
+    def run(self):
+
+        logger.info(f"Downloading lexicon from {self.url}")
+        response = urlopen(self.url)
+        checksum = hashlib.sha256()
+        with self.output().open('wb') as output:
+            # Use blocks to reduce required RAM.
+            while True:
+                data = response.read(4096)
+                if not data:
+                    break
+                checksum.update(data)
+                output.write(data)
+
+        with self.checksum_target().open('w') as stream:
+            stream.write(checksum.hexdigest())
+
+    def checksum(self):
+
+        if not self.complete():
+            return None
+        target = self.checksum_target()
+        if not target.exists():
+            # Cache from an older version, compute checksum once
+            with target.open('w') as stream:
+                stream.write(file_checksum(self.output().path))
+        with target.open('r') as stream:
+            return stream.read().strip()
+
+    def checksum_target(self):
+
+        return luigi.LocalTarget(f'{self.output().path}.sha256', format=UTF8)
+
+
+def file_checksum(path):
+    """Compute the SHA-256 checksum of the file at the given path."""
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for block in iter(lambda: stream.read(4096), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
@@ -2,10 +2,14 @@
 
 import luigi
 from luigi.format import UTF8
+import pandas as pd
 
-from _utils import CsvToDb, ConcatCsvs, QueryDb
+from _utils import CsvToDb, ConcatCsvs, DataPreparationTask, QueryDb
+from .aspect_matching import AspectMatcher
 from .post_ngrams import PostNgramsToDb
-from .target_aspects import TargetAspectsToDb
+from .post_words import PostWordsToDb
+from .stopwords import StopwordsToDb
+from .target_aspects import ConvertTargetAspectWords, TargetAspectsToDb
 
 
 class PostAspectsToDb(CsvToDb):
@@ -26,9 +30,11 @@ class CollectPostAspects(ConcatCsvs):
     """
 
     def requires(self):
-        yield CollectPostAspectsEquality(table=self.table)
+        # Equality and levenshtein are matched in memory (see
+        # MatchPostAspects). CollectPostAspectsEquality and
+        # CollectPostAspectsLevenshtein remain as the reference implementation.
+        yield MatchPostAspects(table=self.table)
         yield CollectPostAspectsTrigram(table=self.table)
-        yield CollectPostAspectsLevenshtein(table=self.table)
 
     def output(self):
         return luigi.LocalTarget(
@@ -37,6 +43,118 @@ class CollectPostAspects(ConcatCsvs):
         )
 
 
+class MatchPostAspects(DataPreparationTask):
+    """
+    Find all known aspects in posts using an in-memory matcher.
+
+    This is equivalent to the equality and levenshtein algorithms of
+    CollectPostAspectsAlgorithm, but instead of comparing every n-gram to
+    every target aspect word in the database, all target aspect words are
+    compiled into an AspectMatcher and the words of every post are scanned
+    only once. Like for absa.post_ngram, phrases neither span stopwords nor
+    sentences.
+    """
+
+    n_max = luigi.IntParameter(
+        default=4,
+        description="Maximum length of matched phrases")
+
+    word_table = 'absa.post_word'
+    stopword_table = 'absa.stopword'
+
+    levenshtein_threshold = 0.19
+
+    def _requires(self):
+
+        return luigi.task.flatten([
+            PostWordsToDb(),
+            StopwordsToDb(),
+            TargetAspectsToDb(),
+            super()._requires()
+        ])
+
+    def requires(self):
+
+        yield ConvertTargetAspectWords()
+        yield QueryDb(query=f'''
+            WITH
+                new_post_id AS (
+                    SELECT post_id
+                    FROM post
+                    WHERE post_date > ANY(
+                        SELECT max(post_date)
+                        FROM {self.table}
+                        NATURAL JOIN post
+                    ) IS NOT FALSE
+                )
+            SELECT  source, post_id, sentence_index, word_index, word
+            FROM    {self.word_table}
+            WHERE   post_id IN (SELECT * FROM new_post_id)
+            AND     word NOT IN (
+                SELECT word
+                FROM {self.stopword_table}
+            )
+            ORDER BY source, post_id, sentence_index, word_index
+        ''')
+
+    def output(self):
+
+        return luigi.LocalTarget(
+            f'{self.output_dir}/absa/post_aspects_matched.csv',
+            format=UTF8
+        )
+
+    def run(self):
+
+        aspect_words, post_words = self.input()
+        with aspect_words.open('r') as stream:
+            aspect_words = pd.read_csv(stream)
+        with post_words.open('r') as stream:
+            post_words = pd.read_csv(
+                stream,
+                dtype={'source': str, 'post_id': str, 'word': str},
+                keep_default_na=False
+            )
+
+        matcher = AspectMatcher(
+            zip(aspect_words['aspect_id'], aspect_words['word']),
+            n_max=self.n_max
+        )
+
+        # Split words into sequences of adjacent words
+        keys = post_words[['source', 'post_id', 'sentence_index']]
+        sequence_ids = (
+            (keys != keys.shift()).any(axis=1)
+            | (post_words['word_index'].diff() != 1)
+        ).cumsum()
+
+        rows = []
+        for _, sequence in self.tqdm(
+                post_words.groupby(sequence_ids, sort=False),
+                desc="Matching post aspects"):
+            source = sequence['source'].iat[0]
+            post_id = sequence['post_id'].iat[0]
+            word_indices = sequence['word_index'].tolist()
+            words = sequence['word'].tolist()
+            for algorithm, matches in [
+                    ('equality', matcher.match_exact(words)),
+                    ('levenshtein', matcher.match_levenshtein(
+                        words, self.levenshtein_threshold))]:
+                for (position, aspect_id), aspect_word in matches.items():
+                    rows.append((
+                        source, post_id, word_indices[position], aspect_id,
+                        aspect_word, algorithm
+                    ))
+
+        df = pd.DataFrame(rows, columns=[
+            'source', 'post_id', 'word_index', 'aspect_id', 'aspect_word',
+            'match_algorithm'
+        ])
+
+        with self.output().open('w') as stream:
+            df.to_csv(stream, index=False, header=True)
+
+
 class CollectPostAspectsAlgorithm(QueryDb):
     """
     The abstract superclass for all post-search query algorithms.
@@ -1,28 +1,30 @@
 """Provides tasks for assessing the opinion of posts based on patterns."""
 
+from functools import lru_cache
+from itertools import islice
 import json
 import logging
+from typing import Dict, List
 
-import gensim
 import luigi
-from luigi.format import UTF8
+from luigi.format import Nop, UTF8
 import numpy as np
 import pandas as pd
 from sklearn.cluster import DBSCAN
 import spacy
-from tqdm import tqdm
+from spacy.language import Language
+from spacy.tokens import DocBin
 
 from _posts import PostsToDb
 from _utils import (
     ConcatCsvs, CsvToDb, DataPreparationTask, JsoncToJson, QueryDb)
-from .german_word_embeddings import FetchGermanWordEmbeddings
+from .german_word_embeddings import (
+    FetchGermanWordEmbeddings, load_word_embeddings)
 from .phrase_polarity import PhrasePolaritiesToDb
 
 
 logger = logging.getLogger('luigi-interface')
 
-tqdm.pandas()
-
 
 class PostOpinionSentimentsToDb(CsvToDb):
 
@@ -105,10 +107,7 @@ class GroupPostOpinionSentiments(DataPreparationTask):
         input_ = self.input()
         with input_[0].open() as stream:
             df = pd.read_csv(stream)
-        model = gensim.models.KeyedVectors.load_word2vec_format(
-            input_[1].path,
-            binary=True
-        )
+        model = load_word_embeddings(input_[1].path)
         return df, model
 
     def group_data(self, raw):
@@ -127,14 +126,13 @@ class GroupPostOpinionSentiments(DataPreparationTask):
         df = raw.copy()
 
         logger.info("Computing word vectors ...")
-        df['vec'] = df['aspect_phrase'].progress_apply(self.word2vec)
-        df = df.dropna(subset=['vec'])
+        df, vectors = self.word_vectors(df)
 
         logger.info("Clustering aspect phrases ...")
-        df = self.cluster_aspects(df)
+        df = self.cluster_aspects(df, vectors)
 
         logger.info("Labelling clusters ...")
-        df = self.label_clusters(df)
+        df = self.label_clusters(df, vectors)
 
         df = df.groupby([
             'source', 'post_id', 'dataset', 'target_aspect_words'
@@ -157,28 +155,49 @@ class GroupPostOpinionSentiments(DataPreparationTask):
         "ß": 'ss'
     })
 
-    def word2vec(self, word):
-
-        word = word.translate(self.word2vec_trans)
-        try:
-            return self.model.get_vector(word)
-        except KeyError:
-            return None
+    def word_vectors(self, df):
+        """
+        Look up the word vectors of all aspect phrases at once.
+
+        Answer the rows of df that could be found in the vocabulary together
+        with a matrix of the word vectors. The i-th row of the matrix belongs
+        to the i-th row of the answered DataFrame.
+        """
+        words = df['aspect_phrase'].str.translate(self.word2vec_trans)
+        codes, unique_words = pd.factorize(words)
+        vocab = self.model.vocab
+        unique_indices = np.array([
+            vocab[word].index if word in vocab else -1
+            for word in unique_words
+        ], dtype=int)
+        # NaN phrases are factorized to -1
+        indices = np.where(codes >= 0, unique_indices[codes], -1)
+
+        known = indices >= 0
+        return df[known].reset_index(drop=True), \
+            self.model.vectors[indices[known]]
 
     dbscan_eps, dbscan_minsamples = 0.37, 2
 
-    def cluster_aspects(self, df):
+    def cluster_aspects(self, df, vectors):
 
-        dbscan = DBSCAN(
-            metric='cosine',
-            eps=self.dbscan_eps,
-            min_samples=self.dbscan_minsamples
-        )
         if df.empty:
             logger.error("Did not receive any posts for grouping!")
             df['bin'] = []
+            df['vec_index'] = []
             return df
-        df['bin'] = dbscan.fit(list(df['vec'])).labels_
+
+        # For normalized vectors, the squared euclidean distance equals twice
+        # the cosine distance. In contrast to the cosine metric, this allows
+        # DBSCAN to use a ball tree instead of comparing all pairs of vectors.
+        dbscan = DBSCAN(
+            metric='euclidean',
+            algorithm='ball_tree',
+            eps=np.sqrt(2 * self.dbscan_eps),
+            min_samples=self.dbscan_minsamples
+        )
+        df['bin'] = dbscan.fit(normalize_rows(vectors)).labels_
+        df['vec_index'] = np.arange(len(df))
 
         is_noise = df['bin'] == -1
         noise, nonnoise = df[is_noise], df[~is_noise]
@@ -191,22 +210,63 @@ class GroupPostOpinionSentiments(DataPreparationTask):
 
     cluster_label_topn = 3
 
-    def label_clusters(self, df):
+    def label_clusters(self, df, vectors):
 
-        # NB: The tuple-array conversion is required because otherwise, pandas
-        # will send the aggregated DataFrame back to the lambda. Just don't
-        # touch it ¯\_(ツ)_/¯
-        bins = df.groupby('bin')[['vec']].agg(
-            lambda cluster: tuple(np.average(cluster))
-        )
-        bins['vec'] = bins['vec'].apply(np.array)
-        bins['target_aspect_words'] = bins['vec'].apply(
-            lambda vec: next(zip(*self.model.similar_by_vector(
-                vec, topn=self.cluster_label_topn
-            )))
-        )
+        centroids = pd.DataFrame(
+            vectors[df['vec_index']]
+        ).groupby(df['bin'].to_numpy()).mean()
 
-        return df.merge(bins, on='bin')
+        bins = pd.DataFrame({
+            'bin': centroids.index,
+            'target_aspect_words': self.similar_words(
+                centroids.to_numpy(),
+                topn=self.cluster_label_topn
+            )
+        })
+
+        return df.drop(columns='vec_index').merge(bins, on='bin')
+
+    similar_words_chunk_size = 50000
+
+    def similar_words(self, vectors, topn):
+        """
+        Find the topn most similar words for each of the given vectors.
+
+        This is equivalent to calling similar_by_vector() of the model for
+        each vector, but scans the vocabulary only once for all vectors. The
+        vocabulary is normalized chunk-wise to avoid holding a normalized copy
+        of the whole model in memory.
+        """
+        queries = normalize_rows(vectors).astype(self.model.vectors.dtype)
+        topn = min(topn, len(self.model.vectors))
+        best_similarities = np.empty((len(queries), 0))
+        best_indices = np.empty((len(queries), 0), dtype=int)
+
+        for start in range(
+                0, len(self.model.vectors), self.similar_words_chunk_size):
+            chunk = self.model.vectors[
+                start:start + self.similar_words_chunk_size]
+            similarities = np.hstack([
+                best_similarities,
+                queries @ normalize_rows(chunk).T
+            ])
+            indices = np.hstack([
+                best_indices,
+                np.broadcast_to(
+                    np.arange(start, start + len(chunk)),
+                    (len(queries), len(chunk))
+                )
+            ])
+            top = np.argpartition(-similarities, topn - 1, axis=1)[:, :topn]
+            best_similarities = np.take_along_axis(similarities, top, axis=1)
+            best_indices = np.take_along_axis(indices, top, axis=1)
+
+        order = np.argsort(-best_similarities, axis=1)
+        best_indices = np.take_along_axis(best_indices, order, axis=1)
+        return [
+            tuple(self.model.index2word[index] for index in indices)
+            for indices in best_indices
+        ]
 
 
 class CollectPostOpinionSentiments(DataPreparationTask):
@@ -277,10 +337,26 @@ class CollectPostOpinionPhrases(DataPreparationTask):
 
     spacy_model = 'de_core_news_lg'
 
+    # Opinion patterns only respect POS tags, so we don't need to parse
+    # dependencies or entities
+    disabled_components = ('parser', 'ner')
+
+    # Token attributes to store for every cached doc
+    doc_attrs = ['TAG', 'POS']
+
     post_table = 'post'
 
     remove_stopwords = luigi.BoolParameter(True)
 
+    batch_size = luigi.IntParameter(
+        default=1000,
+        description="The number of posts to pass to spaCy at once")
+
+    n_process = luigi.IntParameter(
+        default=1,
+        description="The number of processes to parse posts with. If -1, "
+                    "all CPUs will be used.")
+
     def _requires(self):
 
         return luigi.task.flatten([
@@ -305,20 +381,26 @@ class CollectPostOpinionPhrases(DataPreparationTask):
             format=UTF8
         )
 
+    def doc_cache(self):
+        """Answer the target to persist the parsed docs of all posts in."""
+        # Parsing all posts takes quite a while, so keep the docs in
+        # secret_files rather than the output directory that is cleaned up
+        # after every run.
+        return luigi.LocalTarget(
+            f'secret_files/absa/post_docs_{self.spacy_model}.spacy',
+            format=Nop
+        )
+
     def run(self):
 
-        pattern_df, post_df = self.load_input()
+        patterns, post_df = self.load_input()
 
         logger.info("Analyzing posts ...")
         post_df = self.analyze_grammar(post_df)
         logger.info("Collecting opinion phrases ...")
-        post_pattern_df = self.collect_phrases(pattern_df, post_df)
+        post_pattern_df = self.collect_phrases(patterns, post_df)
 
         logger.info("Storing ...")
-        post_pattern_df = post_pattern_df[[
-            'source', 'post_id', 'pattern_name',
-            'aspect_phrase', 'sentiment_phrase'
-        ]]
         with self.output().open('w') as output:
             post_pattern_df.to_csv(output, index=False)
 
@@ -332,80 +414,114 @@ class CollectPostOpinionPhrases(DataPreparationTask):
         with input_[1].open() as stream:
             post_df = pd.read_csv(stream)
 
-        pattern_df = pd.DataFrame(
-            patterns.items(),
-            columns=['pattern_name', 'pattern']
-        )
-
-        return pattern_df, post_df
+        return patterns, post_df
 
     def analyze_grammar(self, post_df):
 
-        nlp = spacy.load(self.spacy_model)
+        nlp = load_spacy_model(self.spacy_model, self.disabled_components)
+        docs = self.parse_posts(nlp, post_df)
 
-        def nlp_cleanse(post):
+        def cleanse(doc):
             return [
                 token
-                for token in nlp(post)
+                for token in doc
                 if not (self.remove_stopwords and token.is_stop)
             ]
 
         return post_df.assign(
-            doc=lambda post:
-                post.text.progress_apply(nlp_cleanse)
+            doc=[cleanse(doc) for doc in docs]
         ).assign(
             pos_tags=lambda post:
                 post.doc.apply(lambda doc: [token.pos_ for token in doc])
         )
 
-    def collect_phrases(self, pattern_df, post_df):
-
-        post_pattern_df = cross_join(post_df, pattern_df)
-
-        post_pattern_df['tokens_list'] = post_pattern_df.apply(
-            lambda row: list(self.extract_opinions(row.pattern, row)),
-            axis=1
-        )
-        post_pattern_df = post_pattern_df.explode('tokens_list').dropna(
-            subset=['tokens_list']
-        ).rename(
-            columns={'tokens_list': 'tokens'}
-        )
-
-        post_pattern_df['aspect_phrase'] = post_pattern_df.apply(
-            lambda row: self.extract_segment(row.pattern, row, 'isAspect'),
-            axis=1
+    def parse_posts(self, nlp, post_df):
+        """
+        Parse the texts of all posts using spaCy.
+
+        Docs are cached across runs and only posts that are new or whose text
+        has changed are parsed again.
+        """
+        keys = list(zip(post_df['source'], post_df['post_id'].astype(str)))
+        texts = post_df['text'].tolist()
+
+        cached_docs = self.load_docs(nlp)
+        docs = [cached_docs.get(key) for key in keys]
+        missing = [
+            i
+            for i, (doc, text) in enumerate(zip(docs, texts))
+            if doc is None or doc.text != text
+        ]
+        if not missing:
+            return docs
+
+        parsed_docs = nlp.pipe(
+            (texts[i] for i in missing),
+            batch_size=self.batch_size,
+            n_process=self.n_process
         )
-        post_pattern_df['sentiment_phrase'] = post_pattern_df.apply(
-            lambda row: self.extract_segment(row.pattern, row, 'isSentiment'),
-            axis=1
-        )
-
-        post_pattern_df.drop('tokens', axis=1)
-        return post_pattern_df
-
-    def extract_opinions(self, pattern, post):
-
-        pattern_tags = [segment['pos'] for segment in pattern]
-        for index in find_subseqs(post.pos_tags, pattern_tags):
-            yield post.doc[index:index + len(pattern)]
-
-    def extract_segment(self, pattern, post, property_):
-
-        aspects = (
-            token
-            for token, segment
-            in zip(post.tokens, pattern)
-            if segment.get(property_, False)
+        for i, doc in zip(missing, self.tqdm(
+                parsed_docs,
+                total=len(missing),
+                desc=f"Parsing {len(missing)} new posts "
+                     f"({len(docs) - len(missing)} cached)")):
+            docs[i] = doc
+
+        self.store_docs(keys, docs)
+        return docs
+
+    def load_docs(self, nlp):
+        """Load all cached docs, mapped by the key of their post."""
+        cache = self.doc_cache()
+        if not cache.exists():
+            return {}
+        with cache.open('r') as stream:
+            doc_bin = DocBin(store_user_data=True).from_bytes(stream.read())
+        return {
+            (doc.user_data['source'], doc.user_data['post_id']): doc
+            for doc in doc_bin.get_docs(nlp.vocab)
+        }
+
+    def store_docs(self, keys, docs):
+        """Cache the given docs of all posts."""
+        doc_bin = DocBin(attrs=self.doc_attrs, store_user_data=True)
+        for (source, post_id), doc in zip(keys, docs):
+            doc.user_data['source'] = source
+            doc.user_data['post_id'] = post_id
+            doc_bin.add(doc)
+        with self.doc_cache().open('w') as stream:
+            stream.write(doc_bin.to_bytes())
+
+    def collect_phrases(self, patterns, post_df):
+
+        matcher = PosPatternMatcher(patterns)
+
+        matches = [
+            (
+                post_index, pattern_index, source, post_id, pattern_name,
+                doc[start + aspect_offset].text,
+                doc[start + sentiment_offset].text
+            )
+            for post_index, (source, post_id, doc, pos_tags) in enumerate(
+                zip(post_df['source'], post_df['post_id'], post_df['doc'],
+                    post_df['pos_tags'])
+            )
+            for (
+                start, pattern_index, pattern_name,
+                aspect_offset, sentiment_offset
+            ) in matcher.match(pos_tags)
+        ]
+        # Order phrases by post and pattern for the sake of reproducibility
+        matches.sort(key=lambda match: match[:2])
+
+        return pd.DataFrame(
+            [match[2:] for match in matches],
+            columns=[
+                'source', 'post_id', 'pattern_name',
+                'aspect_phrase', 'sentiment_phrase'
+            ]
         )
 
-        aspect = next(aspects)
-        try:
-            next(aspects)
-        except StopIteration:
-            return aspect
-        raise AssertionError("Multiple aspect words in pattern")
-
 
 class LoadOpinionPatterns(JsoncToJson):
 
@@ -424,25 +540,74 @@ class LoadOpinionPatterns(JsoncToJson):
         )
 
 
-def cross_join(df1, df2):
-    """Return the cross product of two DataFrames."""
-    magic_name = 'cross_join_side'
-    return pd.merge(
-        df1.assign(**{magic_name: None}),
-        df2.assign(**{magic_name: None}),
-        on=magic_name
-    ).drop(magic_name, axis=1)
+class PosPatternMatcher:
+    """
+    Find all occurrences of multiple POS tag patterns in tag sequences.
+
+    All patterns are compiled into a trie over their POS tags once, so every
+    tag sequence is scanned in a single pass regardless of the number of
+    patterns.
+    """
+
+    # Key of the patterns that end at a trie node. Tags are always strings,
+    # so this key cannot collide with any child node.
+    _LEAF = None
+
+    def __init__(self, patterns: Dict[str, List[dict]]):
+
+        self.trie = {}
+        for index, (name, pattern) in enumerate(patterns.items()):
+            node = self.trie
+            for segment in pattern:
+                node = node.setdefault(segment['pos'], {})
+            node.setdefault(self._LEAF, []).append((
+                index,
+                name,
+                self.segment_offset(pattern, 'isAspect'),
+                self.segment_offset(pattern, 'isSentiment')
+            ))
+
+    def match(self, tags: List[str]):
+        """
+        Find all occurrences of any pattern in the tag sequence.
+
+        Yield a tuple of the start index, the index and the name of the
+        pattern, and the offsets of the aspect and the sentiment segment.
+        """
+        for start in range(len(tags)):
+            node = self.trie
+            for tag in islice(tags, start, None):
+                node = node.get(tag)
+                if node is None:
+                    break
+                for match in node.get(self._LEAF, ()):
+                    yield (start, *match)
+
+    @staticmethod
+    def segment_offset(pattern, property_):
+        """Find the index of the only segment that has the property."""
+        offsets = [
+            offset
+            for offset, segment in enumerate(pattern)
+            if segment.get(property_, False)
+        ]
+        if len(offsets) != 1:
+            raise AssertionError(f"Pattern must have exactly one {property_}")
+        return offsets[0]
 
 
-def find_subseqs(seq, sub):
+@lru_cache(maxsize=None)
+def load_spacy_model(name, disable=()) -> Language:
     """
-    Find all subsequences of seq that equal sub.
+    Load a spaCy model with the given pipeline components disabled.
 
-    Yield the index of each match.
+    Models are cached per worker process, so multiple tasks using the same
+    model will share it. The model must not be modified.
     """
-    if not isinstance(seq, list):
-        return find_subseqs(list(seq), sub)
-    n = len(sub)
-    for i in range(len(seq) - n + 1):
-        if sub == seq[i:i + n]:
-            yield i
+    return spacy.load(name, disable=disable)
+
+
+def normalize_rows(matrix):
+    """Scale all rows of the matrix to unit length."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
@@ -1,9 +1,10 @@
 """Provides tasks for downloading all Apple App Store reviews about the app."""
 
+from concurrent.futures import ThreadPoolExecutor
 import datetime as dt
 import json
 import random
-from time import sleep
+import zlib
 
 import luigi
 from luigi.format import UTF8
@@ -12,6 +13,7 @@ import requests
 import xmltodict
 
 from _utils import CsvToDb, DataPreparationTask, MuseumFacts, logger
+from _utils import http_client
 
 
 class AppstoreReviewsToDb(CsvToDb):
@@ -27,18 +29,37 @@ class FetchAppstoreReviews(DataPreparationTask):
     """
     Download all reviews related to the museum app from the Apple App Store.
 
-    The data is accessed by scanning an RSS feed.
+    The data is accessed by scanning an RSS feed. Countries are fetched
+    concurrently, but all requests share the same rate limit. Feeds are
+    sorted by date, so paging stops at the first reviews that are already
+    stored. Most countries never have any reviews, so countries without
+    any stored reviews are only probed every empty_country_probe_days.
+    During a full resync, all reviews of all countries are fetched again.
     """
 
     table = 'appstore_review'
 
+    full_resync = luigi.BoolParameter(
+        default=False,
+        description="fetch all reviews again to update edited reviews")
+    # Do a full resync every Sunday anyway
+    full_resync_weekday = 6
+
     requests_per_minute = 20
+    request_burst = 5
+    max_workers = 4
+    empty_country_probe_days = 30
     worker_timeout = 1200
 
     def __init__(self, *args, **kwargs):
 
         super().__init__(*args, **kwargs)
-        self.latest_request_time = dt.datetime.min
+        http_client.configure_host(
+            'itunes.apple.com',
+            max_concurrency=self.max_workers,
+            min_interval=60 / self.requests_per_minute,
+            burst=self.request_burst)
+        self.known_review_ids = set()
 
     def requires(self):
 
@@ -65,22 +86,32 @@ class FetchAppstoreReviews(DataPreparationTask):
             country_codes = country_codes[random_num:random_num + 2]
             country_codes.append('CA')
 
-        tbar = self.tqdm(country_codes, desc="Fetching appstore reviews")
-        for country_code in tbar:
-            tbar.set_description(
-                f"Fetching appstore reviews ({country_code})"
-            )
-            try:
-                data_for_country = self.fetch_for_country(country_code)
+        known_reviews = []
+        if not (self.full_resync
+                or dt.date.today().weekday() == self.full_resync_weekday):
+            known_reviews = self.db_connector.query(f'''
+                SELECT review_id, country_code
+                FROM appstore_review
+                WHERE app_id = '{self.get_app_id()}'
+            ''')
+        self.known_review_ids = {review_id for review_id, _ in known_reviews}
+        known_country_codes = {
+            country_code for _, country_code in known_reviews}
+        if known_country_codes:
+            country_codes = [
+                country_code
+                for country_code in country_codes
+                if country_code in known_country_codes
+                or self.is_probe_due(country_code)
+            ]
+
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            for data_for_country in self.tqdm(
+                    executor.map(self.try_fetch_for_country, country_codes),
+                    total=len(country_codes),
+                    desc="Fetching appstore reviews"):
                 if not data_for_country.empty:
                     data.append(data_for_country)
-                logger.debug(f'Fetching appstore reviews for {country_code}')
-            except requests.HTTPError as error:
-                if error.response.status_code == 400:
-                    # not all countries are available
-                    pass
-                else:
-                    raise
         try:
             ret = pd.concat(data)
         except ValueError:
@@ -90,13 +121,42 @@ class FetchAppstoreReviews(DataPreparationTask):
 
     def get_country_codes(self):
 
-        return requests.get('http://country.io/names.json').json().keys()
+        country_codes_df = pd.read_csv(
+            'src/apple_appstore_country_codes.csv',
+            keep_default_na=False)  # 'NA' is Namibia
+        return country_codes_df['code'].to_list()
 
-    def fetch_for_country(self, country_code):
+    def get_app_id(self):
 
         with self.input().open('r') as facts_file:
             facts = json.load(facts_file)
-            app_id = facts['ids']['apple']['appId']
+        return facts['ids']['apple']['appId']
+
+    def is_probe_due(self, country_code):
+        """
+        Tell whether a country without any known reviews should be fetched.
+
+        Every country is probed once per empty_country_probe_days. The days
+        are spread evenly over all countries.
+        """
+        return zlib.crc32(country_code.encode()) \
+            % self.empty_country_probe_days \
+            == dt.date.today().toordinal() % self.empty_country_probe_days
+
+    def try_fetch_for_country(self, country_code):
+
+        logger.debug(f'Fetching appstore reviews for {country_code}')
+        try:
+            return self.fetch_for_country(country_code)
+        except requests.HTTPError as error:
+            if error.response.status_code == 400:
+                # not all countries are available
+                return pd.DataFrame([])
+            raise
+
+    def fetch_for_country(self, country_code):
+
+        app_id = self.get_app_id()
         url = (f'https://itunes.apple.com/{country_code}/rss/customerreviews/'
                f'page=1/id={app_id}/sortby=mostrecent/xml')
         data_list = []
@@ -105,6 +165,11 @@ class FetchAppstoreReviews(DataPreparationTask):
             try:
                 data, url = self.fetch_page(url)
                 data_list += data
+                if any(
+                        review['appstore_review_id'] in self.known_review_ids
+                        for review in data):
+                    # all further reviews are older and known as well
+                    break
             except requests.exceptions.HTTPError as error:
                 if error.response is not None and (
                     error.response.status_code == 503 or (
@@ -130,7 +195,7 @@ class FetchAppstoreReviews(DataPreparationTask):
 
     def fetch_page(self, url):
 
-        response = self.get_metered_request(url)
+        response = http_client.get(url)
         response.raise_for_status()
         # specify encoding explicitly because the autodetection fails sometimes
         response.encoding = 'utf-8'
@@ -170,15 +235,3 @@ class FetchAppstoreReviews(DataPreparationTask):
     def find_first_conditional_tag(self, tags, condition):
 
         return next(each for each in tags if condition(each))
-
-    def get_metered_request(self, *args, **kwargs):
-
-        sleep(max(0, (
-            60 / self.requests_per_minute - (
-                dt.datetime.now() - self.latest_request_time
-            ).total_seconds())
-        ))
-        try:
-            return requests.get(*args, **kwargs)
-        finally:
-            self.latest_request_time = dt.datetime.now()
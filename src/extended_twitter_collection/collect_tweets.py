@@ -4,8 +4,12 @@ Extended twitter collection.
 TODO: Refine docstrings!
 """
 
+from collections import defaultdict
+from concurrent.futures import as_completed, ProcessPoolExecutor
 import csv
 import datetime as dt
+import json
+import re
 
 import pandas as pd
 import luigi
@@ -13,7 +17,7 @@ from luigi.format import UTF8
 import twint
 
 from _utils import CsvToDb, DataPreparationTask, logger
-from .keyword_intervals import KeywordIntervalsToDB
+from .keyword_intervals import KeywordIntervalsToDB, TOKEN_REGEX, find_tokens
 
 
 class TwitterExtendedDatasetToDB(CsvToDb):
@@ -31,7 +35,8 @@ class TwitterExtendedDataset(DataPreparationTask):
     ranking_thresh = luigi.FloatParameter(default=0.8)
 
     def requires(self):
-        return TwitterCandidateTweetsToDB()
+        yield TwitterCandidateTweetsToDB()
+        yield TwitterCandidateTermsToDB()
 
     def output(self):
         return luigi.LocalTarget(
@@ -43,8 +48,9 @@ class TwitterExtendedDataset(DataPreparationTask):
 
         # Apply filtering based on thresholds
         extended_dataset = self.db_connector.query(fr'''
-            SELECT user_id, tweet_id::text, text, response_to,
-                   post_date, permalink, likes, retweets, replies
+            SELECT ec.user_id, ec.tweet_id::text, ec.text, ec.response_to,
+                   ec.post_date, ec.permalink, ec.likes, ec.retweets,
+                   ec.replies
             FROM
             -- keyword-intervals enriched with interval-based R value
             (
@@ -68,16 +74,19 @@ class TwitterExtendedDataset(DataPreparationTask):
                 -- an R value below the threshold
                 WHERE R_interval <= {self.r_thresh}
             ) AS ki_r
-            INNER JOIN twitter_extended_candidates AS ec
+            -- tweet should contain the term as a whole word
+            INNER JOIN twitter_extended_candidate_term AS ct
             ON
-                -- match tweets to intervals based on the post date
-                ec.post_date between ki_r.start_date and ki_r.end_date
+                ct.term = ki_r.term
             AND
-                -- tweet should contain the term as a whole word
-                ec.text ~* ('\m' || ki_r.term || '\M')
-            GROUP BY user_id, tweet_id, text,
-                     response_to, post_date, permalink,
-                     likes, retweets, replies
+                -- match tweets to intervals based on the post date
+                ct.post_date BETWEEN ki_r.start_date AND ki_r.end_date
+            INNER JOIN twitter_extended_candidates AS ec
+            ON
+                ec.tweet_id = ct.tweet_id
+            GROUP BY ec.user_id, ec.tweet_id, ec.text,
+                     ec.response_to, ec.post_date, ec.permalink,
+                     ec.likes, ec.retweets, ec.replies
             -- Only keep top-ranked tweets
             HAVING sum(1 / r_interval) >= {self.ranking_thresh}
         ''')
@@ -107,12 +116,99 @@ class TwitterCandidateTweetsToDB(CsvToDb):
         return TwitterCollectCandidateTweets()
 
 
+class TwitterCandidateTermsToDB(CsvToDb):
+
+    table = 'twitter_extended_candidate_term'
+
+    replace_content = True
+
+    def requires(self):
+        return TwitterMatchCandidateTerms()
+
+
+class TwitterMatchCandidateTerms(DataPreparationTask):
+    """
+    Find all terms that each candidate tweet contains as a whole word.
+
+    This is equivalent to matching every tweet against the word boundaries
+    of every term using a regular expression, but tokenizes every tweet only
+    once.
+    """
+
+    def requires(self):
+        return TwitterCandidateTweetsToDB()
+
+    def output(self):
+        return luigi.LocalTarget(
+            f'{self.output_dir}/twitter/extended_candidate_terms.csv',
+            format=UTF8
+        )
+
+    def run(self):
+
+        terms = {
+            term for (term,) in self.db_connector.query('''
+                SELECT DISTINCT term
+                FROM twitter_keyword_intervals
+            ''')
+        }
+        candidates = self.db_connector.query('''
+            SELECT DISTINCT tweet_id, text, post_date
+            FROM twitter_extended_candidates
+        ''')
+
+        # Most terms are words joined by hyphens. They can be looked up in
+        # the tokens directly.
+        indexed_terms = {term for term in terms if TOKEN_REGEX.fullmatch(term)}
+        max_parts = max(
+            (term.count('-') + 1 for term in indexed_terms), default=1)
+        other_regexes = {
+            term: re.compile(rf'\b(?=\w){term}(?<=\w)\b')
+            for term in terms - indexed_terms
+        }
+
+        candidate_terms = []
+        for tweet_id, text, post_date in self.tqdm(
+                candidates, desc="Matching candidates to terms"):
+            text = text.lower() if text else ''
+            matched_terms = {
+                token for token in find_tokens(text, max_parts)
+                if token in indexed_terms
+            }
+            matched_terms.update(
+                term for term, regex in other_regexes.items()
+                if regex.search(text))
+            candidate_terms.extend(
+                (term, tweet_id, post_date) for term in matched_terms)
+
+        candidate_terms_df = pd.DataFrame(
+            candidate_terms, columns=['term', 'tweet_id', 'post_date'])
+        candidate_terms_df = candidate_terms_df.drop_duplicates(
+            subset=['term', 'tweet_id'])
+
+        with self.output().open('w') as output_file:
+            candidate_terms_df.to_csv(output_file, index=False, header=True)
+
+
 class TwitterCollectCandidateTweets(DataPreparationTask):
+    """
+    Search tweets for all terms that have an active keyword interval.
+
+    Every term is searched for each of the last 7 days separately (only for
+    yesterday and today in minimal mode). The results of past days are
+    cached in the twitter_search_cache table and reused by later runs. Thus,
+    the likes, retweets, and replies of a candidate are not updated anymore
+    after the first run following the day it was posted.
+    """
 
     # only fetch the first count * collection_r_limit tweets
     # for a given keyword-interval
     collection_r_limit = luigi.IntParameter(default=50)
 
+    search_workers = luigi.IntParameter(
+        default=4,
+        description="The maximum number of searches to run in parallel")
+
     def requires(self):
         return KeywordIntervalsToDB()
 
@@ -132,81 +228,207 @@ class TwitterCollectCandidateTweets(DataPreparationTask):
             WHERE end_date >= CURRENT_DATE
             {'LIMIT 500' if self.minimal_mode else ''}
         ''')
-
-        seven_days_ago = (
-            dt.datetime.today() - dt.timedelta(days=7)
-        ).strftime('%Y-%m-%d')
-
-        # fetch the tweets
-        tweet_dfs = []  # list of dataframes
-        for term, count in self.tqdm(
-                active_intervals, desc="Extending tweet collection"):
-            tweet_dfs.append(self.fetch_tweets(
-                query=term,
-                start_date=seven_days_ago,
-                limit=count * self.collection_r_limit
-            ))
+        limits = defaultdict(int)
+        for term, count in active_intervals:
+            limits[term] = max(limits[term], count * self.collection_r_limit)
 
         # always query 'museumbarberini'
         # TODO: Don't hardcode this.
-        tweet_dfs.append(self.fetch_tweets(
-            query="museumbarberini",
-            start_date=seven_days_ago,
-            limit=10000
-        ))
-
-        # create dataframe with all the fetched tweets
-        tweet_df = pd.concat(tweet_dfs)
-        tweet_df = tweet_df.drop_duplicates(subset=['term', 'tweet_id'])
+        limits['museumbarberini'] = max(limits['museumbarberini'], 10000)
+
+        # Search every day separately so that the results for past days can
+        # be reused from the cache by the next runs
+        today = dt.date.today()
+        # Keep minimal mode fast, searching 8 days would take 8 times longer
+        days_back = 1 if self.minimal_mode else 7
+        days = [
+            today - dt.timedelta(days=n) for n in range(days_back, -1, -1)]
+        cache = self.load_search_cache(since=days[0])
+        results, searches = self.plan_searches(limits, days, cache)
+        logger.info(
+            f"Searching {len(searches)} term-days, reusing "
+            f"{len(limits) * len(days) - len(searches)} from the cache")
+
+        # fetch the tweets
+        new_cache = {}
+        for (term, day, limit), tweets_df in self.tqdm(
+                self.run_searches(searches),
+                total=len(searches),
+                desc="Extending tweet collection"):
+            results[term].append((day, tweets_df))
+            # The results for today are not final yet
+            if day < today:
+                new_cache[term, day] = (limit, tweets_df)
+        self.store_search_cache(new_cache, since=days[0])
+
+        tweet_df = self.merge_results(results, limits)
         tweet_df = self.encode_strings(tweet_df)
 
         with self.output().open('w') as output_file:
             tweet_df.to_csv(output_file, index=False, header=True)
 
-    def fetch_tweets(self, query, start_date, limit):
-        """All searches are limited to German tweets (twitter lang code de)."""
-        logger.debug(
-            f"Querying Tweets. term \"{query}\", "
-            f"limit: {limit}, start_date: {start_date}"
-        )
-
-        tweets = []  # tweets go in this list
-
-        # set config options for twint
-        c = twint.Config()
-        c.Limit = limit
-        c.Search = query
-        c.Store_object = True
-        c.Since = f'{start_date} 00:00:00'
-        c.Lang = 'de'
-        c.Hide_output = True
-        c.Store_object_tweets_list = tweets
-
-        # execute the twitter search
-        twint.run.Search(c)
-
-        # create dataframe from search results
-        tweets_df = pd.DataFrame([
-            {
-                'term': query,
-                'user_id': t.user_id,
-                'tweet_id': t.id,
-                'text': t.tweet,
-                'response_to': '',
-                'post_date': t.datestamp,
-                'permalink': t.link,
-                'likes': t.likes_count,
-                'retweets': t.retweets_count,
-                'replies': t.replies_count
+    @staticmethod
+    def plan_searches(limits, days, cache):
+        """
+        Decide which searches can be answered from the cache.
+
+        Answer the cached (day, tweets) results for each term and the list of
+        (term, day, limit) searches that have to be run. A cached result is
+        only reused if it is complete (i.e., it was not cut off by its limit)
+        or if its limit was not smaller than the current one.
+        """
+        results = defaultdict(list)
+        searches = []
+        for term, limit in limits.items():
+            for day in days:
+                if (term, day) in cache:
+                    cache_limit, tweets_df = cache[term, day]
+                    if len(tweets_df) < cache_limit or cache_limit >= limit:
+                        results[term].append((day, tweets_df))
+                        continue
+                searches.append((term, day, limit))
+        return results, searches
+
+    @staticmethod
+    def merge_results(results, limits):
+        """
+        Merge the (day, tweets) results of all terms into one DataFrame.
+
+        For every term, only the latest limit tweets of all days are kept,
+        like a single search over the whole period would do. Tweets that were
+        found multiple times for the same term are only kept once.
+        """
+        tweet_dfs = []
+        for term, term_results in results.items():
+            seen_ids = set()
+            remaining = limits[term]
+            for _day, tweets_df in sorted(
+                    term_results, key=lambda result: result[0],
+                    reverse=True):
+                tweets_df = tweets_df.drop_duplicates(subset='tweet_id')
+                tweets_df = tweets_df[~tweets_df['tweet_id'].isin(seen_ids)]
+                tweets_df = tweets_df.head(remaining)
+                seen_ids.update(tweets_df['tweet_id'])
+                remaining -= len(tweets_df)
+                tweet_dfs.append(tweets_df)
+        tweet_df = pd.concat(tweet_dfs, ignore_index=True)
+        return tweet_df.drop_duplicates(subset=['term', 'tweet_id'])
+
+    def run_searches(self, searches):
+        """
+        Run all searches and yield their results as soon as they complete.
+
+        Each search is a tuple of query, day, and limit. twint is not
+        thread-safe, so searches are run in up to search_workers processes.
+        If search_workers is 1, they are run sequentially in this process.
+        """
+        if self.search_workers <= 1:
+            for search in searches:
+                yield search, fetch_tweets(*search)
+            return
+
+        with ProcessPoolExecutor(self.search_workers) as executor:
+            futures = {
+                executor.submit(fetch_tweets, *search): search
+                for search in searches
             }
-            for t in tweets
-        ])
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def load_search_cache(self, since):
+        """Answer the cached limits and results of all searches by term/day."""
+        return {
+            (term, day): (
+                tweet_limit,
+                pd.DataFrame(json.loads(tweets), columns=TWEET_COLUMNS))
+            for term, day, tweet_limit, tweets in self.db_connector.query(
+                '''
+                    SELECT term, since, tweet_limit, tweets
+                    FROM twitter_search_cache
+                    WHERE since >= %s
+                ''',
+                since)
+        }
+
+    def store_search_cache(self, cache, since):
+        """Store the results of the searches and drop outdated ones."""
+        self.db_connector.execute(
+            ('''
+                DELETE FROM twitter_search_cache
+                WHERE since < %s
+            ''', (since,)),
+            *[
+                ('''
+                    INSERT INTO twitter_search_cache
+                        (term, since, tweet_limit, tweets)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (term, since) DO UPDATE
+                        SET tweet_limit = EXCLUDED.tweet_limit,
+                            tweets = EXCLUDED.tweets
+                ''', (
+                    term, day, limit,
+                    tweets_df.to_json(orient='records')
+                ))
+                for (term, day), (limit, tweets_df) in cache.items()
+            ]
+        )
 
-        # insert space before links to match hashtags correctly
-        if not tweets_df.empty:
-            tweets_df['text'] = tweets_df['text']\
-                .str.replace('pic.', ' pic.', regex=False)\
-                .str.replace('https', ' https', regex=False)\
-                .str.replace('http', ' http', regex=False)
 
-        return tweets_df
+TWEET_COLUMNS = [
+    'term', 'user_id', 'tweet_id', 'text', 'response_to',
+    'post_date', 'permalink', 'likes', 'retweets', 'replies'
+]
+
+
+def fetch_tweets(query, day, limit):
+    """
+    Search all tweets for the query that were posted on the given day.
+
+    All searches are limited to German tweets (twitter lang code de).
+    """
+    logger.debug(
+        f"Querying Tweets. term \"{query}\", "
+        f"limit: {limit}, day: {day}"
+    )
+
+    tweets = []  # tweets go in this list
+
+    # set config options for twint
+    c = twint.Config()
+    c.Limit = limit
+    c.Search = query
+    c.Store_object = True
+    c.Since = f'{day} 00:00:00'
+    c.Until = f'{day + dt.timedelta(days=1)} 00:00:00'
+    c.Lang = 'de'
+    c.Hide_output = True
+    c.Store_object_tweets_list = tweets
+
+    # execute the twitter search
+    twint.run.Search(c)
+
+    # create dataframe from search results
+    tweets_df = pd.DataFrame([
+        {
+            'term': query,
+            'user_id': t.user_id,
+            'tweet_id': t.id,
+            'text': t.tweet,
+            'response_to': '',
+            'post_date': t.datestamp,
+            'permalink': t.link,
+            'likes': t.likes_count,
+            'retweets': t.retweets_count,
+            'replies': t.replies_count
+        }
+        for t in tweets
+    ], columns=TWEET_COLUMNS)
+
+    # insert space before links to match hashtags correctly
+    if not tweets_df.empty:
+        tweets_df['text'] = tweets_df['text']\
+            .str.replace('pic.', ' pic.', regex=False)\
+            .str.replace('https', ' https', regex=False)\
+            .str.replace('http', ' http', regex=False)
+
+    return tweets_df
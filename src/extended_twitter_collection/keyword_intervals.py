@@ -13,11 +13,15 @@ from luigi.format import UTF8
 import numpy as np
 import pandas as pd
 from stop_words import get_stop_words
-from tqdm import tqdm
 
 from _utils import DataPreparationTask, CsvToDb
 from twitter import TweetsToDb
 
+# Words joined by hyphens, like most terms (e.g., maz-online)
+TOKEN_REGEX = re.compile(r'\w+(?:-\w+)*')
+# Characters before a term that indicate an URL, e.g., www.maz-online.de
+URL_PREFIX_CHARS = set('(www.)(http://)')
+
 
 class KeywordIntervalsToDB(CsvToDb):
 
@@ -45,36 +49,21 @@ class KeywordIntervals(DataPreparationTask):
         with inputs[1].open("r") as input_file:
             initial_dataset = pd.read_csv(input_file)
 
-        # determine the keyword-intervals for all terms
-        tqdm.pandas(desc="Processing keyword intervals")
-        intervals_and_post_dates = terms_df.term.progress_apply(
-            self.get_relevance_timespan, args=(initial_dataset,))
-        terms_df['relevance_timespan'] = [
-            e[0] if not pd.isnull(e) else np.nan
-            for e in intervals_and_post_dates
-        ]
-        terms_df["post_dates"] = [
-            e[1] if not pd.isnull(e) else np.nan
-            for e in intervals_and_post_dates
-        ]
-
-        # post-processing of updated terms dataframe
-        terms_df = terms_df.dropna(subset=["post_dates"])
-        terms_df["count"] = [len(x) for x in terms_df["post_dates"]]
+        # find the post dates of all terms at once
+        post_dates = self.index_post_dates(terms_df.term, initial_dataset)
 
         # build dataframe with keyword-intervals
         # and the correct keyword counts.
         intervals = []
-        for i, row in terms_df.iterrows():
-            for x, y in row['relevance_timespan']:
-                start = min(x, y)
-                end = max(x, y)
-                count_interval = len([
-                    date for date in row['post_dates']
-                    if start <= date <= end
-                ])
-                intervals.append(
-                    (row['term'], row['count'], count_interval, start, end))
+        for term in self.tqdm(
+                terms_df.term, desc="Processing keyword intervals"):
+            if term not in post_dates:
+                continue
+            for start, end, count_interval in self.get_relevance_timespans(
+                    post_dates[term]):
+                intervals.append((
+                    term, len(post_dates[term]), count_interval,
+                    str(start), str(end)))
         intervals_df = pd.DataFrame(
             intervals, columns=['term', 'count_overall', 'count_interval',
                                 'start_date', 'end_date']
@@ -90,55 +79,91 @@ class KeywordIntervals(DataPreparationTask):
             format=UTF8
         )
 
-    def get_relevance_timespan(self, term, initial_dataset):
-
-        if not isinstance(term, str):
-            return np.nan
-
-        # find all dates on which the term was used
-        # exclude tweets where the term only appears as the domain
-        # name in an url -> this favours terms such as maz-online or pnn
-        regex = rf'(?<![(www\.)(http://)])\b{term}\b'
-
-        # find tweets that contain the term
-        relevant_tweets = initial_dataset[[
-            True if re.findall(regex, tweet) else False
-            for tweet in initial_dataset.text.str.lower()
-        ]]
-
-        # when was the term used in the initial dataset?
-        post_dates = pd.to_datetime(
-            relevant_tweets.date, infer_datetime_format=True)
-        post_dates = post_dates.sort_values()
-        post_dates_output = [str(date) for date in post_dates]
-        if post_dates.empty:
-            return np.nan
-
+    def index_post_dates(self, terms, initial_dataset):
+        """
+        Answer the sorted dates of all tweets that contain each term.
+
+        Instead of searching every tweet for every term, all tweets are split
+        into tokens once. Terms without matches are omitted.
+        """
+        terms = {term for term in terms if isinstance(term, str)}
+        # Most terms are words joined by hyphens. They can be looked up in
+        # the index directly.
+        indexed_terms = {term for term in terms if TOKEN_REGEX.fullmatch(term)}
+        max_parts = max(
+            (term.count('-') + 1 for term in indexed_terms), default=1)
+
+        tweets_by_term = defaultdict(set)
+        texts = initial_dataset.text.str.lower()
+        for i, text in enumerate(self.tqdm(texts, desc="Indexing tweets")):
+            if not isinstance(text, str):
+                continue
+            # exclude tweets where the term only appears as the domain
+            # name in an url -> this favours terms such as maz-online or pnn
+            for token in find_tokens(text, max_parts, exclude_urls=True):
+                if token in indexed_terms:
+                    tweets_by_term[token].add(i)
+
+        # Fall back to regular expressions for all other terms
+        for term in terms - indexed_terms:
+            regex = re.compile(rf'(?<![(www\.)(http://)])\b{term}\b')
+            tweets_by_term[term] = {
+                i for i, text in enumerate(texts)
+                if isinstance(text, str) and regex.search(text)
+            }
+
+        dates = pd.to_datetime(
+            initial_dataset.date, infer_datetime_format=True)
+        return {
+            term: pd.DatetimeIndex(dates.iloc[sorted(tweets)]).sort_values()
+            for term, tweets in tweets_by_term.items()
+            if tweets
+        }
+
+    def get_relevance_timespans(self, post_dates):
+        """
+        Answer the keyword intervals for the sorted post dates of a term.
+
+        Post dates that are at most 2 * offset days apart from each other are
+        merged into one interval. Answer the start, the end, and the number of
+        post dates of each interval.
+        """
         # keyword intervals are post_date +/- offset
         offset_dt = dt.timedelta(days=self.offset)
 
         # calculate the non-overlapping keyword intervals
         # for the given term using the provided offset
-        intervals = []
-        cur_start = post_dates.iloc[0]
-        prev_date = post_dates.iloc[0]
-        for date in post_dates[1:]:
-            if abs((date - prev_date).days) <= self.offset * 2:
-                prev_date = date
-            else:
-                intervals.append(
-                    (cur_start + offset_dt, prev_date - offset_dt))
-                cur_start = date
-                prev_date = date
-
-        # handle last post date
-        last_date = post_dates.iloc[-1]
-        intervals.append((cur_start + offset_dt, last_date - offset_dt))
-
-        # convert dates to string
-        intervals = [(str(a), str(b)) for a, b in intervals]
-
-        return intervals, post_dates_output
+        dates = post_dates.values
+        gap_days = np.diff(dates) // np.timedelta64(1, 'D')
+        breaks = np.flatnonzero(gap_days > self.offset * 2)
+        starts = post_dates[np.concatenate([[0], breaks + 1])] + offset_dt
+        ends = post_dates[np.concatenate([breaks, [len(dates) - 1]])] \
+            - offset_dt
+
+        # intervals of isolated post dates are inverted
+        lower = starts.where(starts <= ends, ends)
+        upper = ends.where(starts <= ends, starts)
+        counts = np.searchsorted(dates, upper.values, side='right') \
+            - np.searchsorted(dates, lower.values, side='left')
+
+        return list(zip(lower, upper, counts))
+
+
+def find_tokens(text, max_parts, exclude_urls=False):
+    """
+    Yield all tokens of the text that a term can match as a whole word.
+
+    Tokens are words or up to max_parts words joined by hyphens. If
+    exclude_urls is True, skip tokens that directly follow one of the
+    URL_PREFIX_CHARS.
+    """
+    for match in TOKEN_REGEX.finditer(text):
+        is_url = exclude_urls and match.start() > 0 \
+            and text[match.start() - 1] in URL_PREFIX_CHARS
+        parts = match.group().split('-')
+        for first in range(1 if is_url else 0, len(parts)):
+            for last in range(first, min(len(parts), first + max_parts)):
+                yield '-'.join(parts[first:last + 1])
 
 
 class TermCounts(DataPreparationTask):
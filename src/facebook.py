@@ -5,9 +5,11 @@ All data are fetched using the Facebook Graph API. An access token has to be
 available in the /etc/secrets/keys.env file.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import datetime as dt
 import json
 import os
+from typing import List, Optional
 
 import luigi
 import numpy as np
@@ -16,6 +18,7 @@ import requests
 from luigi.format import UTF8
 
 from _utils import CsvToDb, DataPreparationTask, MuseumFacts, logger
+from _utils import http_client
 
 API_VER = 'v10.0'
 API_BASE = f'https://graph.facebook.com/{API_VER}'
@@ -42,6 +45,11 @@ class FbPostPerformanceToDb(CsvToDb):
 
         return FetchFbPostPerformance(table=self.table)
 
+    def run(self):
+
+        super().run()
+        self.requires().store_poll_schedule()
+
 
 class FbPostCommentsToDb(CsvToDb):
     """Store all fetched Facebook comments into the database."""
@@ -52,6 +60,11 @@ class FbPostCommentsToDb(CsvToDb):
 
         return FetchFbPostComments(table=self.table)
 
+    def run(self):
+
+        super().run()
+        self.requires().clear_harvests()
+
 # ======= FetchTasks =======
 
 
@@ -121,10 +134,6 @@ class FetchFbPostDetails(DataPreparationTask):
         default=dt.timedelta(days=60),
         description="For how much time posts should be fetched")
 
-    # Override the default timeout of 10 minutes to allow
-    # FetchFbPostPerformance to take up to 20 minutes.
-    worker_timeout = 1200
-
     def __init__(self, *args, **kwargs):
 
         super().__init__(*args, **kwargs)
@@ -141,6 +150,13 @@ class FetchFbPostDetails(DataPreparationTask):
 
         return FetchFbPosts()
 
+    def filter_relevant_posts(self, df):
+        """Drop all posts that are older than the timespan."""
+        return df.loc[[
+            index for index in df.index
+            if self.post_date(df, index) >= self.minimum_relevant_date
+        ]]
+
     @staticmethod
     def post_date(df, index):
 
@@ -155,7 +171,8 @@ class FetchFbPostPerformance(FetchFbPostDetails):
     Fetch performance data for every Facebook comment.
 
     Performance data include the number of likes, shares, and comments for a
-    post.
+    post. Only posts that are due according to the poll_scheduler() are
+    fetched.
     """
 
     def output(self):
@@ -174,39 +191,41 @@ class FetchFbPostPerformance(FetchFbPostDetails):
         if self.minimal_mode:
             df = df.head(5)
 
-        invalid_count = 0
-        pbar = self.tqdm(
-            df.index,
-            desc="Fetching performance data for facebook posts"
-        )
-        for index in pbar:
-            page_id, post_id = \
-                str(df['page_id'][index]), str(df['post_id'][index])
-            fb_post_id = f'{page_id}_{post_id}'
-            post_date = self.post_date(df, index)
-            if post_date < self.minimum_relevant_date:
-                continue
-
-            logger.debug(
-                f"Loading performance data for FB post {fb_post_id}")
-
-            metrics = ','.join([
-                'post_reactions_by_type_total',
-                'post_activity_by_action_type',
-                'post_clicks_by_type',
-                'post_negative_feedback',
-                'post_impressions_paid',
-                'post_impressions',
-                'post_impressions_unique'  # "reach"
-            ])
-            url = f'{API_BASE}/{fb_post_id}/insights?metric={metrics}'
-
-            response = try_request_multiple_times(url)
+        df = self.filter_relevant_posts(df)
+
+        poll_scheduler = self.poll_scheduler()
+        post_keys = [
+            f'{page_id}_{post_id}'
+            for page_id, post_id in zip(df['page_id'], df['post_id'])
+        ]
+        due = poll_scheduler.is_due(post_keys)
+        post_keys = [key for key, is_due in zip(post_keys, due) if is_due]
+        df = df[pd.Series(due, index=df.index, dtype=bool)]
+        # created_time is given in UTC
+        post_dates = [self.post_date(df, index) for index in df.index]
+
+        metrics = ','.join([
+            'post_reactions_by_type_total',
+            'post_activity_by_action_type',
+            'post_clicks_by_type',
+            'post_negative_feedback',
+            'post_impressions_paid',
+            'post_impressions',
+            'post_impressions_unique'  # "reach"
+        ])
+        logger.info(f"Fetching performance data for {len(df)} facebook posts")
+        responses = GraphApiClient().get_all([
+            f'{page_id}_{post_id}/insights?metric={metrics}'
+            for page_id, post_id in zip(df['page_id'], df['post_id'])
+        ])
 
+        invalid_count = 0
+        for page_id, post_id, response in zip(
+                df['page_id'], df['post_id'], responses):
+            page_id, post_id = str(page_id), str(post_id)
             if response.status_code == 400:
                 invalid_count += 1
                 continue
-            response.raise_for_status()  # in case of another error
             response_content = response.json()
 
             post_perf = {
@@ -257,7 +276,16 @@ class FetchFbPostPerformance(FetchFbPostDetails):
         if invalid_count:
             logger.warning(f"Skipped {invalid_count} posts")
 
-        df = pd.DataFrame(performances)
+        df = pd.DataFrame(performances, columns=[
+            'timestamp',
+            'react_like', 'react_love', 'react_wow',
+            'react_haha', 'react_sorry', 'react_anger',
+            'likes', 'shares', 'comments',
+            'video_clicks', 'link_clicks', 'other_clicks',
+            'negative_feedback', 'paid_impressions',
+            'post_impressions', 'post_impressions_unique',
+            'page_id', 'post_id'
+        ])
 
         # For some reason, all except the first set of performance
         # values get inserted twice into the performances list.
@@ -268,12 +296,41 @@ class FetchFbPostPerformance(FetchFbPostDetails):
         df = self.filter_fkey_violations(df)
         df = self.condense_performance_values(df)
 
+        # Only stored by FbPostPerformanceToDb after storing the values
+        self.write_poll_schedule(poll_scheduler.next_polls(
+            post_keys,
+            post_dates,
+            [
+                f'{page_id}_{post_id}'
+                for page_id, post_id in zip(df['page_id'], df['post_id'])
+            ]))
+
         with self.output().open('w') as output_file:
             df.to_csv(output_file, index=False, header=True)
 
 
 class FetchFbPostComments(FetchFbPostDetails):
-    """Fetch all user comments to Facebook posts."""
+    """
+    Fetch all user comments to Facebook posts.
+
+    Comments are harvested page by page for all posts at once. After every
+    page, the paging cursor and all comments fetched so far are checkpointed
+    in the fb_post_comment_harvest table, so a failed run is resumed at the
+    same page. Once FbPostCommentsToDb has stored the comments of a complete
+    harvest, they are dropped from the checkpoint.
+
+    Posts whose number of comments has not changed since their last complete
+    harvest are not requested again. This number is taken from the latest
+    fb_post_performance, which is only polled every few days for old posts
+    (see poll_scheduler()), so new comments to these posts can be missed
+    until their next poll. To bound this delay, every harvest older than
+    max_harvest_age is repeated anyway.
+    """
+
+    max_harvest_age = luigi.parameter.TimeDeltaParameter(
+        default=dt.timedelta(days=7),
+        description="After how much time the comments of a post are "
+                    "harvested again even if their number has not changed")
 
     def requires(self):
 
@@ -339,86 +396,261 @@ class FetchFbPostComments(FetchFbPostDetails):
 
     def fetch_comments(self, df):
 
+        df = self.filter_relevant_posts(df)
+        # Posts can appear multiple times, see #227
+        posts = list(dict.fromkeys(
+            (str(page_id), str(post_id))
+            for page_id, post_id in zip(df['page_id'], df['post_id'])
+        ))
+
+        harvests = self.load_harvests()
+        current_counts = self.load_comment_counts()
+        now = dt.datetime.now()
+
+        # All comments fetched so far, per post
+        comments = {}
+        # Number of comments and time at the beginning of the harvest, per post
+        comment_counts = {}
+        harvest_times = {}
+        # Cursor of the next page (or None for the first page), per post
+        cursors = {}
+        for post in posts:
+            if post in harvests:
+                count, cursor, harvested_comments, harvested_at = \
+                    harvests[post]
+                if cursor is not None:
+                    # Resume the interrupted harvest
+                    comments[post] = harvested_comments
+                    comment_counts[post] = count
+                    harvest_times[post] = harvested_at
+                    cursors[post] = cursor
+                    continue
+                if count is not None and count == current_counts.get(post) \
+                        and harvested_at is not None \
+                        and now - harvested_at <= self.max_harvest_age:
+                    # Nothing has changed since the last harvest. Unless
+                    # FbPostCommentsToDb has failed, the comments are already
+                    # stored and don't need to be answered again.
+                    comments[post] = harvested_comments or []
+                    continue
+            comments[post] = []
+            comment_counts[post] = current_counts.get(post)
+            harvest_times[post] = now
+            cursors[post] = None
+        logger.info(
+            f"Harvesting comments for {len(cursors)} of {len(posts)} facebook "
+            f"posts, resuming {sum(c is not None for c in cursors.values())}")
+
         invalid_count = 0
+        while cursors:
+            responses = GraphApiClient().get_all([
+                self.comments_url(f'{page_id}_{post_id}', cursor)
+                for (page_id, post_id), cursor in cursors.items()
+            ])
 
-        # Handle each post
-        for i in df.index:
-            page_id, post_id = df['page_id'][i], df['post_id'][i]
-            fb_post_id = f'{page_id}_{post_id}'
-            post_date = self.post_date(df, i)
-            if post_date < self.minimum_relevant_date:
-                continue
+            next_cursors = {}
+            pages = {}
+            for post, response in zip(cursors, responses):
+                if response.status_code == 400:
+                    invalid_count += 1
+                    continue
+                response_content = response.json()
+                pages[post] = response_content.get('data')
+                if 'next' in response_content.get('paging', {}) \
+                        and not self.minimal_mode:
+                    next_cursors[post] = \
+                        response_content['paging']['cursors']['after']
+
+            self.fetch_remaining_replies([
+                comment for page in pages.values() for comment in page])
+
+            for (page_id, post_id), page in pages.items():
+                logger.info(f"Fetched {len(page)} comments for post {post_id}")
+                comments[page_id, post_id].extend(
+                    self.transform_comments(page_id, post_id, page))
+            self.store_harvests({
+                post: (
+                    comment_counts[post],
+                    next_cursors.get(post),
+                    comments[post],
+                    harvest_times[post])
+                for post in pages
+            })
+            cursors = next_cursors
 
-            # Grab up to 100 comments for the post (maximum)
-            limit = 100
+        if invalid_count:
+            logger.warning(f"Skipped {invalid_count} posts")
 
-            # 'toplevel' or 'stream' (toplevel doesn't include replies)
-            # Using 'toplevel' here allows us to safely
-            # set parent to None for all comments returned
-            # by the first query
-            filt = 'toplevel'
+        for post_comments in comments.values():
+            yield from post_comments
 
-            # 'chronological' or 'reverse_chronolocial'
-            order = 'chronological'
+    def comments_url(self, object_id, cursor=None):
+        """Answer the relative URL of a page of comments to the object."""
+        # Grab up to 100 comments per page (maximum)
+        limit = 100
 
-            fields = ','.join([
-                'id',
-                'created_time',
-                'comment_count',
-                'message',
-                'comments'
-                ])
+        # 'toplevel' or 'stream' (toplevel doesn't include replies)
+        # Using 'toplevel' here allows us to safely
+        # set parent to None for all comments returned
+        # by the first query
+        filt = 'toplevel'
+
+        # 'chronological' or 'reverse_chronolocial'
+        order = 'chronological'
+
+        fields = ','.join([
+            'id',
+            'created_time',
+            'comment_count',
+            'message',
+            'comments'
+            ])
 
-            url = (f'{API_BASE}/{fb_post_id}/comments?limit={limit}'
-                   f'filter={filt}&order={order}&fields={fields}')
+        url = (
+            f'{object_id}/comments?limit={limit}'
+            f'&filter={filt}&order={order}&fields={fields}')
+        if cursor:
+            url += f'&after={cursor}'
+        return url
+
+    def fetch_remaining_replies(self, comments):
+        """
+        Complete the replies of all comments in place.
+
+        Only the first page of replies is embedded in every comment, so fetch
+        any further pages of replies.
+        """
+        pending = [
+            comment for comment in comments
+            if 'next' in comment.get('comments', {}).get('paging', {})
+        ]
+        while pending:
+            logger.info(f"Fetching more replies for {len(pending)} comments")
+            responses = GraphApiClient().get_all([
+                f"{comment['id']}/comments?limit=100&after="
+                f"{comment['comments']['paging']['cursors']['after']}"
+                for comment in pending
+            ])
 
-            response = try_request_multiple_times(url)
-            if response.status_code == 400:
-                invalid_count += 1
-                continue
-            response_data = response.json().get('data')
-
-            logger.info(f"Fetched {len(response_data)} "
-                        f"comments for post {post_id}")
-
-            # Handle each comment for the post
-            for comment in response_data:
-                comment_id = comment.get('id').split('_')[1]
-
-                yield {
-                    'post_id': str(post_id),
-                    'comment_id': str(comment_id),
-                    'page_id': str(page_id),
-                    'post_date': comment.get('created_time'),
-                    'text': comment.get('message'),
-                    'is_from_museum': self.is_from_museum(comment),
-                    'response_to': None
-                }
-
-                if not comment.get('comment_count'):
+            next_pending = []
+            for comment, response in zip(pending, responses):
+                if response.status_code == 400:
                     continue
-                try:
-                    # Handle each reply for the comment
-                    for reply in comment['comments']['data']:
-                        yield {
-                            'comment_id': reply.get('id').split('_')[1],
-                            'page_id': str(page_id),
-                            'post_id': str(post_id),
-                            'post_date': reply.get('created_time'),
-                            'text': reply.get('message'),
-                            'is_from_museum': self.is_from_museum(reply),
-                            'response_to': str(comment_id)
-                        }
-                except KeyError:
-                    # Sometimes, replies become unavailable. In this case,
-                    # the Graph API returns the true 'comment_count',
-                    # but does not provide a 'comments' field anyway
-                    logger.warning(
-                        f"Failed to retrieve replies for comment "
-                        f"{comment.get('id')}")
+                response_content = response.json()
+                comment['comments']['data'].extend(
+                    response_content.get('data'))
+                comment['comments']['paging'] = \
+                    response_content.get('paging', {})
+                if 'next' in comment['comments']['paging']:
+                    next_pending.append(comment)
+            pending = next_pending
+
+    def transform_comments(self, page_id, post_id, comments):
+
+        # Handle each comment for the post
+        for comment in comments:
+            comment_id = comment.get('id').split('_')[1]
+
+            yield {
+                'post_id': str(post_id),
+                'comment_id': str(comment_id),
+                'page_id': str(page_id),
+                'post_date': comment.get('created_time'),
+                'text': comment.get('message'),
+                'is_from_museum': self.is_from_museum(comment),
+                'response_to': None
+            }
 
-        if invalid_count:
-            logger.warning(f"Skipped {invalid_count} posts")
+            if not comment.get('comment_count'):
+                continue
+            try:
+                # Handle each reply for the comment
+                for reply in comment['comments']['data']:
+                    yield {
+                        'comment_id': reply.get('id').split('_')[1],
+                        'page_id': str(page_id),
+                        'post_id': str(post_id),
+                        'post_date': reply.get('created_time'),
+                        'text': reply.get('message'),
+                        'is_from_museum': self.is_from_museum(reply),
+                        'response_to': str(comment_id)
+                    }
+            except KeyError:
+                # Sometimes, replies become unavailable. In this case,
+                # the Graph API returns the true 'comment_count',
+                # but does not provide a 'comments' field anyway
+                logger.warning(
+                    f"Failed to retrieve replies for comment "
+                    f"{comment.get('id')}")
+
+    def load_comment_counts(self):
+        """Answer the latest known number of comments for every post."""
+        return {
+            (page_id, post_id): comments
+            for page_id, post_id, comments in self.db_connector.query('''
+                SELECT DISTINCT ON (page_id, post_id)
+                    page_id, post_id, comments
+                FROM fb_post_performance
+                ORDER BY page_id, post_id, timestamp DESC
+            ''')
+        }
+
+    def load_harvests(self):
+        """
+        Answer the checkpoints of all previous harvests.
+
+        For every post, answer the number of comments at the beginning of the
+        harvest, the cursor of the next page (or None if the harvest is
+        complete), all comments fetched so far (or None if they have already
+        been stored), and the time at the beginning of the harvest.
+        """
+        return {
+            (page_id, post_id): (
+                comment_count,
+                cursor,
+                json.loads(comments) if comments is not None else None,
+                harvested_at)
+            for page_id, post_id, comment_count, cursor, comments, harvested_at
+            in self.db_connector.query('''
+                SELECT
+                    page_id, post_id, comment_count, after_cursor, comments,
+                    harvested_at
+                FROM fb_post_comment_harvest
+            ''')
+        }
+
+    def store_harvests(self, harvests):
+        """Checkpoint the progress of the harvest for the given posts."""
+        if not harvests:
+            return
+        self.db_connector.execute(*[
+            ('''
+                INSERT INTO fb_post_comment_harvest (
+                    page_id, post_id, comment_count, after_cursor, comments,
+                    harvested_at
+                )
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (page_id, post_id) DO UPDATE
+                    SET comment_count = EXCLUDED.comment_count,
+                        after_cursor = EXCLUDED.after_cursor,
+                        comments = EXCLUDED.comments,
+                        harvested_at = EXCLUDED.harvested_at
+            ''', (
+                page_id, post_id, comment_count, cursor, json.dumps(comments),
+                harvested_at
+            ))
+            for (page_id, post_id), (
+                comment_count, cursor, comments, harvested_at
+            ) in harvests.items()
+        ])
+
+    def clear_harvests(self):
+        """Drop the comments of all complete harvests from the checkpoints."""
+        self.db_connector.execute('''
+            UPDATE fb_post_comment_harvest
+            SET comments = NULL
+            WHERE after_cursor IS NULL
+        ''')
 
     def is_from_museum(self, comment_json):
 
@@ -430,7 +662,8 @@ def try_request_multiple_times(url, **kwargs) -> requests.Response:
     Try multiple request to the Facebook Graph API.
 
     Not all requests to the API are successful. To allow some requests to fail
-    (mainly: to time out), request the API up to four times.
+    (mainly: to time out), request the API up to four times. See http_client
+    for details on the backoff between the attempts.
     """
     headers = kwargs.pop('headers', None)
     if not headers:
@@ -439,22 +672,8 @@ def try_request_multiple_times(url, **kwargs) -> requests.Response:
             raise EnvironmentError("FB Access token is not set")
         headers = {'Authorization': 'Bearer ' + access_token}
 
-    for _ in range(3):
-        try:
-            response = requests.get(
-                url,
-                timeout=60,
-                headers=headers,
-                **kwargs)
-            response.raise_for_status()
-            return response
-        except requests.RequestException as e:
-            logger.error(
-                "An Error occurred requesting the Facebook API.\n"
-                "Trying to request the API again.\n"
-                f"Error message: {e}"
-            )
-    response = requests.get(url, timeout=100, headers=headers, **kwargs)
+    response = http_client.get(
+        url, attempts=4, timeout=100, headers=headers, **kwargs)
 
     # cause clear error instead of trying
     # to process the invalid response
@@ -464,6 +683,128 @@ def try_request_multiple_times(url, **kwargs) -> requests.Response:
     return response
 
 
+class GraphApiClient:
+    """
+    Send many GET requests to the Facebook Graph API in batches.
+
+    The Graph API accepts up to 50 requests in a single batch request, which
+    saves a round trip per request. All batches are sent using http_client,
+    at most max_workers of them at once. http_client further reduces the
+    number of concurrent batches when the API reports a high rate limit usage.
+
+    Each request of a batch gets its own response, so single requests can
+    fail independently. Failed requests are repeated in a later batch, except
+    for HTTP 400, which denotes an invalid object (e.g., a deleted post) and
+    is answered to the caller like any successful response.
+    """
+
+    max_batch_size = 50
+
+    def __init__(self, max_workers=4, attempts=4, timeout=100):
+
+        self.access_token = os.getenv('FB_ACCESS_TOKEN')
+        if not self.access_token:
+            raise EnvironmentError("FB Access token is not set")
+        self.max_workers = max_workers
+        self.attempts = attempts
+        self.timeout = timeout
+
+    def get_all(self, relative_urls: List[str]) -> List['GraphApiResponse']:
+        """
+        Request all URLs and answer their responses in the same order.
+
+        URLs are relative to API_BASE. Raise an HTTPError if any request has
+        still failed after the last attempt.
+        """
+        responses: List[Optional[GraphApiResponse]] = \
+            [None] * len(relative_urls)
+        pending = list(range(len(relative_urls)))
+
+        for attempt in range(self.attempts):
+            if attempt:
+                logger.error(
+                    f"{len(pending)} requests to the Facebook API failed.\n"
+                    "Trying to request the API again.")
+            batches = [
+                pending[start:start + self.max_batch_size]
+                for start in range(0, len(pending), self.max_batch_size)
+            ]
+            with ThreadPoolExecutor(self.max_workers) as executor:
+                batch_responses = executor.map(
+                    lambda batch: self._request_batch(
+                        [relative_urls[index] for index in batch]),
+                    batches)
+                for batch, batch_response in zip(batches, batch_responses):
+                    for index, response in zip(batch, batch_response):
+                        responses[index] = response
+            pending = [
+                index for index in pending
+                if responses[index] is None
+                or not (responses[index].ok
+                        or responses[index].status_code == 400)
+            ]
+            if not pending:
+                return responses
+
+        index = pending[0]
+        raise requests.HTTPError(
+            f"Failed to request {relative_urls[index]} from the Facebook API "
+            f"({len(pending)} requests failed in total): "
+            f"{responses[index] and responses[index].text}")
+
+    def _request_batch(
+            self,
+            relative_urls: List[str]) -> List[Optional['GraphApiResponse']]:
+        """
+        Send a single batch request.
+
+        Answer None for every request that could not be completed.
+        """
+        try:
+            response = http_client.post(
+                API_BASE,
+                data={
+                    'access_token': self.access_token,
+                    'include_headers': 'false',
+                    'batch': json.dumps([
+                        {'method': 'GET', 'relative_url': url}
+                        for url in relative_urls
+                    ])
+                },
+                timeout=self.timeout)
+            response.raise_for_status()
+            results = response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.error(
+                f"An error occurred requesting the Facebook API: {e}")
+            return [None] * len(relative_urls)
+
+        # Requests that timed out are answered as null
+        return [
+            GraphApiResponse(result['code'], result['body'])
+            if result else None
+            for result in results
+        ]
+
+
+class GraphApiResponse:
+    """The response to a single request of a Graph API batch."""
+
+    def __init__(self, status_code: int, text: str):
+
+        self.status_code = status_code
+        self.text = text
+
+    @property
+    def ok(self):
+        """Tell whether the request was successful."""
+        return self.status_code < 400
+
+    def json(self):
+        """Answer the parsed JSON body of the response."""
+        return json.loads(self.text)
+
+
 def _num_to_str(num):
     """
     Convert number from pandas into CSV-stable representation.
@@ -4,10 +4,9 @@ import time
 from urllib import parse
 
 import luigi
-import requests
 from bs4 import BeautifulSoup
 
-from _utils import output_dir
+from _utils import http_client, output_dir
 from gomus._utils.fetch_report_helper import REPORT_IDS
 
 # These lists map directly to various Gomus attributes used for editing
@@ -169,11 +168,11 @@ class EditGomusReport(luigi.Task):
             self.add_to_body(f'{base}[{mode}][end_at]=')
 
     def get(self, url):
-        return requests.get(url, cookies=dict(
+        return http_client.get(url, cookies=dict(
             _session_id=os.environ['GOMUS_SESS_ID']))
 
     def post(self):
-        return requests.post(
+        return http_client.post(
             f'{BASE_URL}/admin/reports/{self.report}',
             self.__body.encode(
                 encoding='utf-8'),
@@ -2,13 +2,13 @@ from copy import copy
 import datetime as dt
 import re
 import os
-import time
+from urllib.parse import urlparse
 
 import luigi
 import pandas as pd
 import requests
 
-from _utils import DataPreparationTask
+from _utils import DataPreparationTask, http_client
 from ..orders import OrdersToDb
 from .extract_bookings import ExtractGomusBookings
 
@@ -84,11 +84,13 @@ class FetchGomusHTML(DataPreparationTask):
     def run(self):
 
         # polite get: we don't want to overwhelm the server
-        time.sleep(0.2)
+        http_client.configure_host(
+            urlparse(self.base_url).netloc,
+            min_interval=0.2)
 
         output = self.output()
 
-        response = requests.get(
+        response = http_client.get(
             self.base_url + self.url,
             cookies=dict(
                 _session_id=os.environ['GOMUS_SESS_ID']),
@@ -3,10 +3,9 @@ import datetime as dt
 import os
 
 import luigi
-import requests
 from luigi.format import UTF8
 
-from _utils import output_dir
+from _utils import http_client, output_dir
 from .edit_report import EditGomusReport
 from .fetch_report_helper import (
     REPORT_IDS, csv_from_excel, parse_timespan, request_report
@@ -76,7 +75,8 @@ class FetchEventReservations(luigi.Task):
 
     def run(self):
         url = f'{BASE_URL}/bookings/{self.booking_id}/seats.xlsx'
-        response = requests.get(url, cookies=dict(
+        # gomus answers 500 if there are no reservations, don't retry that
+        response = http_client.get(url, attempts=1, cookies=dict(
             _session_id=os.environ['GOMUS_SESS_ID']))
         response_content = response.content
 
@@ -2,10 +2,9 @@
 import csv
 import datetime as dt
 
-import requests
 import xlrd
 
-from _utils import logger
+from _utils import http_client, logger
 
 # This dict maps 'report_types' to 'REPORT_IDS'
 # Data sheets that don't require a report to be generated or
@@ -86,7 +85,7 @@ def direct_download_url(base_url, report, timespan):
 def get_request(url, sess_id):
     """Request the given URL from the gomus servers and return the results."""
     cookies = dict(_session_id=sess_id)
-    response = requests.get(url, cookies=cookies)
+    response = http_client.get(url, cookies=cookies)
     response.raise_for_status()
     if response.ok:
         logger.info("HTTP request successful")
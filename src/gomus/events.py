@@ -9,7 +9,7 @@ import requests
 from luigi.format import UTF8
 from xlrd import xldate_as_datetime
 
-from _utils import CsvToDb, DataPreparationTask, logger
+from _utils import CsvToDb, DataPreparationTask, http_client, logger
 from ._utils.extract_customers import hash_id
 from ._utils.fetch_report import FetchEventReservations
 from .bookings import BookingsToDb
@@ -183,7 +183,7 @@ def get_categories():
     """
     try:
         url = 'https://barberini.gomus.de/api/v4/events/categories'
-        response = requests.get(url)
+        response = http_client.get(url)
         response.raise_for_status()
         response_json = response.json()
         categories = [
@@ -5,9 +5,8 @@ from dateutil import parser as dateparser
 import luigi
 from luigi.format import UTF8
 import pandas as pd
-import requests
 
-from _utils import CsvToDb, DataPreparationTask
+from _utils import CsvToDb, DataPreparationTask, http_client
 
 
 class ExhibitionTimesToDb(CsvToDb):
@@ -53,7 +52,7 @@ class FetchExhibitions(DataPreparationTask):
 
     def run(self):
 
-        response = requests.get(self.url)
+        response = http_client.get(self.url)
         response.raise_for_status()
         content = response.json()
 
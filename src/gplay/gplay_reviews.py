@@ -1,15 +1,16 @@
 """Provides tasks for downloading Google Play reviews into the database."""
 
+from concurrent.futures import ThreadPoolExecutor
+import datetime as dt
 import json
 import luigi
 import os
 import pandas as pd
 import random
-import requests
 
 from itertools import chain
 
-from _utils import CsvToDb, DataPreparationTask, MuseumFacts
+from _utils import CsvToDb, DataPreparationTask, MuseumFacts, http_client
 
 
 class GooglePlaystoreReviewsToDb(CsvToDb):
@@ -23,7 +24,23 @@ class GooglePlaystoreReviewsToDb(CsvToDb):
 
 
 class FetchGplayReviews(DataPreparationTask):
-    """Fetch Google Play reviews."""
+    """
+    Fetch Google Play reviews.
+
+    The gplay API answers the newest reviews first. Unless a full resync is
+    done, only reviews newer than the newest stored review are requested.
+    Since the API does not support pagination, the number of requested
+    reviews is increased until the answer reaches back to that review.
+    """
+
+    full_resync = luigi.BoolParameter(
+        default=False,
+        description="fetch all reviews again to update edited reviews")
+    # Do a full resync every Sunday anyway
+    full_resync_weekday = 6
+
+    batch_size = 100
+    max_workers = 8
 
     def __init__(self, *args, **kwargs):
 
@@ -75,10 +92,21 @@ class FetchGplayReviews(DataPreparationTask):
                 'de'  # make sure we do not get zero reviews
             })
 
-        reviews_nested = [
-            self.fetch_for_language(language_code)
-            for language_code in language_codes
-        ]
+        newer_than = None
+        if not (self.full_resync
+                or dt.date.today().weekday() == self.full_resync_weekday):
+            newer_than = self.db_connector.query(f'''
+                SELECT MAX(post_date)
+                FROM gplay_review
+                WHERE app_id = '{self.app_id}'
+            ''', only_first=True)[0]
+
+        # The gplay API runs in a local container, so don't be too polite
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            reviews_nested = list(executor.map(
+                lambda language_code: list(
+                    self.fetch_for_language(language_code, newer_than)),
+                language_codes))
         reviews_flattened = list(chain.from_iterable(reviews_nested))
         reviews_df = pd.DataFrame(
             reviews_flattened,
@@ -91,24 +119,44 @@ class FetchGplayReviews(DataPreparationTask):
         language_codes_df = pd.read_csv('src/gplay/language_codes_gplay.csv')
         return language_codes_df['code'].to_list()
 
-    def fetch_for_language(self, language_code):
+    def fetch_for_language(self, language_code, newer_than=None):
         """
         Request reviews for a specific language from the gplay webserver.
 
+        If newer_than is given, only reviews until this date are requested
+        (plus a few older ones). Otherwise, all reviews are requested.
+
         Note: If the language_code is not supported, the gplay api returns
         english reviews.
         """
-        response = requests.get(
-            url=self.url,
-            params={
-                'lang': language_code,
-                # max number of reviews to be fetched. We want all reviews.
-                'num': 1000000 if not self.minimal_mode else 12
-            }
-        )
-        response.raise_for_status()
-
-        reviews = response.json()['results']
+        if self.minimal_mode:
+            num = 12
+        elif newer_than is None:
+            # max number of reviews to be fetched. We want all reviews.
+            num = 1000000
+        else:
+            num = self.batch_size
+
+        while True:
+            response = http_client.get(
+                self.url,
+                params={
+                    'lang': language_code,
+                    'num': num
+                }
+            )
+            response.raise_for_status()
+
+            reviews = response.json()['results']
+            if newer_than is None or self.minimal_mode \
+                    or len(reviews) < num:
+                break
+            oldest_date = min(
+                pd.Timestamp(review['date']).tz_localize(None)
+                for review in reviews)
+            if oldest_date <= newer_than:
+                break
+            num *= 4
 
         for review in reviews:
             yield {
@@ -5,6 +5,7 @@ All data are fetched using the Facebook Graph API. The credentials are shared
 with the access token used in the facebook module. See documentation there.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import base64
 import datetime as dt
 import json
@@ -15,11 +16,11 @@ from dateutil import parser as dtparser
 import luigi
 from luigi.format import UTF8
 import pandas as pd
-from tqdm import tqdm
+import requests
 
 from _utils import CsvToDb, DataPreparationTask, MuseumFacts, QueryDb, logger
 from _utils.data_preparation import PerformanceValueCondenser
-from facebook import API_BASE, try_request_multiple_times
+from facebook import API_BASE, GraphApiClient, try_request_multiple_times
 
 
 # =============== Database Tasks ===============
@@ -47,6 +48,10 @@ class IgPostPerformanceToDb(CsvToDb):
         return FetchIgPostPerformance(
             table=self.table, columns=[col[0] for col in self.columns])
 
+    def run(self):
+        super().run()
+        self.requires().store_poll_schedule()
+
 
 class IgPostsToDb(CsvToDb):
     """Download all fetched Instagram posts into the database."""
@@ -218,12 +223,31 @@ class FetchIgPosts(DataPreparationTask):
 
 
 class FetchIgPostThumbnails(DataPreparationTask):
-    """Fetch thumbnails for all fetched Instagram posts."""
+    """
+    Fetch thumbnails for all fetched Instagram posts.
+
+    Thumbnails are cached in the ig_post table. Only posts without a
+    thumbnail and posts whose thumbnail has expired (see the
+    ig_post_thumbnail_refresh table) are requested again, and only
+    thumbnails that have changed are stored. If a thumbnail cannot be
+    fetched, the post is requested again after an exponential backoff.
+    """
 
     thumbnail_width = 512
     empty_data_uri = 'data:image/png,'
     worker_timeout = 3600  # 60 min
 
+    # After this time, thumbnails are fetched again
+    max_age = dt.timedelta(days=90)
+    # After this time, posts that did not exist are requested again
+    missing_max_age = dt.timedelta(days=30)
+    # After this time, posts whose thumbnail could not be fetched are
+    # requested again. Doubled after every further failure up to
+    # missing_max_age.
+    failure_retry_interval = dt.timedelta(days=1)
+
+    max_workers = 8
+
     def output(self):
         return luigi.LocalTarget(
             f'{self.output_dir}/instagram/ig_post_thumbnails.csv',
@@ -233,32 +257,76 @@ class FetchIgPostThumbnails(DataPreparationTask):
         # Run deps in certain order
         yield IgPostsToDb()
         posts = yield QueryDb(query=f'''
-            SELECT ig_post_id, permalink
+            SELECT ig_post_id, permalink, thumbnail_uri, failures
             FROM {IgPostsToDb.table}  -- # nosec - constant
-            WHERE (length(thumbnail_uri) > 0) IS NOT TRUE
+                LEFT JOIN ig_post_thumbnail_refresh USING (ig_post_id)
+            WHERE next_refresh <= now()
+                OR next_refresh IS NULL
+                    AND (length(thumbnail_uri) > 0) IS NOT TRUE
         ''')
         with posts.open('r') as stream:
-            df = pd.read_csv(stream)
+            df = pd.read_csv(stream, dtype={'ig_post_id': str})
 
-        tqdm.pandas(desc="Downloading thumbnails")
-        demo_count = 0
-
-        def get_thumbnail_uri_demo(permalink):
-            nonlocal demo_count
-            if demo_count > 10:
+        def get_thumbnail_uri(index_and_permalink):
+            index, permalink = index_and_permalink
+            if self.minimal_mode and index > 10:
                 return 'data:demo'
-            demo_count += 1
             return self.get_thumbnail_uri(permalink)
-        get_thumbnail_uri = (
-            self.get_thumbnail_uri
-            if not self.minimal_mode
-            else get_thumbnail_uri_demo)
-        df['thumbnail_uri'] = df['permalink'].progress_apply(get_thumbnail_uri)
-        del df['permalink']
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            uris = list(self.tqdm(
+                executor.map(get_thumbnail_uri, enumerate(df['permalink'])),
+                total=len(df),
+                desc="Downloading thumbnails"))
+        logger.info(f"Fetched {sum(map(bool, uris))} of {len(uris)} "
+                    f"outdated thumbnails")
+
+        df['new_thumbnail_uri'] = uris
+        self.schedule_refreshes(
+            df['ig_post_id'],
+            uris,
+            df['failures'].fillna(0).astype(int).tolist())
+        # Don't overwrite thumbnails that could not be fetched
+        df = df[df['new_thumbnail_uri'].notna()]
+        df = df[df['new_thumbnail_uri'] != df['thumbnail_uri']]
+        df = df[['ig_post_id', 'new_thumbnail_uri']]
+        df.columns = ['ig_post_id', 'thumbnail_uri']
 
         with self.output().open('w') as output_file:
             df.to_csv(output_file, index=False)
 
+    def schedule_refreshes(self, ig_post_ids, uris, failures):
+        """
+        Store when the requested thumbnails need to be requested again.
+
+        uris are None for thumbnails that could not be fetched. failures are
+        the numbers of previous failures in a row for each post.
+        """
+        queries = []
+        for ig_post_id, uri, failures_ in zip(ig_post_ids, uris, failures):
+            if uri is None:
+                failures_ += 1
+                max_age = min(
+                    self.missing_max_age,
+                    self.failure_retry_interval * 2 ** (failures_ - 1))
+            else:
+                failures_ = 0
+                max_age = self.missing_max_age \
+                    if uri == self.empty_data_uri else self.max_age
+            queries.append(('''
+                INSERT INTO ig_post_thumbnail_refresh
+                    (ig_post_id, next_refresh, failures)
+                VALUES (%s, now() + %s, %s)
+                ON CONFLICT (ig_post_id) DO UPDATE
+                    SET next_refresh = EXCLUDED.next_refresh,
+                        failures = EXCLUDED.failures
+            ''', (ig_post_id, max_age, failures_)))
+        if queries:
+            self.db_connector.execute(*queries)
+        failed = sum(uri is None for uri in uris)
+        if failed:
+            logger.warning(f"Could not fetch {failed} thumbnails, "
+                           f"retrying them later")
+
     def get_thumbnail_uri(self, permalink):
         url = self.get_thumbnail_url(permalink)
         if not url:
@@ -266,7 +334,14 @@ class FetchIgPostThumbnails(DataPreparationTask):
         if url == self.empty_data_uri:
             return url
 
-        response = try_request_multiple_times(url)
+        try:
+            response = try_request_multiple_times(url)
+        except requests.HTTPError as error:
+            if error.response is None or error.response.status_code != 404:
+                raise
+            # The thumbnail has disappeared in the meantime, try again later
+            logger.warning(f"Thumbnail for {permalink} not found")
+            return None
         data_type = response.headers['Content-Type']
         data = base64.b64encode(response.content)
         return f'data:{data_type};base64,{data.decode()}'
@@ -281,7 +356,7 @@ class FetchIgPostThumbnails(DataPreparationTask):
                 if response_json['error']['code'] == 24:
                     # Error: "The requested resource does not exist".
                     # Return a truthy value instead of None to avoid redundant
-                    # retrys upon every later execution of the task.
+                    # retrys before missing_max_age has passed.
                     return self.empty_data_uri
             except (KeyError, ValueError):
                 pass
@@ -291,7 +366,11 @@ class FetchIgPostThumbnails(DataPreparationTask):
 
 
 class FetchIgPostPerformance(DataPreparationTask):
-    """Fetch performance values for all fetched Instagram posts."""
+    """
+    Fetch performance values for all fetched Instagram posts.
+
+    Only posts that are due according to the poll_scheduler() are fetched.
+    """
 
     columns = luigi.parameter.ListParameter(description="Column names")
     timespan = luigi.parameter.TimeDeltaParameter(
@@ -333,23 +412,37 @@ class FetchIgPostPerformance(DataPreparationTask):
             if not column.startswith('delta_')])
 
         fetch_time = dt.datetime.now()
-        for i, row in self.tqdm(
-                post_df.iterrows(),
-                desc="Fetching insights for instagram posts",
-                total=len(post_df)):
-            # Fetch only insights for less than 2 months old posts
-            post_time = dtparser.parse(row['timestamp'])
-            if post_time.date() < \
-               fetch_time.date() - self.timespan:
-                continue
-
+        # Fetch only insights for less than 2 months old posts
+        post_df = post_df.loc[[
+            i for i, timestamp in post_df['timestamp'].items()
+            if dtparser.parse(timestamp).date()
+            >= fetch_time.date() - self.timespan
+        ]]
+
+        poll_scheduler = self.poll_scheduler()
+        post_df = post_df[pd.Series(
+            poll_scheduler.is_due(post_df['id'].apply(str).tolist()),
+            index=post_df.index,
+            dtype=bool)]
+
+        def metrics_for(media_type):
             metrics = ','.join(generic_metrics)
-            if row['media_type'] == 'VIDEO':
+            if media_type == 'VIDEO':
                 metrics += ',video_views'  # causes error if used on non-video
+            return metrics
 
-            url = f'{API_BASE}/{row["id"]}/insights?metric={metrics}'
+        logger.info(
+            f"Fetching insights for {len(post_df)} instagram posts")
+        responses = GraphApiClient().get_all([
+            f'{row.id}/insights?metric={metrics_for(row.media_type)}'
+            for row in post_df.itertuples()
+        ])
 
-            response = try_request_multiple_times(url)
+        invalid_count = 0
+        for (i, row), response in zip(post_df.iterrows(), responses):
+            if response.status_code == 400:
+                invalid_count += 1
+                continue
             response_data = response.json()['data']
 
             impressions = response_data[0]['values'][0]['value']
@@ -370,6 +463,8 @@ class FetchIgPostPerformance(DataPreparationTask):
                 saved,
                 video_views
             ]
+        if invalid_count:
+            logger.warning(f"Skipped {invalid_count} posts")
 
         performance_df = self.filter_fkey_violations(performance_df)
         performance_df = self.condense_performance_values(
@@ -377,6 +472,16 @@ class FetchIgPostPerformance(DataPreparationTask):
             delta_function=PerformanceValueCondenser.linear_delta
         )
 
+        # Only stored by IgPostPerformanceToDb after storing the values
+        self.write_poll_schedule(poll_scheduler.next_polls(
+            post_df['id'].apply(str).tolist(),
+            [
+                dtparser.parse(timestamp)
+                .astimezone(dt.timezone.utc).replace(tzinfo=None)
+                for timestamp in post_df['timestamp']
+            ],
+            performance_df['ig_post_id'].tolist()))
+
         with self.output().open('w') as output_file:
             performance_df.to_csv(output_file, index=False, header=True)
 
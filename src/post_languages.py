@@ -0,0 +1,102 @@
+"""
+Provides tasks for detecting the language of all posts.
+
+Detecting languages is expensive, so the results are cached in the table
+post_language. Every post is identified by its source, its ID, and a hash of
+its text, so languages are only detected again if the text of a post has
+changed. Other tasks that need the language of posts can join this table
+(see TopicModelingCreateCorpus for an example).
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import langdetect
+from langdetect.lang_detect_exception import LangDetectException
+import luigi
+from luigi.format import UTF8
+import pandas as pd
+
+from _utils import CsvToDb, DataPreparationTask, QueryDb
+from _posts import PostsToDb
+
+# langdetect is non-deterministic unless it is seeded
+langdetect.DetectorFactory.seed = 0
+
+
+class PostLanguagesToDb(CsvToDb):
+    """Store the detected languages of all posts into the database."""
+
+    table = 'post_language'
+
+    def requires(self):
+
+        return DetectPostLanguages()
+
+
+class DetectPostLanguages(DataPreparationTask):
+    """Detect the language of all posts that are not yet in the cache."""
+
+    table = 'post_language'
+
+    n_processes = luigi.IntParameter(
+        default=-1,
+        description="The number of processes to detect languages in. If -1, "
+                    "all CPUs will be used.")
+
+    def _requires(self):
+
+        return luigi.task.flatten([
+            PostsToDb(),
+            super()._requires()
+        ])
+
+    def requires(self):
+
+        return QueryDb(query=f'''
+            SELECT source, post_id, md5(text) AS text_hash, text
+            FROM post
+            WHERE text IS NOT NULL
+            AND NOT EXISTS (
+                SELECT NULL
+                FROM {self.table}
+                WHERE ({self.table}.source, {self.table}.post_id, text_hash)
+                    = (post.source, post.post_id, md5(post.text))
+            )
+        ''')
+
+    def output(self):
+
+        return luigi.LocalTarget(
+            f'{self.output_dir}/post_languages.csv',
+            format=UTF8
+        )
+
+    def run(self):
+
+        with self.input().open('r') as stream:
+            df = pd.read_csv(
+                stream,
+                dtype={'post_id': str, 'text': str},
+                keep_default_na=False
+            )
+
+        with ProcessPoolExecutor(
+                max_workers=self.n_processes if self.n_processes > 0
+                else None) as executor:
+            df['language'] = list(self.tqdm(
+                executor.map(detect_language, df['text'], chunksize=100),
+                total=len(df),
+                desc="Detecting post languages"
+            ))
+
+        with self.output().open('w') as stream:
+            df.drop(columns='text').to_csv(stream, index=False)
+
+
+def detect_language(text):
+    """Detect the language of the text. Answer None if this is impossible."""
+    try:
+        return langdetect.detect(text)
+    except LangDetectException:
+        # langdetect can not handle emoji-only and link-only texts
+        return None
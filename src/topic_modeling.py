@@ -30,20 +30,31 @@ the minimal runs.
 This only applies if the minimal run uses a fresh test database.
 """
 
-from collections import defaultdict
-import logging
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 import pickle  # nosec: We only use pickle for self-generated files.
+import time
+import zlib
 
-from gsdmm import MovieGroupProcess
-import langdetect
 import luigi
 from luigi.format import UTF8
 from nltk.tokenize import word_tokenize
+import numpy as np
 import pandas as pd
 from stop_words import get_stop_words
 
-from _utils import CsvToDb, DataPreparationTask, StreamToLogger, logger
+from _utils import CsvToDb, DataPreparationTask, logger
 from _posts import PostsToDb
+from post_languages import PostLanguagesToDb, detect_language
+from topic_modeling_gsdmm import MovieGroupProcess
+
+# Expensive intermediate results are cached across runs. Unlike the output
+# directory, this directory is not cleaned up after every run.
+CACHE_DIR = 'secret_files/topic_modeling'
+# Increment this whenever a change of the preprocessing or the training
+# invalidates the cached results
+CACHE_VERSION = 1
 
 
 class TopicModeling(luigi.WrapperTask):
@@ -150,10 +161,26 @@ class TopicModelingFindTopics(DataPreparationTask):
     Dirichlet Multinomial Mixture model' (GSDMM). This algorithms
     is designed specifically for short text topic modeling. Link to the paper:
     http://dbgroup.cs.tsinghua.edu.cn/wangjy/papers/KDD14-GSDMM.pdf
+
+    Trained models are cached across runs, so only models whose docs have
+    changed (usually the current year and 'all') need to be retrained.
     """
 
+    n_processes = luigi.IntParameter(
+        default=-1,
+        description="The number of processes to train models in. If -1, all "
+                    "CPUs will be used.")
+
+    seed = luigi.IntParameter(
+        default=0,
+        description="The random seed to train the models with")
+
+    cache_dir = luigi.Parameter(
+        default=CACHE_DIR,
+        description="The directory to cache trained models in across runs")
+
     def requires(self):
-        return TopicModelingPreprocessCorpus()
+        return TopicModelingPreprocessCorpus(cache_dir=self.cache_dir)
 
     def output(self):
         yield luigi.LocalTarget(
@@ -180,69 +207,101 @@ class TopicModelingFindTopics(DataPreparationTask):
 
     def find_topics(self, docs):
         # one model per year
-        models = {'all'}
-        for doc in docs:
-            models.add(str(doc.post_date.year))
+        model_names = sorted({'all', *(
+            str(doc.post_date.year) for doc in docs
+        )})
+        docs_by_model = {
+            model_name: [doc for doc in docs if doc.in_year(model_name)]
+            for model_name in model_names
+        }
 
         # accumulate topic predictions and important terms
         # for the different models in these variables.
         text_dfs = []
         topic_dfs = []
 
-        for model_name in models:
-            docs_in_timespan = [
-                doc for doc in docs if doc.in_year(model_name)
-            ]
-
-            # allow for more topics if all posts are used
-            model = self.train_mgp(
-                docs_in_timespan,
-                K=12 if model_name else 10
-            )
-
-            for doc in docs_in_timespan:
-                doc.predict(model, model_name)
-
-            # cols: text,source,post_date,topic,model_name
-            text_df = pd.DataFrame([doc.to_dict() for doc in docs_in_timespan])
-
-            # cols: topic,term,count,model
-            out = []
-            for i, topic_terms in enumerate(self.top_terms(model)):
-                for term in topic_terms:
-                    out.append({
-                        'topic': i,
-                        'term': term[0],
-                        'count': term[1],
+        # Models are independent of each other, so train them in parallel
+        with ProcessPoolExecutor(
+                max_workers=self.n_processes if self.n_processes > 0
+                else None) as executor:
+            results, trainings = {}, {}
+            for model_name, docs_in_timespan in docs_by_model.items():
+                seed = self.model_seed(model_name)
+                # allow for more topics if all posts are used
+                params = dict(K=12 if model_name else 10)
+                fingerprint = compute_fingerprint(
+                    CACHE_VERSION, seed, params, *(
+                        (doc.source, doc.post_id, doc.tokens)
+                        for doc in docs_in_timespan
+                    ))
+                cache = self.model_cache(model_name)
+                cached = load_cache(cache, fingerprint)
+                if cached is not None:
+                    logger.info(f"Reusing topic model '{model_name}'")
+                    results[model_name] = cached
+                    continue
+                trainings[model_name] = (cache, fingerprint, executor.submit(
+                    train_topic_model,
+                    [doc.tokens for doc in docs_in_timespan],
+                    seed=seed,
+                    **params
+                ))
+
+            for model_name in model_names:
+                if model_name in trainings:
+                    cache, fingerprint, future = trainings[model_name]
+                    model, topics, duration = future.result()
+                    logger.info(
+                        f"Trained topic model '{model_name}' in "
+                        f"{duration:.1f} s")
+                    results[model_name] = model, topics
+                    store_cache(cache, fingerprint, results[model_name])
+                model, topics = results[model_name]
+                docs_in_timespan = docs_by_model[model_name]
+                top_terms = self.top_terms(model)
+
+                # name topics
+                topic_names = [
+                    terms[0][0] if terms else None
+                    for terms in top_terms
+                ]
+
+                for doc, topic in zip(docs_in_timespan, topics):
+                    doc.topic = topic_names[topic]
+                    doc.model_name = model_name
+
+                # cols: text,source,post_date,topic,model_name
+                text_df = pd.DataFrame(
+                    [doc.to_dict() for doc in docs_in_timespan])
+
+                # cols: topic,term,count,model
+                topic_df = pd.DataFrame([
+                    {
+                        'topic': topic_names[i],
+                        'term': term,
+                        'count': count,
                         'model': model_name
-                    })
-            topic_df = pd.DataFrame(out)
-
-            # name topics
-            topic_df['topic'] = topic_df['topic'].apply(
-                lambda x: self.top_terms(model)[x][0][0])
-            text_df['topic'] = text_df['topic'].apply(
-                lambda x: self.top_terms(model)[x][0][0])
+                    }
+                    for i, topic_terms in enumerate(top_terms)
+                    for term, count in topic_terms
+                ])
 
-            text_dfs.append(text_df)
-            topic_dfs.append(topic_df)
+                text_dfs.append(text_df)
+                topic_dfs.append(topic_df)
 
         return pd.concat(topic_dfs), pd.concat(text_dfs)
 
-    def train_mgp(
-            self,
-            docs,
-            K=10,  # noqa: N803
-            alpha=0.1, beta=0.1,
-            n_iters=30
-            ):
-        vocab = set(x for doc in docs for x in doc.tokens)
-        n_terms = len(vocab)
-
-        mgp = MovieGroupProcess(K=K, alpha=alpha, beta=beta, n_iters=n_iters)
-        with StreamToLogger(log_level=logging.DEBUG).activate():
-            mgp.fit([doc.tokens for doc in docs], n_terms)
-        return mgp
+    def model_cache(self, model_name):
+        """Answer the target to cache the model and its predictions in."""
+        return luigi.LocalTarget(
+            f'{self.cache_dir}/model_{model_name}.pkl',
+            format=luigi.format.Nop
+        )
+
+    def model_seed(self, model_name):
+        """Derive a random seed for the given model from the task's seed."""
+        # Don't use hash() because it is salted for each process
+        return (self.seed + zlib.crc32(model_name.encode())) % 2 ** 32
 
     def top_terms(self, model, n=20):
         top_terms = []
@@ -265,18 +324,25 @@ class TopicModelingPreprocessCorpus(DataPreparationTask):
     - removing non-german Docs
     - discarding Docs with less than three tokens
     - removing tokens that appear only once in the entire corpus
+
+    The result of the steps that apply to single Docs is cached per year
+    across runs and reused as long as the posts of the year do not change.
     """
 
+    cache_dir = luigi.Parameter(
+        default=CACHE_DIR,
+        description="The directory to cache preprocessed docs in across runs")
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.stop_words = [
+        self.stop_words = {
             *get_stop_words('german'),
             *get_stop_words('english'),
             *['http', 'https', 'www', 'com', 'de', 'google', 'translated',
               'twitter', 'fur', 'uber', 'html', 'barberini',
               'museumbarberini', 'museum', 'ausstellung', 'ausstellungen',
               'potsdam', 'mal']
-        ]
+        }
 
     def requires(self):
         return TopicModelingCreateCorpus()
@@ -299,6 +365,44 @@ class TopicModelingPreprocessCorpus(DataPreparationTask):
 
     def preprocess(self, docs):
 
+        docs_by_year = defaultdict(list)
+        for doc in docs:
+            year = doc.post_date.year if doc.post_date else None
+            docs_by_year[year].append(doc)
+
+        docs = [
+            doc
+            for year, docs_in_year in docs_by_year.items()
+            for doc in self.preprocess_year(year, docs_in_year)
+        ]
+
+        return self.preprocess_corpus(docs)
+
+    def preprocess_year(self, year, docs):
+        """Preprocess the docs of a year, using the cache if possible."""
+        if year is None:
+            return self.preprocess_docs(docs)
+
+        fingerprint = compute_fingerprint(
+            CACHE_VERSION, sorted(self.stop_words), *(
+                (doc.source, doc.post_id, doc.post_date, doc.text)
+                for doc in docs
+            ))
+        cache = luigi.LocalTarget(
+            f'{self.cache_dir}/corpus_{year}.pkl',
+            format=luigi.format.Nop
+        )
+        cached_docs = load_cache(cache, fingerprint)
+        if cached_docs is not None:
+            logger.info(f"Reusing preprocessed corpus of {year}")
+            return cached_docs
+
+        docs = self.preprocess_docs(docs)
+        store_cache(cache, fingerprint, docs)
+        return docs
+
+    def preprocess_docs(self, docs):
+        """Apply all preprocessing steps that only concern single docs."""
         # remove leading 'None' (introduced by DB export)
         for doc in docs:
             doc.text = doc.text.replace('None ', '', 1)
@@ -307,31 +411,33 @@ class TopicModelingPreprocessCorpus(DataPreparationTask):
         docs = [doc for doc in docs if doc.guess_language() == 'de']
 
         for doc in docs:
-            doc.tokens = doc.text.lower()
-            doc.tokens = word_tokenize(doc.tokens)
-            # remove stop words
-            doc.tokens = [token for token in doc.tokens
-                          if token not in self.stop_words]
-            # keep only alphabetical tokens
-            doc.tokens = [token for token in doc.tokens
-                          if token.isalpha()]
-            # remove single-digit tokens
-            doc.tokens = [token for token in doc.tokens
-                          if len(token) > 1]
+            doc.tokens = [
+                token
+                for token in word_tokenize(doc.text.lower())
+                # remove stop words, keep only alphabetical tokens, and
+                # remove single-digit tokens
+                if token not in self.stop_words
+                and token.isalpha()
+                and len(token) > 1
+            ]
+
+        return docs
 
+    def preprocess_corpus(self, docs):
+        """Apply all preprocessing steps that concern the entire corpus."""
         # remove tokens that appear only once
-        tokens = defaultdict(lambda: 0)
+        counts = Counter(token for doc in docs for token in doc.tokens)
         for doc in docs:
-            for token in doc.tokens:
-                tokens[token] += 1
-        for doc in docs:
-            for token in doc.tokens:
-                if tokens[token] == 1:
-                    doc.tokens.remove(token)
+            doc.tokens = [token for token in doc.tokens if counts[token] > 1]
 
         # remove very short docs
         docs = [doc for doc in docs if not doc.too_short()]
 
+        # store tokens compactly when pickling the corpus
+        vocabulary = Vocabulary(token for doc in docs for token in doc.tokens)
+        for doc in docs:
+            doc.vocabulary = vocabulary
+
         return docs
 
 
@@ -345,6 +451,7 @@ class TopicModelingCreateCorpus(DataPreparationTask):
 
     def requires(self):
         yield PostsToDb()
+        yield PostLanguagesToDb()
 
     def output(self):
         return luigi.LocalTarget(
@@ -355,12 +462,22 @@ class TopicModelingCreateCorpus(DataPreparationTask):
     def run(self):
 
         texts = self.db_connector.query('''
-            SELECT text, source, post_date, post_id
+            SELECT
+                text, post.source, post_date, post.post_id, language,
+                post_language.text_hash IS NOT NULL
             FROM post
+            LEFT JOIN post_language ON (
+                post_language.source, post_language.post_id, text_hash
+            ) = (
+                post.source, post.post_id, md5(post.text)
+            )
             WHERE NOT is_from_museum AND text IS NOT NULL
+            ORDER BY post.source, post.post_id
         ''')
         corpus = [
-            Doc(row[0], row[1], row[2], row[3])
+            Doc(
+                row[0], row[1], row[2], row[3],
+                language=row[4], language_cached=row[5])
             for row in texts if row[0] is not None
         ]
 
@@ -376,15 +493,37 @@ class Doc:
     """
 
     def __init__(self, text, source=None, post_date=None,
-                 post_id=None, tokens=None):
+                 post_id=None, tokens=None, language=None,
+                 language_cached=False):
         self.text = text
         self.source = source
         self.post_date = post_date
         self.post_id = post_id
         self.tokens = tokens
+        self.vocabulary = None
         self.topic = None
         self.model_name = None
-        self.language = None
+        self.language = language
+        # language is None if it could not be detected, so track separately
+        # whether it is known at all
+        self.language_cached = language_cached or language is not None
+
+    def __getstate__(self):
+        """Answer the state to pickle, with tokens encoded as IDs."""
+        state = self.__dict__.copy()
+        # store tokens as IDs of the shared vocabulary
+        if self.vocabulary is not None:
+            state['tokens'] = self.vocabulary.encode(self.tokens)
+        return state
+
+    def __setstate__(self, state):
+        """Restore a pickled state, also from before vocabularies."""
+        state.setdefault('vocabulary', None)
+        state.setdefault(
+            'language_cached', state.get('language') is not None)
+        self.__dict__.update(state)
+        if self.vocabulary is not None:
+            self.tokens = self.vocabulary.decode(self.tokens)
 
     def in_year(self, year):
         if year == 'all':
@@ -394,17 +533,14 @@ class Doc:
     def too_short(self):
         return len(self.tokens) <= 2
 
-    def predict(self, model, model_name):
-        self.topic = model.choose_best_label(self.tokens)[0]
-        self.model_name = model_name
-
     def guess_language(self):
-        try:
-            return langdetect.detect(self.text)
-        except langdetect.lang_detect_exception.LangDetectException as e:
-            # langdetect can not handle emoji-only and link-only texts
-            logger.debug(f'langdetect failed for one Doc. Error: {e}')
-            logger.debug(f'Failure happened for Doc {self.to_dict()}')
+        if not self.language_cached:
+            # not cached in post_language
+            self.language = detect_language(self.text)
+            self.language_cached = True
+            if self.language is None:
+                logger.debug(f'langdetect failed for Doc {self.to_dict()}')
+        return self.language
 
     def to_dict(self):
         return {
@@ -415,3 +551,87 @@ class Doc:
             'topic': self.topic,
             'model_name': self.model_name
         }
+
+
+class Vocabulary:
+    """
+    A mapping between tokens and integer IDs that is shared by many Docs.
+
+    When a corpus is pickled, the vocabulary is stored only once and every
+    Doc stores its tokens as an array of IDs.
+    """
+
+    def __init__(self, tokens=()):
+        self.tokens = list(dict.fromkeys(tokens))
+        self.ids = {token: id_ for id_, token in enumerate(self.tokens)}
+
+    def __getstate__(self):
+        """Answer the state to pickle, the IDs are derived on unpickling."""
+        return {'tokens': self.tokens}
+
+    def __setstate__(self, state):
+        """Restore a pickled state and rebuild the ID mapping."""
+        self.__init__(state['tokens'])
+
+    def encode(self, tokens):
+        """Answer the IDs of the tokens. All tokens must be known."""
+        return np.fromiter(
+            (self.ids[token] for token in tokens),
+            dtype=np.int32,
+            count=len(tokens)
+        )
+
+    def decode(self, ids):
+        """Answer the tokens for the IDs."""
+        return [self.tokens[id_] for id_ in ids]
+
+
+def compute_fingerprint(*values):
+    """Answer a hash identifying the given values by their repr."""
+    return hashlib.sha256(repr(values).encode()).hexdigest()
+
+
+def load_cache(target, fingerprint):
+    """Load the cached value from the target if it is still up to date."""
+    if not target.exists():
+        return None
+    with target.open('r') as stream:
+        cached_fingerprint, value = pickle.load(stream)  # nosec
+    return value if cached_fingerprint == fingerprint else None
+
+
+def store_cache(target, fingerprint, value):
+    """Cache the value into the target, identified by the fingerprint."""
+    with target.open('w') as stream:
+        pickle.dump((fingerprint, value), stream)
+
+
+def train_topic_model(docs, seed, **kwargs):
+    """
+    Train a GSDMM model and predict the topic of each doc.
+
+    This function is meant to be run in a separate process. The trained
+    model, the predicted topics, and the wall time are returned.
+    """
+    start = time.perf_counter()
+    np.random.seed(seed)
+
+    model = train_mgp(docs, **kwargs)
+    topics = [model.choose_best_label(doc)[0] for doc in docs]
+
+    return model, topics, time.perf_counter() - start
+
+
+def train_mgp(
+        docs,
+        K=10,  # noqa: N803
+        alpha=0.1, beta=0.1,
+        n_iters=30
+        ):
+    """Fit a GSDMM model (MovieGroupProcess) on the tokenized docs."""
+    vocab = set(x for doc in docs for x in doc)
+    n_terms = len(vocab)
+
+    mgp = MovieGroupProcess(K=K, alpha=alpha, beta=beta, n_iters=n_iters)
+    mgp.fit(docs, n_terms)
+    return mgp
@@ -0,0 +1,181 @@
+"""
+Provides a vectorized implementation of the GSDMM topic model.
+
+GSDMM is the 'Gibbs Sampling algorithm for the Dirichlet Multinomial Mixture
+model' (see topic_modeling.py). This implementation is meant as a drop-in
+replacement for gsdmm.MovieGroupProcess: it follows the same sampling
+procedure and scoring formula and exposes the same interface (fit(),
+choose_best_label(), and cluster_word_distribution), but instead of storing
+the state in dicts and looping over every token in Python, all counts are
+stored in integer arrays over an integer vocabulary and the conditional
+probabilities of all clusters are computed at once for each document.
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from scipy.special import gammaln
+
+from _utils import logger
+
+
+class MovieGroupProcess:
+    """The GSDMM topic model for short texts."""
+
+    def __init__(self, K=8, alpha=0.1, beta=0.1, n_iters=30):  # noqa: N803
+
+        self.K = K
+        self.alpha = alpha
+        self.beta = beta
+        self.n_iters = n_iters
+
+        self.number_docs = None
+        self.vocab_size = None
+        self.vocab: Dict[str, int] = {}
+        self.words: List[str] = []
+
+        # Number of documents per cluster
+        self.cluster_doc_count = np.zeros(K, dtype=np.int64)
+        # Number of words per cluster
+        self.cluster_word_count = np.zeros(K, dtype=np.int64)
+        # Number of occurrences of each word (rows) per cluster (columns)
+        self.word_cluster_count = np.zeros((0, K), dtype=np.int64)
+
+    @property
+    def cluster_word_distribution(self) -> List[Dict[str, int]]:
+        """Answer the number of occurrences of each word per cluster."""
+        return [
+            {
+                self.words[word_id]: int(counts[word_id])
+                for word_id in np.flatnonzero(counts)
+            }
+            for counts in self.word_cluster_count.T
+        ]
+
+    def fit(self, docs: Sequence[Sequence[str]], vocab_size: int):
+        """
+        Cluster the documents.
+
+        Answer the list of cluster labels of the documents.
+        """
+        K, n_iters = self.K, self.n_iters  # noqa: N806
+        self.number_docs = len(docs)
+        self.vocab_size = vocab_size
+
+        self.vocab = {}
+        docs = [self._encode(doc, extend_vocab=True) for doc in docs]
+        self.words = list(self.vocab)
+
+        m_z = self.cluster_doc_count = np.zeros(K, dtype=np.int64)
+        n_z = self.cluster_word_count = np.zeros(K, dtype=np.int64)
+        n_w_z = self.word_cluster_count = np.zeros(
+            (len(self.words), K), dtype=np.int64)
+
+        # choose a random initial cluster for each doc
+        d_z = np.random.randint(K, size=len(docs))
+        for z, (word_ids, counts, size) in zip(d_z, docs):
+            m_z[z] += 1
+            n_z[z] += size
+            n_w_z[word_ids, z] += counts
+
+        cluster_count = K
+        for iteration in range(n_iters):
+            total_transfers = 0
+
+            for i, (word_ids, counts, size) in enumerate(docs):
+                # remove the doc from its current cluster
+                z_old = d_z[i]
+                m_z[z_old] -= 1
+                n_z[z_old] -= size
+                n_w_z[word_ids, z_old] -= counts
+
+                # draw sample from distribution to find new cluster
+                cumulative_p = np.exp(
+                    self._log_score(word_ids, counts, size)
+                ).cumsum()
+                z_new = min(
+                    cumulative_p.searchsorted(
+                        np.random.random_sample() * cumulative_p[-1]),
+                    K - 1)
+
+                # transfer doc to the new cluster
+                if z_new != z_old:
+                    total_transfers += 1
+                d_z[i] = z_new
+                m_z[z_new] += 1
+                n_z[z_new] += size
+                n_w_z[word_ids, z_new] += counts
+
+            cluster_count_new = np.count_nonzero(m_z)
+            logger.debug(
+                f"In stage {iteration}: transferred {total_transfers} "
+                f"clusters with {cluster_count_new} clusters populated")
+            if total_transfers == 0 and cluster_count_new == cluster_count \
+                    and iteration > 25:
+                logger.debug("Converged. Breaking out.")
+                break
+            cluster_count = cluster_count_new
+
+        return d_z.tolist()
+
+    def score(self, doc: Sequence[str]) -> np.ndarray:
+        """Answer the probability of the document for each cluster."""
+        p = np.exp(self._log_score(*self._encode(doc)))
+        return p / p.sum()
+
+    def choose_best_label(self, doc: Sequence[str]) -> Tuple[int, float]:
+        """Answer the most likely cluster and its probability."""
+        p = self.score(doc)
+        label = int(np.argmax(p))
+        return label, p[label]
+
+    def _encode(self, doc, extend_vocab=False):
+        """
+        Convert a document into a bag of word IDs.
+
+        Answer the unique word IDs, their counts, and the length of the doc.
+        Unknown words are ignored unless extend_vocab is True, but they are
+        still considered in the length.
+        """
+        if extend_vocab:
+            word_ids = [
+                self.vocab.setdefault(word, len(self.vocab))
+                for word in doc
+            ]
+        else:
+            word_ids = [
+                self.vocab[word]
+                for word in doc
+                if word in self.vocab
+            ]
+        word_ids, counts = np.unique(
+            np.array(word_ids, dtype=np.int64),
+            return_counts=True)
+        return word_ids, counts, len(doc)
+
+    def _log_score(self, word_ids, counts, size):
+        """
+        Answer the unnormalized log probability of the doc for each cluster.
+
+        The maximum is always 0, so the exponential function cannot underflow
+        for all clusters.
+        """
+        alpha, beta, V = self.alpha, self.beta, self.vocab_size  # noqa: N806
+
+        # We break the formula into the following pieces
+        # p = N1*N2/(D1*D2) = exp(lN1 - lD1 + lN2 - lD2)
+        # lN1 = log(m_z[z] + alpha)
+        # lD1 = log(D - 1 + K*alpha)
+        # lN2 = log(product(n_z_w[w] + beta)) = sum(log(n_z_w[w] + beta))
+        # lD2 = log(product(n_z[d] + V*beta + i - 1))
+        #     = sum(log(n_z[d] + V*beta + i - 1))
+        #     = lgamma(n_z[d] + V*beta + len(doc)) - lgamma(n_z[d] + V*beta)
+        # lD1 is equal for all clusters, so it cancels out by normalization.
+        # So does log(beta) that every unknown word would add to lN2.
+        l_n1 = np.log(self.cluster_doc_count + alpha)
+        l_n2 = counts @ np.log(self.word_cluster_count[word_ids] + beta)
+        l_d2_base = self.cluster_word_count + V * beta
+        l_d2 = gammaln(l_d2_base + size) - gammaln(l_d2_base)
+
+        log_p = l_n1 + l_n2 - l_d2
+        return log_p - log_p.max()
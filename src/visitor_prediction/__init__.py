@@ -1,14 +1,16 @@
 """
 Provides analysis tasks to make predict the number of museum visitors.
 
-6 prediction sets are made, predictions for the next 1/7/30 days and sample
-predictions of the last 1/7/30 days. All sets are stored in the same relation.
+2 prediction sets are made, a prediction for the next 30 days and a sample
+prediction of the last 30 days. Both sets are stored in the same relation.
+Alternative models can be compared by backtesting them on past entries.
 
 Developed by Georg Tennigkeit as part of his Bachelor Thesis in 2020.
 See https://gitlab.hpi.de/georg.tennigkeit/ba-visitor-prediction.
 """
 
+from .backtesting import BacktestResultsToDb
 from .predict import PredictionsToDb
 
 
-__all__ = [PredictionsToDb]
+__all__ = [BacktestResultsToDb, PredictionsToDb]
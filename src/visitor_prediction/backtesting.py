@@ -0,0 +1,145 @@
+"""
+Provides tasks for evaluating visitor prediction models on past entries.
+
+Backtesting simulates past predictions: for a number of cutoff dates
+(rolling origin), every candidate model is trained on the entries up to the
+cutoff and predicts the following days, which are compared to the actual
+entries. Together with the CPU time spent for training and predicting, the
+resulting errors allow to choose a model as gomus_daily_entry grows.
+"""
+
+import time
+
+import joblib
+import luigi
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import Ridge
+from sklearn.neighbors import KNeighborsRegressor
+
+from _utils import CsvToDb
+from .predict import (
+    N_NEIGHBORS, TIMESPAN, PredictVisitors,
+    denormalize_entries, normalize_entries, predict_entries, train_model)
+from .preprocessing import preprocess_entries
+
+
+CANDIDATES = {
+    f'knn_{N_NEIGHBORS}': KNeighborsRegressor(n_neighbors=N_NEIGHBORS),
+    'knn_3': KNeighborsRegressor(n_neighbors=3),
+    'knn_10': KNeighborsRegressor(n_neighbors=10),
+    f'knn_{N_NEIGHBORS}_distance': KNeighborsRegressor(
+        n_neighbors=N_NEIGHBORS, weights='distance'),
+    'ridge': Ridge(),
+    'random_forest': RandomForestRegressor(n_estimators=100, random_state=0)
+}
+
+
+class BacktestResultsToDb(CsvToDb):
+    """Store the backtesting results of all candidate models."""
+
+    table = 'visitor_prediction_backtest'
+    replace_content = True
+
+    def requires(self):
+        return BacktestVisitorPrediction(days_to_predict=TIMESPAN)
+
+
+class BacktestVisitorPrediction(PredictVisitors):
+    """
+    Evaluate all candidate models for predicting the number of visitors.
+
+    The entries of all days are preprocessed only once and shared by all
+    evaluations, which are run in parallel.
+    """
+
+    n_cutoffs = luigi.IntParameter(
+        default=12,
+        description="maximum number of cutoff dates to predict from")
+    cutoff_step = luigi.IntParameter(
+        default=30,
+        description="number of known days between two cutoff dates")
+    n_jobs = luigi.IntParameter(
+        default=-1,
+        description="number of parallel evaluations, -1 for all CPUs")
+
+    def output(self):
+        return luigi.LocalTarget(
+            f'{self.output_dir}/visitor_prediction/backtest'
+            f'_{self.days_to_predict}_days_ahead.csv',
+            format=luigi.format.UTF8)
+
+    def run(self):
+        all_entries, exhibitions, facts = self.load_input()
+        actual_entries = all_entries['entries'].copy()
+        cutoffs = self.select_cutoffs(all_entries.index)
+
+        all_entries = preprocess_entries(all_entries, exhibitions, facts)
+
+        results = joblib.Parallel(n_jobs=self.n_jobs)(
+            joblib.delayed(evaluate_model)(
+                name, model,
+                all_entries, actual_entries,
+                cutoff, self.days_to_predict)
+            for cutoff in cutoffs
+            for name, model in CANDIDATES.items()
+        )
+        results = pd.DataFrame(results)
+
+        with self.output().open('w') as output_file:
+            results.to_csv(output_file, index=False, header=True)
+
+    def select_cutoffs(self, dates):
+        """Answer the cutoff dates to evaluate from, latest first."""
+        # Leave enough days before the first cutoff to train any candidate
+        min_train_days = max(
+            getattr(model, 'n_neighbors', 1)
+            for model in CANDIDATES.values())
+        return [
+            dates[position]
+            for position in range(
+                len(dates) - self.days_to_predict - 1,
+                min_train_days - 2,
+                -self.cutoff_step
+            )
+        ][:self.n_cutoffs]
+
+
+def evaluate_model(
+        name, model,
+        all_entries, actual_entries,
+        cutoff, days_to_predict):
+    """
+    Train a candidate model until the cutoff and predict the following days.
+
+    The entries must be preprocessed but not normalized, the scalers are fit
+    on the training days only. Answer the errors of the prediction and the
+    CPU time spent.
+    """
+    cutoff_end = cutoff + pd.Timedelta(days=days_to_predict)
+    entries = all_entries[all_entries.index <= cutoff_end].copy()
+    entries_scaler = normalize_entries(entries, fit_until=cutoff)
+    train_entries = entries[entries.index <= cutoff]
+    to_be_predicted_entries = entries[entries.index > cutoff]
+
+    start = time.process_time()
+    model = train_model(train_entries, clone(model))
+    fit_time = time.process_time() - start
+
+    start = time.process_time()
+    predictions = predict_entries(model, to_be_predicted_entries)
+    predict_time = time.process_time() - start
+
+    errors = denormalize_entries(entries_scaler, predictions) \
+        - actual_entries[to_be_predicted_entries.index].values
+    return {
+        'model': name,
+        'cutoff_date': cutoff.date(),
+        'days_to_predict': days_to_predict,
+        'mae': np.abs(errors).mean(),
+        'rmse': np.sqrt((errors ** 2).mean()),
+        'fit_cpu_seconds': fit_time,
+        'predict_cpu_seconds': predict_time
+    }
@@ -1,8 +1,7 @@
 """Estimate the popularity for each exhibition."""
 
-import datetime as dt
-
 import luigi
+import numpy as np
 import pandas as pd
 
 from _utils import DataPreparationTask, QueryDb
@@ -55,23 +54,7 @@ class ExhibitionPopularity(DataPreparationTask):
             )
 
         # match posts with announced exhibitions
-        def find_related_exhib(post):
-            mentioned_exhibitions = []
-            for exhib in exhibitions.itertuples():
-                if exhib.special:
-                    continue
-
-                first_title_half = exhib.title.split('.')[0]
-                simple_text = simplify_text(str(post['text']))
-                simple_title = simplify_text(first_title_half)
-                if simple_title in simple_text and \
-                    exhib.start_date - dt.timedelta(days=360) \
-                        < post['post_date'] < exhib.start_date:
-                    mentioned_exhibitions.append(exhib.title)
-            return mentioned_exhibitions[0] \
-                if len(mentioned_exhibitions) == 1\
-                else None  # avoid ambiguity
-        posts['announces'] = posts.apply(find_related_exhib, axis=1)
+        posts['announces'] = find_announced_exhibitions(posts, exhibitions)
 
         announcing_posts = posts.dropna(subset=['announces'])
 
@@ -82,19 +65,55 @@ class ExhibitionPopularity(DataPreparationTask):
             if len(announcing_posts) > 0 else 0.0
 
         # assign to exhibitions
-        for exhibition in exhibitions.itertuples():
-            try:
-                popularity = popul_per_exhib.loc[exhibition.title]['likes']
-            except KeyError:
-                popularity = average_max_likes
-            exhibitions.loc[
-                exhibitions['title'] == exhibition.title, 'popularity'
-                ] = popularity
+        exhibitions['popularity'] = exhibitions['title'].map(
+            popul_per_exhib['likes']
+        ).fillna(average_max_likes)
 
         with self.output().open('w') as output_file:
             exhibitions.to_csv(output_file, index=False, header=True)
 
 
+def find_announced_exhibitions(posts, exhibitions):
+    """
+    Find the exhibition that is announced by each post.
+
+    A post announces an exhibition if it mentions the first sentence of its
+    title and was published within 360 days before the exhibition started.
+    Posts that announce multiple exhibitions are ignored to avoid ambiguity.
+    Answer a series of exhibition titles (or None) for the posts.
+
+    To avoid comparing every post with every exhibition, the posts are
+    sorted by date, so the posts published before each exhibition can be
+    looked up by binary search. Only these texts are searched for the title.
+    """
+    exhibitions = exhibitions[~exhibitions['special'].astype(bool)]
+
+    simple_texts = [simplify_text(str(text)) for text in posts['text']]
+    post_dates = posts['post_date'].values
+    order = np.argsort(post_dates, kind='stable')
+    sorted_dates = post_dates[order]
+
+    start_dates = exhibitions['start_date'].values
+    lows = np.searchsorted(
+        sorted_dates,
+        start_dates - np.timedelta64(360, 'D'),
+        side='right')
+    highs = np.searchsorted(sorted_dates, start_dates, side='left')
+
+    announced = np.full(len(posts), None, dtype=object)
+    mention_counts = np.zeros(len(posts), dtype=int)
+    for title, low, high in zip(exhibitions['title'], lows, highs):
+        first_title_half = title.split('.')[0]
+        simple_title = simplify_text(first_title_half)
+        for position in order[low:high]:
+            if simple_title in simple_texts[position]:
+                announced[position] = title
+                mention_counts[position] += 1
+
+    announced[mention_counts != 1] = None
+    return pd.Series(announced, index=posts.index)
+
+
 def simplify_text(text):
     """Simplify a text by filtering out non-alphanumeric characters."""
     return ''.join(s for s in text if s.isalnum()).lower()
@@ -4,6 +4,7 @@ import datetime as dt
 import json
 
 import luigi
+import numpy as np
 import pandas as pd
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.preprocessing import MinMaxScaler
@@ -15,7 +16,6 @@ from .preprocessing import preprocess_entries
 
 
 N_NEIGHBORS = 5
-SEQUENCE_LENGTH = 1
 # These parameters as well as conventions
 # in training models were optimized as part of
 # https://gitlab.hpi.de/georg.tennigkeit/ba-visitor-prediction
@@ -29,41 +29,23 @@ class PredictionsToDb(CsvToDb):
     replace_content = True
 
     def requires(self):
-        return CombinePredictions()
-
-
-class CombinePredictions(DataPreparationTask):
-    """Combine visitor predictions for different timespans."""
-
-    def output(self):
-        return luigi.LocalTarget(
-            f'{self.output_dir}/visitor_prediction/all_predictions.csv',
-            format=luigi.format.UTF8)
-
-    def run(self):
-        all_predictions = pd.DataFrame(
-            columns=['is_sample', 'date', 'entries'])
-        for is_sample in [False, True]:
-            target = yield PredictVisitors(
-                days_to_predict=TIMESPAN,
-                sample_prediction=is_sample
-            )
-            with target.open('r') as prediction_file:
-                new_predictions = pd.read_csv(prediction_file)
-            new_predictions['is_sample'] = is_sample
-            all_predictions = all_predictions.append(new_predictions)
-        with self.output().open('w') as output_file:
-            all_predictions.to_csv(output_file, index=False, header=True)
+        return PredictVisitors(days_to_predict=TIMESPAN)
 
 
 class PredictVisitors(DataPreparationTask):
-    """Predict the number of museum visitors for the next days."""
+    """
+    Predict the number of museum visitors for the next days.
+
+    In addition, a sample prediction of the last days is made as a
+    reference, pretending that their actual entries were unknown. Both
+    predictions are stored in the same output, distinguished by is_sample.
+    """
 
     days_to_predict = luigi.parameter.IntParameter(default=7)
-    sample_prediction = luigi.parameter.BoolParameter(
+    allow_long_horizon = luigi.parameter.BoolParameter(
         default=False,
-        description="if sample_prediction, predict the last"
-        "days_to_predict days instead")
+        description=f"allow to predict more than {TIMESPAN} days, which the "
+                    "model has not been optimized for")
 
     def _requires(self):
         return luigi.task.flatten([
@@ -88,12 +70,68 @@ class PredictVisitors(DataPreparationTask):
     def output(self):
         return luigi.LocalTarget(
             f'{self.output_dir}/visitor_prediction/prediction'
-            f'{"_sample" if self.sample_prediction else ""}'
             f'_{self.days_to_predict}_days_ahead.csv',
             format=luigi.format.UTF8)
 
     def run(self):
-        # --- load data ---
+        all_entries, exhibitions, facts = self.load_input()
+
+        # --- split into training sets and dates to be predicted ---
+        known_dates = all_entries.index
+        prediction_sets = {}
+        for is_sample in [False, True]:
+            train_dates = known_dates
+            if is_sample:
+                train_dates = train_dates[:-self.days_to_predict]
+            prediction_sets[is_sample] = (train_dates, pd.date_range(
+                start=train_dates.max() + dt.timedelta(days=1),
+                periods=self.days_to_predict))
+
+        # --- append dates to be predicted ---
+        # --- so everything is preprocessed together ---
+        all_dates = known_dates
+        for _, predict_dates in prediction_sets.values():
+            all_dates = all_dates.union(predict_dates)
+        all_entries = all_entries.reindex(all_dates)
+
+        # --- preprocess ---
+        all_entries = preprocess_entries(
+            all_entries,
+            exhibitions,
+            facts)
+        entries_scaler = normalize_entries(all_entries)
+
+        # --- train and predict ---
+        all_predictions = []
+        for is_sample, (train_dates, predict_dates) \
+                in prediction_sets.items():
+            model = train_model(all_entries.loc[train_dates])
+            predicted_entries = pd.DataFrame({
+                'is_sample': is_sample,
+                'date': predict_dates,
+                'entries': predict_entries(
+                    model,
+                    all_entries.loc[predict_dates])
+            })
+            all_predictions.append(predicted_entries)
+        all_predictions = pd.concat(all_predictions)
+
+        # --- denormalize results ---
+        all_predictions['entries'] = denormalize_entries(
+            entries_scaler,
+            all_predictions['entries'])
+
+        # --- write output ---
+        with self.output().open('w') as output_file:
+            all_predictions.to_csv(output_file, index=False, header=True)
+
+    def load_input(self):
+        """Answer the known daily entries, exhibitions, and museum facts."""
+        if self.days_to_predict > TIMESPAN and not self.allow_long_horizon:
+            raise ValueError(
+                f"Predicting more than {TIMESPAN} days requires "
+                "allow_long_horizon")
+
         with self.input()[0].open('r') as entries_file:
             all_entries = pd.read_csv(
                 entries_file,
@@ -120,87 +158,63 @@ class PredictVisitors(DataPreparationTask):
             exhibitions['popularity'] = exhibitions['title'].apply(len)
         exhibitions['popularity'] = exhibitions['popularity'].apply(int)
 
-        if self.sample_prediction:
-            all_entries = all_entries.iloc[:-self.days_to_predict].copy()
+        return all_entries, exhibitions, facts
 
-        last_date = all_entries.index.max()
 
-        # --- append dates to be predicted ---
-        # --- so everything is preprocessed together ---
-        to_be_predicted_entries = pd.DataFrame(
-            index=pd.date_range(
-                start=last_date + dt.timedelta(days=1),
-                periods=self.days_to_predict),
-            columns=['entries'])
+def normalize_entries(entries, fit_until=None):
+    """
+    Scale the entries and all other continuous columns to [0, 1] in place.
 
-        all_entries = all_entries.append(to_be_predicted_entries)
+    If fit_until is given, the scalers only learn from the days until then so
+    that later days cannot leak into a model evaluation. Answer the scaler of
+    the entries column for denormalize_entries().
+    """
+    to_be_rescaled = [
+        'entries',
+        'exhibition_popularity',
+        'exhibition_progress']
 
-        # --- preprocess ---
-        all_entries = preprocess_entries(
-            all_entries,
-            exhibitions,
-            facts)
-
-        to_be_rescaled = [
-            'entries',
-            'exhibition_popularity',
-            'exhibition_progress']
-
-        # --- normalize ---
-        scaler_dict = dict()
-        for col in to_be_rescaled:
-            scaler = MinMaxScaler()
-            all_entries[[col]] = scaler.fit_transform(all_entries[[col]])
-            scaler_dict[col] = scaler
+    scaler_dict = dict()
+    for col in to_be_rescaled:
+        scaler = MinMaxScaler()
+        scaler.fit(entries.loc[:fit_until, [col]])
+        entries[[col]] = scaler.transform(entries[[col]])
+        scaler_dict[col] = scaler
+    return scaler_dict['entries']
 
-        # --- separate into training set and to_be_predicted ---
 
-        train_entries = all_entries[:-self.days_to_predict].copy()
-        to_be_predicted_entries = all_entries[-self.days_to_predict:].copy()
+def denormalize_entries(scaler, entries):
+    """Convert normalized entries back into integral numbers of visitors."""
+    return scaler.inverse_transform(
+        np.asarray(entries).reshape(-1, 1)
+    )[:, 0].astype(int)
 
-        # add last SEQUENCE_LENGTH entries to each row
-        # done after scaling to not rescale some e-X columns differently
-        for i in range(1, SEQUENCE_LENGTH):
-            train_entries[f'e-{i}'] = train_entries['entries'].shift(periods=i)
 
-        # --- train ---
-        feature_columns = [col for col in train_entries.columns
-                           if col != 'entries']
+def train_model(train_entries, model=None):
+    """
+    Train a model that predicts the entries from all other columns.
 
+    By default, the tuned KNeighborsRegressor is used.
+    """
+    if model is None:
         model = KNeighborsRegressor(n_neighbors=N_NEIGHBORS)
-        model.fit(
-            train_entries.filter(feature_columns),
-            train_entries['entries'])
-
-        # --- predict ---
-        previous_entries = list(train_entries['entries'].values)
-        predictions = []
-        for i in range(len(to_be_predicted_entries)):
-            new_row = to_be_predicted_entries.iloc[[i]].copy()
-            if new_row['is_closed'][0] == 1.0 or\
-               new_row['weekday_1'][0] == 1.0:
-                new_prediction = 0.0  # not predicting Tuesdays and closed days
-            else:
-                for j in range(1, SEQUENCE_LENGTH + 1):
-                    new_row[f'e-{j}'] = previous_entries[-j]
-                new_prediction = model.predict(
-                    new_row.filter(feature_columns))[0]
-
-            previous_entries.append(new_prediction)
-            predictions.append(new_prediction)
-
-        predicted_entries = pd.DataFrame(
-            index=to_be_predicted_entries.index,
-            data=predictions)
-        predicted_entries.reset_index(inplace=True)
-        predicted_entries.columns = ['date', 'entries']
-
-        # --- denormalize results ---
-        predicted_entries[['entries']] = \
-            scaler_dict['entries'].inverse_transform(
-                predicted_entries[['entries']])
-        predicted_entries['entries'] = predicted_entries['entries'].apply(int)
-
-        # --- write output ---
-        with self.output().open('w') as output_file:
-            predicted_entries.to_csv(output_file, index=False, header=True)
+    model.fit(
+        train_entries.drop(columns='entries'),
+        train_entries['entries'])
+    return model
+
+
+def predict_entries(model, to_be_predicted_entries):
+    """
+    Predict the entries of all given days at once.
+
+    All entries must be normalized already. Tuesdays and closed days are not
+    predicted but answered as 0.
+    """
+    predictions = model.predict(
+        to_be_predicted_entries.drop(columns='entries'))
+    not_predicted = to_be_predicted_entries['is_closed'] == 1
+    if 'weekday_1' in to_be_predicted_entries:
+        not_predicted |= to_be_predicted_entries['weekday_1'] == 1
+    predictions[not_predicted.values] = 0.0
+    return predictions
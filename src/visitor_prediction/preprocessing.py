@@ -1,5 +1,6 @@
 """Provides preprocessing tools used for visitor prediction."""
 
+import numpy as np
 import pandas as pd
 
 
@@ -20,76 +21,102 @@ def preprocess_entries(entries, exhibitions, facts):
 
 def _complement_exhibitions(exhibitions, facts):
     # facts_atttribute should be list of timespans
-    for (special, facts_attribute) in [
-        ('closing day', 'missing_closed_timespans'),
-        ('limited entries', 'limited_entry_timespans')
-    ]:
-        for closed_timespan in facts[facts_attribute]:
-            exhibitions = exhibitions.append(
-                pd.DataFrame(
-                    columns=exhibitions.columns,
-                    data=[{
-                        "special": special,
-                        'start_date': closed_timespan['start'],
-                        'end_date': closed_timespan['end']
-                    }]),
-                ignore_index=True)
+    timespans = pd.DataFrame(
+        columns=exhibitions.columns,
+        data=[
+            {
+                'special': special,
+                'start_date': closed_timespan['start'],
+                'end_date': closed_timespan['end']
+            }
+            for (special, facts_attribute) in [
+                ('closing day', 'missing_closed_timespans'),
+                ('limited entries', 'limited_entry_timespans')
+            ]
+            for closed_timespan in facts[facts_attribute]
+        ])
+    exhibitions = pd.concat([exhibitions, timespans], ignore_index=True)
+    for column in ['start_date', 'end_date']:
+        exhibitions[column] = pd.to_datetime(exhibitions[column])
     return exhibitions
 
 
 def _add_is_closed(entries, exhibitions):
-    entries['is_closed'] = 0
-    for exhibition in exhibitions[
-            exhibitions['special'] == "closing day"].itertuples():
-        start = exhibition.start_date
-        end = exhibition.end_date
-        entries.loc[
-            entries['entries'].index.to_series().between(start, end),
-            'is_closed'] = 1
+    closing_days = exhibitions[exhibitions['special'] == "closing day"]
+    entries['is_closed'] = (
+        _find_intervals(entries.index, closing_days) >= 0
+    ).astype(int)
     return entries
 
 
 def _add_limited_entries(entries, exhibitions):
-    entries['limited_entries'] = 0
-    for exhibition in exhibitions[
-            exhibitions['special'] == "limited entries"].itertuples():
-        start = exhibition.start_date
-        end = exhibition.end_date
-        entries.loc[
-            entries['entries'].index.to_series().between(start, end),
-            'limited_entries'] = 1
+    limited_entries = exhibitions[exhibitions['special'] == "limited entries"]
+    entries['limited_entries'] = (
+        _find_intervals(entries.index, limited_entries) >= 0
+    ).astype(int)
     return entries
 
 
 def _add_exhibition_progress(entries, exhibitions):
-    def calc_exhib_progress(date):
-        for exhibition in exhibitions.itertuples():
-            start = exhibition.start_date
-            end = exhibition.end_date
-            if start <= date <= end:
-                return (date - start).days / (end - start).days
-        return -1
-    entries['exhibition_progress'] = \
-        entries['entries'].index.to_series().apply(calc_exhib_progress)
+    indices = _find_intervals(entries.index, exhibitions, first=True)
+    matched = indices >= 0
+    start = exhibitions['start_date'].values[indices[matched]]
+    end = exhibitions['end_date'].values[indices[matched]]
+    dates = entries.index.values[matched]
+
+    progress = np.full(len(entries), -1.0)
+    progress[matched] = (
+        (dates - start).astype('timedelta64[D]').astype(int)
+        / (end - start).astype('timedelta64[D]').astype(int)
+    )
+    entries['exhibition_progress'] = progress
     return entries
 
 
 def _add_exhibition_popularity(entries, exhibitions):
-    entries['exhibition_popularity'] = 0
-
-    for exhibition in exhibitions.itertuples():
-        start = exhibition.start_date
-        end = exhibition.end_date
-        entries.loc[
-            entries['entries'].index.to_series().between(start, end),
-            'exhibition_popularity'] = exhibition.popularity
+    indices = _find_intervals(entries.index, exhibitions)
+    # index -1 (no exhibition) selects the appended default popularity
+    entries['exhibition_popularity'] = np.append(
+        exhibitions['popularity'].values, 0)[indices]
     return entries
 
 
 def _add_weekdays(entries):
-    weekdays_series = entries['entries'].index.to_series().apply(
-        lambda date: date.weekday())
+    weekdays_series = pd.Series(
+        entries.index.weekday,
+        index=entries.index)
     weekdays = pd.get_dummies(weekdays_series, prefix='weekday')
     for col in weekdays.columns:
         entries[col] = weekdays[col]
     return entries
+
+
+def _find_intervals(dates, intervals, first=False):
+    """
+    Find the interval that contains each date.
+
+    Intervals are given as the columns start_date and end_date and include
+    both bounds. For every date, answer the position of the last (or first,
+    if first is True) interval that contains it, or -1 if there is none.
+    Sorting and searching take O((dates + intervals) log dates) time, plus
+    the total number of dates within all intervals for assigning them.
+    """
+    dates = np.asarray(dates.values, dtype='datetime64[ns]')
+    order = np.argsort(dates, kind='stable')
+    sorted_dates = dates[order]
+
+    starts = intervals['start_date'].values
+    ends = intervals['end_date'].values
+    lows = np.searchsorted(sorted_dates, starts, side='left')
+    highs = np.searchsorted(sorted_dates, ends, side='right')
+    # intervals with missing bounds do not contain any date
+    highs[pd.isnull(starts) | pd.isnull(ends)] = 0
+
+    sorted_indices = np.full(len(dates), -1)
+    positions = range(len(intervals))
+    for position in reversed(positions) if first else positions:
+        sorted_indices[lows[position]:highs[position]] = position
+
+    indices = np.empty_like(sorted_indices)
+    indices[order] = sorted_indices
+    return indices
@@ -0,0 +1,199 @@
+from functools import lru_cache
+import random
+
+from absa.aspect_matching import AspectMatcher, levenshtein_distance
+from absa.post_aspects import MatchPostAspects
+from db_test import DatabaseTestCase
+
+
+THRESHOLD = MatchPostAspects.levenshtein_threshold
+
+
+def reference_distance(a, b):
+    """Compute the Levenshtein distance naively."""
+
+    @lru_cache(maxsize=None)
+    def distance(i, j):
+        if not i or not j:
+            return i + j
+        return min(
+            distance(i - 1, j) + 1,
+            distance(i, j - 1) + 1,
+            distance(i - 1, j - 1) + (a[i - 1] != b[j - 1])
+        )
+
+    return distance(len(a), len(b))
+
+
+def sql_matches(aspect_words, words, algorithm, n_max=4):
+    """
+    Emulate CollectPostAspectsEquality and CollectPostAspectsLevenshtein.
+
+    Answer the (position, aspect_id) keys of all matches in words.
+    """
+    value, aggregate, post_filter = {
+        'equality': (
+            lambda phrase, word: int(phrase.lower() == word.lower()),
+            max,
+            bool
+        ),
+        'levenshtein': (
+            lambda phrase, word: reference_distance(
+                phrase.lower(), word.lower()
+            ) / len(phrase),
+            min,
+            lambda value: value <= THRESHOLD
+        )
+    }[algorithm]
+
+    # Cross join all ngrams with all target aspect words
+    aspect_match = [
+        (start, aspect_id, value(' '.join(words[start:end]), word))
+        for start in range(len(words))
+        for end in range(start + 1, min(start + n_max, len(words)) + 1)
+        for aspect_id, word in aspect_words
+    ]
+    best_aspect_match = {}
+    for start, _, match_value in aspect_match:
+        if post_filter(match_value):
+            best_aspect_match[start] = aggregate(
+                best_aspect_match.get(start, match_value), match_value)
+    return {
+        (start, aspect_id)
+        for start, aspect_id, match_value in aspect_match
+        if best_aspect_match.get(start) == match_value
+    }
+
+
+class TestLevenshteinDistance(DatabaseTestCase):
+    """Tests the levenshtein_distance() function."""
+
+    def test_distance(self):
+
+        self.assertEqual(3, levenshtein_distance('kitten', 'sitting'))
+        self.assertEqual(3, levenshtein_distance('sitting', 'kitten'))
+        self.assertEqual(0, levenshtein_distance('monet', 'monet'))
+        self.assertEqual(5, levenshtein_distance('', 'monet'))
+        self.assertEqual(0, levenshtein_distance('', ''))
+
+    def test_max_distance(self):
+
+        self.assertEqual(3, levenshtein_distance('kitten', 'sitting', 3))
+        self.assertIsNone(levenshtein_distance('kitten', 'sitting', 2))
+        # length difference exceeds max_distance
+        self.assertIsNone(levenshtein_distance('monet', 'mo', 2))
+        self.assertEqual(0, levenshtein_distance('monet', 'monet', 0))
+
+    def test_random_strings(self):
+
+        rng = random.Random(42)
+        for _ in range(1000):
+            a, b = (
+                ''.join(rng.choices('abc', k=rng.randint(0, 8)))
+                for _ in range(2))
+            max_distance = rng.randint(0, 8)
+            expected = reference_distance(a, b)
+
+            self.assertEqual(expected, levenshtein_distance(a, b))
+            self.assertEqual(
+                expected if expected <= max_distance else None,
+                levenshtein_distance(a, b, max_distance))
+
+
+class TestAspectMatcher(DatabaseTestCase):
+    """Tests the AspectMatcher class."""
+
+    def setUp(self):
+
+        super().setUp()
+        self.aspect_words = [
+            (1, 'Ausstellung'),
+            (1, 'Ausstellungen'),
+            (2, 'Claude Monet'),
+            (3, 'Monet'),
+            (4, 'Café')
+        ]
+        self.matcher = AspectMatcher(self.aspect_words)
+
+    def test_match_exact(self):
+
+        words = ['die', 'AUSSTELLUNG', 'von', 'claude', 'Monet', 'café']
+
+        self.assertEqual(
+            {
+                (1, 1): 'Ausstellung',
+                (3, 2): 'Claude Monet',
+                (4, 3): 'Monet',
+                (5, 4): 'Café'
+            },
+            self.matcher.match_exact(words))
+        self.assertEqual(
+            sql_matches(self.aspect_words, words, 'equality'),
+            set(self.matcher.match_exact(words)))
+
+    def test_match_levenshtein_threshold(self):
+
+        for words, expected in [
+                # 2 / 11 <= 0.19
+                (['aussxxllung'], {(0, 1): 'Ausstellung'}),
+                # 3 / 11 > 0.19
+                (['auxxxellung'], {}),
+                # distance is relative to the length of the post phrase:
+                # 2 / 9 > 0.19 (although 2 / 11 <= 0.19)
+                (['ausstellu'], {}),
+                # 1 / 12 for both words, choose the smallest one
+                (['ausstellunge'], {(0, 1): 'Ausstellung'})]:
+            with self.subTest(words=words):
+                self.assertEqual(
+                    expected,
+                    self.matcher.match_levenshtein(words, THRESHOLD))
+                self.assertEqual(
+                    sql_matches(self.aspect_words, words, 'levenshtein'),
+                    set(expected))
+
+    def test_match_levenshtein_best_only(self):
+
+        matcher = AspectMatcher([
+            (1, 'gartenhaus'), (2, 'gartenmaus'), (3, 'gartenhause')
+        ])
+
+        # exact match beats all similar words
+        self.assertEqual(
+            {(0, 1): 'gartenhaus'},
+            matcher.match_levenshtein(['gartenhaus'], THRESHOLD))
+        # equally similar aspects are all matched (1 / 10 each), but 2 / 10
+        # is not similar enough
+        self.assertEqual(
+            {(0, 1): 'gartenhaus', (0, 2): 'gartenmaus'},
+            matcher.match_levenshtein(['gartenlaus'], THRESHOLD))
+
+    def test_random_sequences(self):
+
+        rng = random.Random(42)
+        vocabulary = ['ab', 'ba', 'abc', 'bca', 'cab', 'abcab', 'bacba']
+
+        def phrase(max_words):
+            return ' '.join(rng.choices(
+                vocabulary, k=rng.randint(1, max_words)))
+
+        for _ in range(50):
+            aspect_words = [
+                (rng.randint(1, 5), phrase(3))
+                for _ in range(rng.randint(1, 8))
+            ]
+            matcher = AspectMatcher(aspect_words)
+            for _ in range(10):
+                words = phrase(8).split(' ')
+                for algorithm, matches in [
+                        ('equality', matcher.match_exact(words)),
+                        ('levenshtein', matcher.match_levenshtein(
+                            words, THRESHOLD))]:
+                    with self.subTest(
+                            aspect_words=aspect_words,
+                            words=words,
+                            algorithm=algorithm):
+                        self.assertEqual(
+                            sql_matches(aspect_words, words, algorithm),
+                            set(matches))
+                        for (_, aspect_id), word in matches.items():
+                            self.assertIn((aspect_id, word), aspect_words)
@@ -0,0 +1,127 @@
+import random
+from types import SimpleNamespace
+
+import pandas as pd
+
+from absa.post_opinion_patterns import (
+    CollectPostOpinionPhrases, PosPatternMatcher)
+from db_test import DatabaseTestCase
+
+
+def pattern(*tags, aspect=0, sentiment=-1):
+    """Build an opinion pattern from POS tags."""
+    segments = [{'pos': tag} for tag in tags]
+    segments[aspect]['isAspect'] = True
+    segments[sentiment]['isSentiment'] = True
+    return segments
+
+
+def per_pattern_matches(patterns, tags):
+    """Emulate the former matching that searched every pattern separately."""
+    for index, (name, pattern_) in enumerate(patterns.items()):
+        pattern_tags = [segment['pos'] for segment in pattern_]
+        aspect_offset, sentiment_offset = (
+            next(
+                offset for offset, segment in enumerate(pattern_)
+                if segment.get(property_, False))
+            for property_ in ['isAspect', 'isSentiment'])
+        for start in range(len(tags) - len(pattern_tags) + 1):
+            if tags[start:start + len(pattern_tags)] == pattern_tags:
+                yield start, index, name, aspect_offset, sentiment_offset
+
+
+class TestPosPatternMatcher(DatabaseTestCase):
+    """Tests the PosPatternMatcher class."""
+
+    def test_overlapping_patterns(self):
+
+        patterns = {
+            'adj_noun': pattern('ADJ', 'NOUN', aspect=1, sentiment=0),
+            'adj_adj_noun': pattern('ADJ', 'ADJ', 'NOUN', aspect=2),
+            'noun_verb': pattern('NOUN', 'VERB'),
+            'noun_verb_adv': pattern('NOUN', 'VERB', 'ADV')
+        }
+        tags = ['ADJ', 'ADJ', 'NOUN', 'VERB', 'ADV', 'ADJ', 'NOUN']
+
+        self.assertCountEqual(
+            [
+                (0, 1, 'adj_adj_noun', 2, 2),
+                (1, 0, 'adj_noun', 1, 0),
+                (2, 2, 'noun_verb', 0, 1),
+                (2, 3, 'noun_verb_adv', 0, 2),
+                (5, 0, 'adj_noun', 1, 0)
+            ],
+            PosPatternMatcher(patterns).match(tags))
+
+    def test_random_sequences(self):
+
+        rng = random.Random(42)
+        tags = ['ADJ', 'NOUN', 'VERB']
+
+        for _ in range(50):
+            patterns = {}
+            for i in range(rng.randint(1, 6)):
+                length = rng.randint(1, 4)
+                patterns[f'pattern{i}'] = pattern(
+                    *rng.choices(tags, k=length),
+                    aspect=rng.randrange(length),
+                    sentiment=rng.randrange(length))
+            matcher = PosPatternMatcher(patterns)
+            for _ in range(10):
+                sequence = rng.choices(tags, k=rng.randint(0, 12))
+                with self.subTest(patterns=patterns, sequence=sequence):
+                    self.assertCountEqual(
+                        per_pattern_matches(patterns, sequence),
+                        matcher.match(sequence))
+
+    def test_invalid_pattern(self):
+
+        with self.assertRaises(AssertionError):
+            PosPatternMatcher({'no_aspect': [
+                {'pos': 'ADJ', 'isSentiment': True}, {'pos': 'NOUN'}
+            ]})
+
+
+class TestCollectPostOpinionPhrases(DatabaseTestCase):
+    """Tests the CollectPostOpinionPhrases task."""
+
+    def test_collect_phrases(self):
+
+        patterns = {
+            'noun_adj': pattern('NOUN', 'ADJ'),
+            'adj_noun': pattern('ADJ', 'NOUN', aspect=1, sentiment=0)
+        }
+        posts = [
+            ('twitter', '1', "schöne Bilder", ['ADJ', 'NOUN']),
+            ('gmaps', '2', "Museum toll Café schön", [
+                'NOUN', 'ADJ', 'NOUN', 'ADJ'
+            ]),
+            ('twitter', '3', "nichts", ['PRON'])
+        ]
+        post_df = pd.DataFrame(
+            [
+                (
+                    source, post_id,
+                    [SimpleNamespace(text=word) for word in text.split()],
+                    tags
+                )
+                for source, post_id, text, tags in posts
+            ],
+            columns=['source', 'post_id', 'doc', 'pos_tags'])
+
+        phrases = CollectPostOpinionPhrases().collect_phrases(
+            patterns, post_df)
+
+        pd.testing.assert_frame_equal(
+            pd.DataFrame(
+                [
+                    ('twitter', '1', 'adj_noun', 'Bilder', 'schöne'),
+                    ('gmaps', '2', 'noun_adj', 'Museum', 'toll'),
+                    ('gmaps', '2', 'noun_adj', 'Café', 'schön'),
+                    ('gmaps', '2', 'adj_noun', 'Café', 'toll')
+                ],
+                columns=[
+                    'source', 'post_id', 'pattern_name',
+                    'aspect_phrase', 'sentiment_phrase'
+                ]),
+            phrases)
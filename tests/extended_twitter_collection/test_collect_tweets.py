@@ -0,0 +1,64 @@
+import datetime as dt
+
+import pandas as pd
+
+from db_test import DatabaseTestCase
+from extended_twitter_collection.collect_tweets import (
+    TWEET_COLUMNS, TwitterCollectCandidateTweets)
+
+
+def tweets(term, *tweet_ids):
+    """Build a search result of the given tweets."""
+    return pd.DataFrame(
+        [{'term': term, 'tweet_id': tweet_id} for tweet_id in tweet_ids],
+        columns=TWEET_COLUMNS)
+
+
+class TestTwitterCollectCandidateTweets(DatabaseTestCase):
+    """Tests the TwitterCollectCandidateTweets task."""
+
+    def test_plan_searches(self):
+
+        day1, day2 = dt.date(2020, 5, 1), dt.date(2020, 5, 2)
+        cache = {
+            # complete, although the current limit is larger
+            ('a', day1): (10, tweets('a', 1, 2, 3)),
+            # cut off by a smaller limit
+            ('a', day2): (10, tweets('a', *range(10))),
+            # cut off by a larger limit
+            ('b', day1): (30, tweets('b', *range(30)))
+        }
+
+        results, searches = TwitterCollectCandidateTweets.plan_searches(
+            {'a': 20, 'b': 20}, [day1, day2], cache)
+
+        self.assertEqual(
+            {'a': [day1], 'b': [day1]},
+            {
+                term: [day for day, _ in term_results]
+                for term, term_results in results.items()
+            })
+        self.assertCountEqual(
+            [('a', day2, 20), ('b', day2, 20)],
+            searches)
+
+    def test_merge_results(self):
+
+        day1, day2 = dt.date(2020, 5, 1), dt.date(2020, 5, 2)
+        results = {
+            'a': [
+                (day1, tweets('a', 4, 3, 2, 1)),
+                # a single search may answer a tweet multiple times
+                (day2, tweets('a', 6, 6, 5, 4))
+            ],
+            'b': [(day1, tweets('b', 6, 1))]
+        }
+
+        tweet_df = TwitterCollectCandidateTweets.merge_results(
+            results, {'a': 4, 'b': 10})
+
+        # only the latest tweets of a are kept
+        self.assertEqual(
+            [('a', 6), ('a', 5), ('a', 4), ('a', 3), ('b', 6), ('b', 1)],
+            list(tweet_df[['term', 'tweet_id']].itertuples(
+                index=False, name=None)))
@@ -12,7 +12,7 @@ from gomus.exhibitions import FetchExhibitions, FetchExhibitionTimes
 class TestExhibitions(DatabaseTestCase):
     """Tests the gomus exhibition tasks."""
 
-    @patch('gomus.exhibitions.requests.get')
+    @patch('gomus.exhibitions.http_client.get')
     @patch.object(FetchExhibitions, 'output')
     def test_exhibitions(self, output_mock, requests_get_mock):
 
@@ -42,7 +42,7 @@ class TestExhibitions(DatabaseTestCase):
         with output_target.open('r') as output_data:
             self.assertEqual(expected_data, output_data.read())
 
-    @patch('gomus.exhibitions.requests.get')
+    @patch('gomus.exhibitions.http_client.get')
     @patch.object(FetchExhibitionTimes, 'output')
     def test_exhibition_times(self, output_mock, requests_get_mock):
 
@@ -1,6 +1,6 @@
-import time
 from unittest.mock import MagicMock, patch
 
+from freezegun import freeze_time
 import pandas as pd
 import requests
 
@@ -33,19 +33,12 @@ class TestFetchAppleReviews(DatabaseTestCase):
         self.run_task(MuseumFacts())
         self.task.get_country_codes = lambda: FAKE_COUNTRY_CODES
 
-    def tearDown(self):
-        # Avoid 40(3|4) errors by sending too many requests during consecutive
-        # tests. See FetchAppstoreReviews.get_metered_request().
-        time.sleep(3)
-
-        super().tearDown()
-
     def test_germany_basic(self):
         self.task.requires().run()  # workaround
         result = self.task.fetch_for_country('DE')
         self.assertIsInstance(result, pd.DataFrame)
 
-    @patch('apple_appstore.requests.get')
+    @patch('apple_appstore.http_client.get')
     def test_get_request_returns_bad_status_code(self, mock):
         def raise_for_all_cases():
             raise requests.HTTPError
@@ -55,7 +48,7 @@ class TestFetchAppleReviews(DatabaseTestCase):
             self.task.fetch_for_country,
             'de')
 
-    @patch('apple_appstore.requests.get')
+    @patch('apple_appstore.http_client.get')
     def test_only_one_review_fetched(self, mock):
 
         return_values = [
@@ -104,14 +97,14 @@ class TestFetchAppleReviews(DatabaseTestCase):
     @patch.object(FetchAppstoreReviews, 'fetch_for_country')
     def test_all_countries(self, mock):
 
-        def mock_return():
-            for i in range(5000):
-                yield pd.DataFrame({
-                    'app_id': '123456',
-                    'country_code': [f'{i}'],
-                    'appstore_review_id': [i]
-                })
-        mock.side_effect = mock_return()
+        # countries are fetched concurrently, so don't use a generator
+        def mock_return(country_code):
+            return pd.DataFrame({
+                'app_id': '123456',
+                'country_code': [country_code],
+                'appstore_review_id': [country_code]
+            })
+        mock.side_effect = mock_return
 
         result = self.task.fetch_all()
 
@@ -123,6 +116,79 @@ class TestFetchAppleReviews(DatabaseTestCase):
         for arg in args:
             self.assertRegex(arg, r'^\w{2}$')
 
+    @patch('apple_appstore.http_client.get')
+    def test_stop_at_known_reviews(self, mock):
+
+        self.task.known_review_ids = {'2'}
+        mock.side_effect = [
+            MagicMock(ok=True, text=XML_FRAME % ''.join(
+                f'''<entry>
+                    <updated>2012-11-10T09:08:07-07:00</updated>
+                    <id>{review_id}</id>
+                    <title>Title</title>
+                    <content type="text">Text</content>
+                    <content type="html">Text</content>
+                    <im:voteSum>0</im:voteSum>
+                    <im:voteCount>0</im:voteCount>
+                    <im:rating>5</im:rating>
+                    <im:version>1.0</im:version>
+                </entry>'''
+                for review_id in ['1', '2']
+            ))
+        ]
+
+        result = self.task.fetch_for_country('DE')
+
+        self.assertEqual(['1', '2'], list(result['appstore_review_id']))
+        self.assertEqual(1, mock.call_count)
+
+    @freeze_time('2021-01-04')  # Monday, no full resync
+    @patch.object(FetchAppstoreReviews, 'is_probe_due')
+    @patch.object(FetchAppstoreReviews, 'fetch_for_country')
+    def test_probe_empty_countries_rarely(
+            self, fetch_for_country_mock, is_probe_due_mock):
+
+        self.db_connector.execute('''
+            INSERT INTO appstore_review (app_id, review_id, country_code)
+            VALUES ('1150432552', '42', 'US')
+        ''')
+        fetch_for_country_mock.return_value = pd.DataFrame([])
+        is_probe_due_mock.side_effect = lambda country_code: \
+            country_code == 'PL'
+
+        self.task.fetch_all()
+
+        self.assertCountEqual(
+            ['US', 'PL'],
+            [args[0] for (args, _) in fetch_for_country_mock.call_args_list])
+        self.assertEqual({'42'}, self.task.known_review_ids)
+
+    @freeze_time('2021-01-03')  # Sunday
+    @patch.object(FetchAppstoreReviews, 'fetch_for_country')
+    def test_full_resync(self, fetch_for_country_mock):
+
+        self.db_connector.execute('''
+            INSERT INTO appstore_review (app_id, review_id, country_code)
+            VALUES ('1150432552', '42', 'US')
+        ''')
+        fetch_for_country_mock.return_value = pd.DataFrame([])
+
+        self.task.fetch_all()
+
+        self.assertCountEqual(
+            FAKE_COUNTRY_CODES,
+            [args[0] for (args, _) in fetch_for_country_mock.call_args_list])
+        self.assertEqual(set(), self.task.known_review_ids)
+
+    def test_country_codes(self):
+
+        # bypass the fake country codes from setUp()
+        country_codes = FetchAppstoreReviews.get_country_codes(self.task)
+
+        self.assertEqual(250, len(country_codes))
+        self.assertIn('DE', country_codes)
+        self.assertIn('NA', country_codes)  # Namibia, not a missing value
+
     @patch.object(FetchAppstoreReviews, 'fetch_page')
     def test_http_error(self, fetch_page_mock):
         mock_res = MagicMock(status_code=503)
@@ -231,7 +297,7 @@ class TestAppstoreReviewsToDb(DatabaseTestCase):
     """Tests the AppstoreReviewsToDb task."""
 
     @patch.object(FetchAppstoreReviews, 'get_country_codes')
-    @patch('apple_appstore.requests.get')
+    @patch('apple_appstore.http_client.get')
     def test_umlauts(self, requests_mock, country_codes_mock):
 
         umlaut_title = "Än ümlaut cömment"
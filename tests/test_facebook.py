@@ -6,6 +6,7 @@ from unittest.mock import MagicMock, patch
 from freezegun import freeze_time
 from luigi.format import UTF8
 from luigi.mock import MockTarget
+import pandas as pd
 from requests.exceptions import HTTPError
 
 from db_test import DatabaseTestCase
@@ -17,7 +18,7 @@ FB_TEST_DATA = 'tests/test_data/facebook'
 class TestFacebookPost(DatabaseTestCase):
     """Tests the FetchFbPosts task."""
 
-    @patch('facebook.requests.get')
+    @patch('facebook.http_client.get')
     @patch.object(facebook.FetchFbPosts, 'output')
     @patch.object(facebook.MuseumFacts, 'output')
     def test_post_transformation(
@@ -50,7 +51,7 @@ class TestFacebookPost(DatabaseTestCase):
         with output_target.open('r') as output_data:
             self.assertEqual(expected_data, output_data.read())
 
-    @patch('facebook.requests.get')
+    @patch('facebook.http_client.get')
     @patch.object(facebook.FetchFbPosts, 'output')
     @patch.object(facebook.MuseumFacts, 'output')
     def test_pagination(self, fact_mock, output_mock, requests_get_mock):
@@ -86,7 +87,7 @@ class TestFacebookPost(DatabaseTestCase):
 
         self.assertEqual(requests_get_mock.call_count, 2)
 
-    @patch('facebook.requests.get')
+    @patch('facebook.http_client.get')
     @patch.object(facebook.MuseumFacts, 'output')
     def test_invalid_response_raises_error(self,
                                            fact_mock,
@@ -116,7 +117,7 @@ class TestFacebookPostPerformance(DatabaseTestCase):
             self,
             input_mock,
             output_mock,
-            requests_get_mock,
+            session_post_mock,
             actual_json):
         input_target = MockTarget('posts_in', format=UTF8)
         input_mock.return_value = input_target
@@ -134,11 +135,8 @@ class TestFacebookPostPerformance(DatabaseTestCase):
                   encoding='utf-8') as json_in:
             input_json = json_in.read()
 
-        def mock_json():
-            return json.loads(input_json)
-
-        mock_response = MagicMock(ok=True, json=mock_json)
-        requests_get_mock.return_value = mock_response
+        session_post_mock.side_effect = mock_batch_post(
+            lambda relative_url: (200, input_json))
 
         return output_target
 
@@ -154,11 +152,11 @@ class TestFacebookPostPerformance(DatabaseTestCase):
         with output_target.open('r') as output_data:
             self.assertEqual(expected_insights, output_data.read())
 
-    @patch('facebook.requests.get')
+    @patch('facebook.http_client.post')
     @patch.object(facebook.FetchFbPostPerformance, 'output')
     @patch.object(facebook.FetchFbPostPerformance, 'input')
     def test_post_performance_transformation(
-            self, input_mock, output_mock, requests_get_mock):
+            self, input_mock, output_mock, session_post_mock):
         self.db_connector.execute(
             '''
             INSERT INTO fb_post (page_id, post_id) VALUES
@@ -168,7 +166,7 @@ class TestFacebookPostPerformance(DatabaseTestCase):
         output_target = self.prepare_post_performance_mocks(
             input_mock,
             output_mock,
-            requests_get_mock,
+            session_post_mock,
             'post_insights_actual.json'
         )
 
@@ -183,18 +181,18 @@ class TestFacebookPostPerformance(DatabaseTestCase):
             'post_insights_expected.csv'
         )
 
-    @patch('facebook.requests.get')
+    @patch('facebook.http_client.post')
     @patch.object(facebook.FetchFbPostPerformance, 'output')
     @patch.object(facebook.FetchFbPostPerformance, 'input')
     def test_post_performance_edge_cases(self,
                                          input_mock,
                                          output_mock,
-                                         requests_get_mock):
+                                         session_post_mock):
 
         self.prepare_post_performance_mocks(
             input_mock,
             output_mock,
-            requests_get_mock,
+            session_post_mock,
             'post_insights_edgecases.json'
         )
 
@@ -210,16 +208,16 @@ class TestFacebookPostPerformance(DatabaseTestCase):
                     table='fb_post_performance')
                 self.task.run()
 
-    @patch('facebook.requests.get')
+    @patch('facebook.http_client.post')
     @patch.object(facebook.FetchFbPostComments, 'output')
     @patch.object(facebook.FetchFbPosts, 'output')
     def test_post_comments_transformation(
-            self, input_mock, output_mock, requests_get_mock):
+            self, input_mock, output_mock, session_post_mock):
 
         output_target = self.prepare_post_performance_mocks(
             input_mock,
             output_mock,
-            requests_get_mock,
+            session_post_mock,
             'post_comments_actual.json'
         )
 
@@ -232,3 +230,243 @@ class TestFacebookPostPerformance(DatabaseTestCase):
             output_target,
             'post_comments_expected.csv'
         )
+
+
+@patch.dict('os.environ', {'FB_ACCESS_TOKEN': 'token'})
+class TestFacebookPostComments(DatabaseTestCase):
+    """Tests the checkpointed harvesting of FetchFbPostComments."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.task = facebook.FetchFbPostComments(
+            timespan=dt.timedelta(days=100000),
+            table='fb_post_comment')
+        self.task.facts = {'name': 'Museum Barberini'}
+
+    def fetch_comments(self, post_ids):
+
+        return list(self.task.fetch_comments(pd.DataFrame({
+            'page_id': ['1'] * len(post_ids),
+            'post_id': post_ids,
+            'post_date': ['2020-05-01T11:00:00+0000'] * len(post_ids)
+        })))
+
+    @patch('facebook.http_client.post')
+    def test_resume_harvest(self, session_post_mock):
+
+        self.db_connector.execute('''
+            INSERT INTO fb_post_comment_harvest VALUES
+                ('1', '2', 3, 'cursor1', '[{"comment_id": "4"}]')
+        ''')
+        pages = {
+            'cursor1': {
+                'data': [{'id': '2_5', 'comment_count': 0}],
+                'paging': {'cursors': {'after': 'cursor2'}, 'next': 'url'}
+            },
+            'cursor2': {
+                'data': [{'id': '2_6', 'comment_count': 0}],
+                'paging': {'cursors': {'after': 'cursor3'}}
+            }
+        }
+        requested_urls = []
+
+        def respond(relative_url):
+            requested_urls.append(relative_url)
+            return (200, json.dumps(pages[relative_url.split('after=')[1]]))
+        session_post_mock.side_effect = mock_batch_post(respond)
+
+        comments = self.fetch_comments(['2'])
+
+        self.assertEqual(
+            ['4', '5', '6'],
+            [comment['comment_id'] for comment in comments])
+        self.assertEqual(2, len(requested_urls))
+        self.assertTrue(requested_urls[0].startswith('1_2/comments?'))
+        cursor, harvested_comments = self.db_connector.query('''
+            SELECT after_cursor, comments FROM fb_post_comment_harvest
+        ''', only_first=True)
+        self.assertIsNone(cursor)
+        self.assertEqual(3, len(json.loads(harvested_comments)))
+
+    @patch('facebook.http_client.post')
+    def test_skip_unchanged_posts(self, session_post_mock):
+
+        self.db_connector.execute(
+            '''
+                INSERT INTO fb_post (page_id, post_id)
+                VALUES ('1', '2'), ('1', '3')
+            ''',
+            '''
+                INSERT INTO fb_post_performance
+                    (page_id, post_id, timestamp, comments)
+                VALUES
+                    ('1', '2', '2020-05-01', 1),
+                    ('1', '2', '2020-05-02', 3),
+                    ('1', '3', '2020-05-02', 5)
+            ''',
+            '''
+                INSERT INTO fb_post_comment_harvest VALUES
+                    ('1', '2', 3, NULL, '[{"comment_id": "4"}]',
+                        '2020-05-02'),
+                    ('1', '3', 2, NULL, '[{"comment_id": "5"}]',
+                        '2020-05-02')
+            '''
+        )
+        requested_urls = []
+
+        def respond(relative_url):
+            requested_urls.append(relative_url)
+            return (200, json.dumps({'data': [
+                {'id': '3_5', 'comment_count': 0},
+                {'id': '3_6', 'comment_count': 0}
+            ]}))
+        session_post_mock.side_effect = mock_batch_post(respond)
+
+        with freeze_time('2020-05-03'):
+            comments = self.fetch_comments(['2', '3'])
+
+        self.assertCountEqual(
+            ['4', '5', '6'],
+            [comment['comment_id'] for comment in comments])
+        self.assertEqual(1, len(requested_urls))
+        self.assertTrue(requested_urls[0].startswith('1_3/comments?'))
+        self.assertEqual(
+            [(5, 2)],
+            self.db_connector.query('''
+                SELECT comment_count, json_array_length(comments::json)
+                FROM fb_post_comment_harvest
+                WHERE post_id = '3'
+            '''))
+
+    @patch('facebook.http_client.post')
+    def test_repeat_old_harvests(self, session_post_mock):
+
+        self.db_connector.execute(
+            '''
+                INSERT INTO fb_post (page_id, post_id)
+                VALUES ('1', '2'), ('1', '3')
+            ''',
+            '''
+                INSERT INTO fb_post_performance
+                    (page_id, post_id, timestamp, comments)
+                VALUES
+                    ('1', '2', '2020-05-02', 1),
+                    ('1', '3', '2020-05-02', 1)
+            ''',
+            # The comments of both harvests are already stored
+            '''
+                INSERT INTO fb_post_comment_harvest VALUES
+                    ('1', '2', 1, NULL, NULL, '2020-05-02'),
+                    ('1', '3', 1, NULL, NULL, '2020-04-02')
+            '''
+        )
+        requested_urls = []
+
+        def respond(relative_url):
+            requested_urls.append(relative_url)
+            return (200, json.dumps({'data': [
+                {'id': '3_5', 'comment_count': 0}
+            ]}))
+        session_post_mock.side_effect = mock_batch_post(respond)
+
+        with freeze_time('2020-05-03'):
+            comments = self.fetch_comments(['2', '3'])
+
+        self.assertEqual(
+            ['5'],
+            [comment['comment_id'] for comment in comments])
+        self.assertEqual(1, len(requested_urls))
+        self.assertTrue(requested_urls[0].startswith('1_3/comments?'))
+        self.assertEqual(
+            [('2', dt.datetime(2020, 5, 2)), ('3', dt.datetime(2020, 5, 3))],
+            self.db_connector.query('''
+                SELECT post_id, harvested_at
+                FROM fb_post_comment_harvest
+                ORDER BY post_id
+            '''))
+
+    def test_clear_harvests(self):
+
+        self.db_connector.execute('''
+            INSERT INTO fb_post_comment_harvest VALUES
+                ('1', '2', 3, NULL, '[{"comment_id": "4"}]', '2020-05-02'),
+                ('1', '3', 3, 'cursor1', '[{"comment_id": "5"}]', '2020-05-02')
+        ''')
+
+        self.task.clear_harvests()
+
+        # Only interrupted harvests still need their comments
+        self.assertEqual(
+            [('2', 3, None), ('3', 3, '[{"comment_id": "5"}]')],
+            self.db_connector.query('''
+                SELECT post_id, comment_count, comments
+                FROM fb_post_comment_harvest
+                ORDER BY post_id
+            '''))
+
+
+@patch.dict('os.environ', {'FB_ACCESS_TOKEN': 'token'})
+class TestGraphApiClient(DatabaseTestCase):
+    """Tests the GraphApiClient class."""
+
+    @patch('facebook.http_client.post')
+    def test_batches(self, session_post_mock):
+
+        session_post_mock.side_effect = mock_batch_post(
+            lambda relative_url: (200, json.dumps({'url': relative_url})))
+        urls = [f'{i}/insights' for i in range(120)]
+
+        responses = facebook.GraphApiClient().get_all(urls)
+
+        self.assertEqual(
+            [response.json()['url'] for response in responses],
+            urls)
+        self.assertEqual(session_post_mock.call_count, 3)
+
+    @patch('facebook.http_client.post')
+    def test_partial_failures(self, session_post_mock):
+
+        failures = {'1/insights': [None, (500, '{}')]}
+
+        def respond(relative_url):
+            if relative_url == '0/insights':
+                return (400, '{"error": {"code": 100}}')
+            if failures.get(relative_url):
+                return failures[relative_url].pop(0)
+            return (200, '{"data": []}')
+        session_post_mock.side_effect = mock_batch_post(respond)
+
+        responses = facebook.GraphApiClient().get_all(
+            ['0/insights', '1/insights', '2/insights'])
+
+        self.assertEqual(
+            [response.status_code for response in responses],
+            [400, 200, 200])
+        self.assertEqual(session_post_mock.call_count, 3)
+
+    @patch('facebook.http_client.post')
+    def test_persistent_failure(self, session_post_mock):
+
+        session_post_mock.side_effect = mock_batch_post(
+            lambda relative_url: (500, '{}'))
+
+        with self.assertRaises(HTTPError):
+            facebook.GraphApiClient(attempts=2).get_all(['0/insights'])
+        self.assertEqual(session_post_mock.call_count, 2)
+
+
+def mock_batch_post(respond):
+    """
+    Mock http_client.post() for Graph API batch requests.
+
+    respond is called with the relative URL of every single request and
+    answers its status code and body, or None if the request timed out.
+    """
+    def post(url, data, **kwargs):
+        results = []
+        for request in json.loads(data['batch']):
+            result = respond(request['relative_url'])
+            results.append(result and {'code': result[0], 'body': result[1]})
+        return MagicMock(ok=True, json=lambda: results)
+    return post
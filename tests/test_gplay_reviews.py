@@ -1,10 +1,12 @@
+import datetime as dt
 import json
 import pandas as pd
 import requests
 
+from freezegun import freeze_time
 from luigi.format import UTF8
 from luigi.mock import MockTarget
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 from db_test import DatabaseTestCase
 from gplay.gplay_reviews import FetchGplayReviews
@@ -97,8 +99,13 @@ class TestFetchGplayReviews(DatabaseTestCase):
         # behaviour changes.
         self.assertCountEqual(reviews, reviews_en)
 
+    # languages are fetched concurrently, so map them to their reviews
     @patch('gplay.gplay_reviews.FetchGplayReviews.fetch_for_language',
-           side_effect=[[RESPONSE_ELEM_1], [RESPONSE_ELEM_2], []])
+           side_effect=lambda language_code, newer_than: {
+               'en': [RESPONSE_ELEM_1],
+               'de': [RESPONSE_ELEM_2],
+               'fr': []
+           }[language_code])
     @patch('gplay.gplay_reviews.FetchGplayReviews.load_language_codes',
            return_value=['en', 'de', 'fr'])
     def test_fetch_all_multiple_return_values(
@@ -125,10 +132,10 @@ class TestFetchGplayReviews(DatabaseTestCase):
         )
 
     @patch('gplay.gplay_reviews.FetchGplayReviews.fetch_for_language',
-           side_effect=[
-               [RESPONSE_ELEM_1, RESPONSE_ELEM_2, RESPONSE_ELEM_2],
-               [RESPONSE_ELEM_1]
-           ])
+           side_effect=lambda language_code, newer_than: {
+               'en': [RESPONSE_ELEM_1, RESPONSE_ELEM_2, RESPONSE_ELEM_2],
+               'de': [RESPONSE_ELEM_1]
+           }[language_code])
     @patch('gplay.gplay_reviews.FetchGplayReviews.load_language_codes',
            return_value=['en', 'de'])
     def test_fetch_all_no_duplicates(self, mock_lang, mock_fetch):
@@ -138,7 +145,7 @@ class TestFetchGplayReviews(DatabaseTestCase):
         pd.testing.assert_frame_equal(
             result, pd.DataFrame([RESPONSE_ELEM_1, RESPONSE_ELEM_2]))
 
-    @patch('gplay.gplay_reviews.requests.Response.json')
+    @patch('requests.Response.json')
     def test_fetch_for_language_one_return_value(self, mock_json):
 
         mock_json.return_value = {'results': [RESPONSE_ELEM_1]}
@@ -148,7 +155,7 @@ class TestFetchGplayReviews(DatabaseTestCase):
 
         self.assertCountEqual([RESPONSE_ELEM_1], result)
 
-    @patch('gplay.gplay_reviews.requests.Response.json')
+    @patch('requests.Response.json')
     def test_fetch_for_lang_multi_return_values(self, mock_json):
 
         mock_json.return_value = {
@@ -159,7 +166,7 @@ class TestFetchGplayReviews(DatabaseTestCase):
 
         self.assertCountEqual([RESPONSE_ELEM_1, RESPONSE_ELEM_2], result)
 
-    @patch('gplay.gplay_reviews.requests.Response.json')
+    @patch('requests.Response.json')
     def test_fetch_for_lang_no_reviews_returned(self, mock_json):
 
         mock_json.return_value = {'results': []}
@@ -168,7 +175,7 @@ class TestFetchGplayReviews(DatabaseTestCase):
 
         self.assertCountEqual([], result)
 
-    @patch('gplay.gplay_reviews.requests.get')
+    @patch('gplay.gplay_reviews.http_client.get')
     def test_fetch_for_language_request_failed(self, mock_get):
 
         mock_get.return_value = requests.Response()
@@ -177,6 +184,85 @@ class TestFetchGplayReviews(DatabaseTestCase):
         with self.assertRaises(requests.exceptions.HTTPError):
             list(self.task.fetch_for_language('xyz'))
 
+    @patch('gplay.gplay_reviews.http_client.get')
+    def test_fetch_for_language_newer_than(self, mock_get):
+
+        all_reviews = [
+            {
+                **RESPONSE_ELEM_1,
+                'id': str(i),
+                'date': (
+                    dt.datetime(2020, 12, 31) - dt.timedelta(days=i)
+                ).isoformat() + '.000Z'
+            }
+            for i in range(300)
+        ]
+
+        def get(url, params):
+            response = MagicMock()
+            response.json.return_value = {
+                'results': all_reviews[:params['num']]}
+            return response
+        mock_get.side_effect = get
+
+        reviews = list(self.task.fetch_for_language(
+            'de', newer_than=dt.datetime(2020, 12, 1)))
+
+        self.assertEqual(100, len(reviews))
+        self.assertEqual(1, mock_get.call_count)
+
+        mock_get.reset_mock()
+        reviews = list(self.task.fetch_for_language(
+            'de', newer_than=dt.datetime(2020, 6, 1)))
+
+        self.assertEqual(300, len(reviews))
+        self.assertEqual(
+            [100, 400],
+            [kwargs['params']['num'] for _, kwargs in mock_get.call_args_list])
+
+    @freeze_time('2021-01-04')  # Monday, no full resync
+    @patch('gplay.gplay_reviews.FetchGplayReviews.fetch_for_language',
+           return_value=[])
+    @patch('gplay.gplay_reviews.FetchGplayReviews.load_language_codes',
+           return_value=['en', 'de'])
+    def test_fetch_all_newer_than_stored(self, mock_lang, mock_fetch):
+
+        self.db_connector.execute('''
+            INSERT INTO gplay_review (playstore_review_id, post_date, app_id)
+            VALUES
+                ('1', '2020-12-01 10:00', 'another.app'),
+                ('2', '2020-11-01 10:00',
+                    'com.barberini.museum.barberinidigital'),
+                ('3', '2020-10-01 10:00',
+                    'com.barberini.museum.barberinidigital')
+        ''')
+
+        self.task.fetch_all()
+
+        self.assertCountEqual(
+            [
+                ('en', dt.datetime(2020, 11, 1, 10)),
+                ('de', dt.datetime(2020, 11, 1, 10))
+            ],
+            [args for args, _ in mock_fetch.call_args_list])
+
+    @freeze_time('2021-01-03')  # Sunday
+    @patch('gplay.gplay_reviews.FetchGplayReviews.fetch_for_language',
+           return_value=[])
+    @patch('gplay.gplay_reviews.FetchGplayReviews.load_language_codes',
+           return_value=['en'])
+    def test_full_resync(self, mock_lang, mock_fetch):
+
+        self.db_connector.execute('''
+            INSERT INTO gplay_review (playstore_review_id, post_date, app_id)
+            VALUES ('2', '2020-11-01 10:00',
+                'com.barberini.museum.barberinidigital')
+        ''')
+
+        self.task.fetch_all()
+
+        mock_fetch.assert_called_once_with('en', None)
+
     def test_load_language_codes(self):
 
         language_codes = FetchGplayReviews().load_language_codes()
@@ -9,6 +9,7 @@ from luigi.mock import MockTarget
 import pandas as pd
 
 from db_test import DatabaseTestCase
+from .test_facebook import mock_batch_post
 from .utils.test_database import DummyWriteCsvToDb
 import instagram
 
@@ -119,6 +120,71 @@ class TestInstagram(DatabaseTestCase):
             uri_mock.call_count,
             post_data['thumbnail_uri'].isna().sum())
 
+    @patch.object(instagram.IgPostsToDb, 'complete', return_value=True)
+    @patch.object(instagram.FetchIgPostThumbnails, 'get_thumbnail_uri')
+    @patch.object(instagram.FetchIgPostThumbnails, 'output')
+    def test_refresh_thumbnails(self, output_mock, uri_mock, to_db_mock):
+        self.db_connector.execute(
+            '''
+                INSERT INTO ig_post (ig_post_id, permalink, thumbnail_uri)
+                VALUES
+                    ('1', 'expired', 'data:old'),
+                    ('2', 'fresh', 'data:old'),
+                    ('3', 'changed', 'data:old'),
+                    ('4', 'missing', NULL),
+                    ('5', 'failed', 'data:old'),
+                    ('6', 'failed again', NULL),
+                    ('7', 'backing off', NULL)
+            ''',
+            '''
+                INSERT INTO ig_post_thumbnail_refresh VALUES
+                    ('1', now() - INTERVAL '1 day'),
+                    ('2', now() + INTERVAL '1 day'),
+                    ('3', now() - INTERVAL '1 day'),
+                    ('5', now() - INTERVAL '1 day'),
+                    ('6', now() - INTERVAL '1 day', 2),
+                    ('7', now() + INTERVAL '1 day', 1)
+            '''
+        )
+        output_target = MockTarget('thumbnails_out', format=UTF8)
+        output_mock.return_value = output_target
+        uri_mock.side_effect = lambda permalink: {
+            'expired': 'data:old',
+            'changed': 'data:new',
+            'missing': instagram.FetchIgPostThumbnails.empty_data_uri,
+            'failed': None,
+            'failed again': None
+        }[permalink]
+
+        self.run_task(instagram.FetchIgPostThumbnails())
+
+        # Only expired and missing thumbnails are requested ...
+        self.assertCountEqual(
+            ['expired', 'changed', 'missing', 'failed', 'failed again'],
+            [args[0] for args, _ in uri_mock.call_args_list])
+        # ... and only changed thumbnails are stored
+        with output_target.open('r') as output_file:
+            actual_data = pd.read_csv(output_file, dtype=str)
+        pd.testing.assert_frame_equal(
+            pd.DataFrame({
+                'ig_post_id': ['3', '4'],
+                'thumbnail_uri': ['data:new', 'data:image/png,']
+            }),
+            actual_data.sort_values('ig_post_id', ignore_index=True))
+        # ... and failed thumbnails are retried with an exponential backoff
+        self.assertCountEqual(
+            [
+                ('1', 90, 0), ('2', 1, 0), ('3', 90, 0), ('4', 30, 0),
+                ('5', 1, 1), ('6', 4, 3), ('7', 1, 1)
+            ],
+            self.db_connector.query('''
+                SELECT
+                    ig_post_id,
+                    ROUND(EXTRACT(EPOCH FROM next_refresh - now()) / 86400),
+                    failures
+                FROM ig_post_thumbnail_refresh
+            '''))
+
     @patch('instagram.try_request_multiple_times')
     @patch.object(instagram.FetchIgPostThumbnails, 'get_thumbnail_url')
     def test_get_thumbnail_uri(self, url_mock, request_mock):
@@ -150,11 +216,11 @@ class TestInstagram(DatabaseTestCase):
             actual_thumbnails, thumbnails['thumbnail_uri'],
             check_names=False)
 
-    @patch('instagram.try_request_multiple_times')
+    @patch('facebook.http_client.post')
     @patch.object(instagram.FetchIgPostPerformance, 'output')
     @patch.object(instagram.FetchIgPostPerformance, 'input')
     def test_post_performance_transformation(
-            self, input_mock, output_mock, request_mock):
+            self, input_mock, output_mock, session_post_mock):
         self.db_connector.execute(
             '''INSERT INTO ig_post (ig_post_id) VALUES
                 (0123456789),
@@ -188,18 +254,12 @@ class TestInstagram(DatabaseTestCase):
                   encoding='utf-8') as expected_data_in:
             expected_df = pd.read_csv(expected_data_in)
 
-        def mock_video_json():
-            return json.loads(input_video_insights)
-
-        def mock_no_video_json():
-            return json.loads(input_no_video_insights)
-
-        mock_video_response = MagicMock(ok=True, json=mock_video_json)
-        mock_no_video_response = MagicMock(ok=True, json=mock_no_video_json)
-        request_mock.side_effect = [
-            mock_video_response,
-            mock_no_video_response,
-            mock_no_video_response]
+        session_post_mock.side_effect = mock_batch_post(
+            lambda relative_url: (
+                200,
+                input_video_insights
+                if 'video_views' in relative_url
+                else input_no_video_insights))
 
         with freeze_time('2020-01-01 00:00:05'):
             self.task = instagram.FetchIgPostPerformance(
@@ -5,6 +5,7 @@ import sys
 from unittest.mock import patch
 
 import luigi
+import numpy as np
 import pandas as pd
 
 from db_test import DatabaseTestCase
@@ -13,6 +14,7 @@ from topic_modeling import (
     Doc, TopicModelingFindTopics,
     TopicModelingPreprocessCorpus, TopicModelingCreateCorpus
 )
+from topic_modeling_gsdmm import MovieGroupProcess
 
 
 class TestDoc(DatabaseTestCase):
@@ -32,6 +34,19 @@ class TestDoc(DatabaseTestCase):
         lang = doc.guess_language()
         self.assertIsNone(lang)
 
+    @patch('topic_modeling.detect_language', return_value=None)
+    def test_guess_language_cached(self, detect_mock):
+
+        # the language of the text could not be detected before
+        doc = Doc("https://blablabla.de", language_cached=True)
+        self.assertIsNone(doc.guess_language())
+        detect_mock.assert_not_called()
+
+        doc = Doc("https://blablabla.de")
+        self.assertIsNone(doc.guess_language())
+        self.assertIsNone(doc.guess_language())
+        detect_mock.assert_called_once_with("https://blablabla.de")
+
     def test_too_short(self):
 
         doc = Doc("Text with many tokens")
@@ -117,7 +132,8 @@ class TestPreprocessing(DatabaseTestCase):
             )
 
         # ------- RUN TASK UNDER TEST --------
-        task = TopicModelingPreprocessCorpus()
+        task = TopicModelingPreprocessCorpus(
+            cache_dir=f'{os.getenv("OUTPUT_DIR")}/cache')
         task.run()
 
         # ------- INSPECT OUTPUT -------
@@ -129,6 +145,44 @@ class TestPreprocessing(DatabaseTestCase):
         self.assertEqual(
             output[1].tokens, ['weitere', 'weitere', 'toll'])
 
+    def test_consecutive_rare_tokens(self):
+
+        docs = [
+            Doc("kunst garten garten monet manet park", language='de'),
+            Doc("park bild bild seerosen", language='de')
+        ]
+
+        docs = TopicModelingPreprocessCorpus(
+            cache_dir=f'{os.getenv("OUTPUT_DIR")}/cache'
+        ).preprocess(docs)
+
+        # every token that appears only once is removed, even if it follows
+        # another removed token
+        self.assertEqual(
+            [
+                ['garten', 'garten', 'park'],
+                ['park', 'bild', 'bild']
+            ],
+            [doc.tokens for doc in docs])
+
+    def test_cache_depends_on_stop_words(self):
+
+        task = TopicModelingPreprocessCorpus(
+            cache_dir=f'{os.getenv("OUTPUT_DIR")}/cache')
+
+        def preprocess(stop_words):
+            with patch.object(task, 'stop_words', stop_words):
+                return [
+                    doc.tokens
+                    for doc in task.preprocess_year(2020, [
+                        Doc("kunst garten park",
+                            post_date=datetime(2020, 1, 1), language='de')
+                    ])
+                ]
+
+        self.assertEqual([['kunst', 'garten', 'park']], preprocess(set()))
+        self.assertEqual([['kunst', 'park']], preprocess({'garten'}))
+
 
 class TestFindTopics(DatabaseTestCase):
     """Tests the TopicModelingFindTopics task."""
@@ -179,7 +233,8 @@ class TestFindTopics(DatabaseTestCase):
         with open(os.devnull, 'w') as null_file:
             sys.stdout = null_file
 
-            task = TopicModelingFindTopics()
+            task = TopicModelingFindTopics(
+                cache_dir=f'{os.getenv("OUTPUT_DIR")}/cache')
             task.run()
         # stop suppressing messages
         sys.stdout = sys.__stdout__
@@ -206,3 +261,33 @@ class TestFindTopics(DatabaseTestCase):
         )
         for model in ['all', '2018', '2019', '2021']:
             self.assertIn(model, list(topics['model']))
+
+
+class TestMovieGroupProcess(DatabaseTestCase):
+    """Tests the vectorized GSDMM implementation."""
+
+    def test_fit(self):
+
+        docs = [
+            *[['kunst', 'bild', 'maler']] * 10,
+            *[['cafe', 'kuchen', 'kaffee']] * 10
+        ]
+        np.random.seed(0)
+        model = MovieGroupProcess(K=5, n_iters=30)
+
+        labels = model.fit(docs, vocab_size=6)
+
+        self.assertEqual(len(labels), 20)
+        self.assertEqual(len(set(labels[:10])), 1)
+        self.assertEqual(len(set(labels[10:])), 1)
+        self.assertNotEqual(labels[0], labels[10])
+
+        distribution = model.cluster_word_distribution
+        self.assertEqual(len(distribution), 5)
+        self.assertDictEqual(
+            distribution[labels[0]],
+            {'kunst': 10, 'bild': 10, 'maler': 10})
+
+        label, probability = model.choose_best_label(['kaffee', 'unbekannt'])
+        self.assertEqual(label, labels[10])
+        self.assertGreater(probability, 0.5)
@@ -1,5 +1,7 @@
+import datetime as dt
 from unittest.mock import MagicMock, patch
 
+from freezegun import freeze_time
 from luigi.format import UTF8
 from luigi.mock import MockTarget
 import pandas as pd
@@ -520,3 +522,95 @@ class TestDataPreparationTask(DatabaseTestCase):
         self.task = DataPreparationTask(table=TABLE_NAME)
         self.task.condense_performance_values(df)
         pd.testing.assert_frame_equal(df, df_copy)
+
+
+class TestPerformancePollScheduler(DatabaseTestCase):
+    """Tests the PerformancePollScheduler class."""
+
+    @freeze_time('2020-05-10 12:00:00')
+    def test_is_due(self):
+
+        self.db_connector.execute('''
+            INSERT INTO performance_poll VALUES
+                ('test_table', 'past', '2020-05-10 11:00', '1 hour'),
+                ('test_table', 'soon', '2020-05-10 12:05', '1 hour'),
+                ('test_table', 'future', '2020-05-11 12:00', '1 day'),
+                ('other_table', 'other', '2020-05-11 12:00', '1 day')
+        ''')
+
+        scheduler = DataPreparationTask(table=TABLE_NAME).poll_scheduler()
+
+        self.assertEqual(
+            [True, True, False, True],
+            scheduler.is_due(['past', 'soon', 'future', 'other']))
+
+    @freeze_time('2020-05-10 12:00:00')
+    def test_reschedule(self):
+
+        self.db_connector.execute('''
+            INSERT INTO performance_poll VALUES
+                ('test_table', 'unchanged', '2020-05-10 12:00', '1 day'),
+                ('test_table', 'changed', '2020-05-10 12:00', '1 day')
+        ''')
+        now = dt.datetime(2020, 5, 10, 12)
+
+        scheduler = DataPreparationTask(table=TABLE_NAME).poll_scheduler()
+        next_polls = scheduler.next_polls(
+            ['new', 'young', 'unchanged', 'changed', 'old'],
+            [
+                now - dt.timedelta(hours=5),
+                now - dt.timedelta(days=5),
+                now - dt.timedelta(days=5),
+                now - dt.timedelta(days=5),
+                now - dt.timedelta(days=500)
+            ],
+            ['young', 'changed'])
+        scheduler.store(next_polls)
+
+        self.assertCountEqual(
+            [
+                ('new', dt.timedelta(hours=1)),
+                ('young', dt.timedelta(hours=5)),
+                ('unchanged', dt.timedelta(days=2)),
+                ('changed', dt.timedelta(hours=5)),
+                ('old', dt.timedelta(days=7))
+            ],
+            self.db_connector.query('''
+                SELECT post_key, poll_interval
+                FROM performance_poll
+                WHERE next_poll = '2020-05-10 12:00' + poll_interval
+            '''))
+
+    @freeze_time('2020-05-10 12:00:00')
+    def test_store_poll_schedule(self):
+
+        self.db_connector.execute('''
+            INSERT INTO performance_poll VALUES
+                ('test_table', 'polled', '2020-05-10 12:00', '1 day')
+        ''')
+        now = dt.datetime(2020, 5, 10, 12)
+        task = DataPreparationTask(table=TABLE_NAME)
+
+        task.write_poll_schedule(task.poll_scheduler().next_polls(
+            ['polled', 'new'],
+            [now - dt.timedelta(days=5), now - dt.timedelta(hours=5)],
+            ['polled', 'new']))
+
+        # Nothing is stored before the performance values are stored
+        self.assertEqual(
+            [('polled', dt.timedelta(days=1))],
+            self.db_connector.query('''
+                SELECT post_key, poll_interval FROM performance_poll
+            '''))
+
+        task.store_poll_schedule()
+
+        self.assertCountEqual(
+            [
+                ('polled', now + dt.timedelta(hours=5), dt.timedelta(hours=5)),
+                ('new', now + dt.timedelta(hours=1), dt.timedelta(hours=1))
+            ],
+            self.db_connector.query('''
+                SELECT post_key, next_poll, poll_interval
+                FROM performance_poll
+            '''))
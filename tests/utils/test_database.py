@@ -98,6 +98,28 @@ class TestCsvToDb(DatabaseTestCase):
             f'SELECT * FROM {self.table_name}')
         self.assertEqual(EXPECTED_DATA, actual_data)
 
+    def test_unchanged_rows_are_not_updated(self):
+
+        # Set up database samples
+        self.db_connector.execute(f'''
+                INSERT INTO {self.table_name} VALUES
+                    (1, 2, 'abc', 'xy,"z'),  -- same as in EXPECTED_CSV
+                    (2, 10, 'old', ',,;abc')  -- different than in EXPECTED_CSV
+            ''')
+        # xmin is the ID of the transaction that inserted the row version
+        xmin_query = f'''
+            SELECT id, xmin::text FROM {self.table_name}
+        '''
+        old_xmins = dict(self.db_connector.query(xmin_query))
+
+        # Execute code under test
+        self.run_task(self.dummy)
+
+        # Inspect result
+        new_xmins = dict(self.db_connector.query(xmin_query))
+        self.assertEqual(old_xmins[1], new_xmins[1])
+        self.assertNotEqual(old_xmins[2], new_xmins[2])
+
     def test_replace_content(self):
 
         # Set up database samples
@@ -0,0 +1,132 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from _utils import http_client
+from db_test import DatabaseTestCase
+
+
+def mock_response(status_code, headers=None):
+    """Build a mock of a requests response with the given status."""
+    return MagicMock(
+        status_code=status_code,
+        ok=status_code < 400,
+        headers=headers or {})
+
+
+@patch('_utils.http_client.time.sleep')
+@patch('_utils.http_client.requests.Session.request')
+class TestRequest(DatabaseTestCase):
+    """Tests the request() function."""
+
+    def test_success(self, request_mock, sleep_mock):
+
+        request_mock.return_value = mock_response(200)
+
+        response = http_client.get('https://example.com/success')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, request_mock.call_count)
+        sleep_mock.assert_not_called()
+
+    def test_retry_transient_failures(self, request_mock, sleep_mock):
+
+        request_mock.side_effect = [
+            requests.ConnectionError(),
+            mock_response(503),
+            mock_response(200)
+        ]
+
+        response = http_client.get('https://example.com/transient')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, request_mock.call_count)
+        self.assertEqual(2, sleep_mock.call_count)
+
+    def test_no_retry_for_client_errors(self, request_mock, sleep_mock):
+
+        request_mock.return_value = mock_response(404)
+
+        response = http_client.get('https://example.com/missing')
+
+        self.assertEqual(404, response.status_code)
+        self.assertEqual(1, request_mock.call_count)
+
+    def test_persistent_failure(self, request_mock, sleep_mock):
+
+        request_mock.return_value = mock_response(500)
+
+        response = http_client.get(
+            'https://example.com/persistent', attempts=3)
+
+        self.assertEqual(500, response.status_code)
+        self.assertEqual(3, request_mock.call_count)
+
+        request_mock.side_effect = requests.Timeout()
+        with self.assertRaises(requests.Timeout):
+            http_client.get('https://example.com/persistent', attempts=2)
+
+    def test_reduce_concurrency(self, request_mock, sleep_mock):
+
+        request_mock.return_value = mock_response(200, {
+            'X-App-Usage': json.dumps({'call_count': 80})
+        })
+        http_client.configure_host('usage.example.com', max_concurrency=8)
+
+        http_client.get('https://usage.example.com/high')
+
+        host = http_client._host('https://usage.example.com')
+        self.assertEqual(4, host.concurrency)
+
+        request_mock.return_value = mock_response(200, {
+            'X-App-Usage': json.dumps({'call_count': 10})
+        })
+        http_client.get('https://usage.example.com/low')
+
+        self.assertEqual(5, host.concurrency)
+
+    def test_token_bucket(self, request_mock, sleep_mock):
+
+        request_mock.return_value = mock_response(200)
+        http_client.configure_host(
+            'bucket.example.com', min_interval=60, burst=2)
+
+        # Both requests are sent at once without waiting for a new token
+        http_client.get('https://bucket.example.com/1')
+        http_client.get('https://bucket.example.com/2')
+
+        host = http_client._host('https://bucket.example.com')
+        self.assertLess(host.tokens, 1)
+        self.assertEqual(2, request_mock.call_count)
+
+
+class TestParseHeaders(DatabaseTestCase):
+    """Tests the header parsing functions of http_client."""
+
+    def test_parse_retry_after(self):
+
+        self.assertEqual(120, http_client.parse_retry_after(
+            {'Retry-After': '120'}))
+        self.assertEqual(0, http_client.parse_retry_after(
+            {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}))
+        self.assertIsNone(http_client.parse_retry_after({}))
+        self.assertIsNone(http_client.parse_retry_after(
+            {'Retry-After': 'soon'}))
+
+    def test_parse_usage(self):
+
+        self.assertEqual((None, 0), http_client.parse_usage({}))
+        self.assertEqual((42, 0), http_client.parse_usage({
+            'X-App-Usage': json.dumps(
+                {'call_count': 42, 'total_cputime': 7, 'total_time': 12})
+        }))
+        self.assertEqual((100, 300), http_client.parse_usage({
+            'X-Business-Use-Case-Usage': json.dumps({'123': [{
+                'type': 'pages',
+                'call_count': 100,
+                'total_cputime': 20,
+                'total_time': 30,
+                'estimated_time_to_regain_access': 5
+            }]})
+        }))
@@ -0,0 +1,83 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import Ridge
+from sklearn.neighbors import KNeighborsRegressor
+
+from db_test import DatabaseTestCase
+from visitor_prediction.backtesting import (
+    BacktestVisitorPrediction, evaluate_model)
+
+
+def preprocessed_entries(days):
+    """Build preprocessed entries whose popularity predicts the entries."""
+    entries = pd.DataFrame(
+        index=pd.date_range(start=dt.date(2020, 1, 1), periods=days),
+        data={'entries': np.arange(days) * 10.0})
+    entries['exhibition_popularity'] = entries['entries']
+    entries['exhibition_progress'] = 0.0
+    entries['is_closed'] = 0
+    return entries
+
+
+class TestBacktestVisitorPrediction(DatabaseTestCase):
+    """Tests the BacktestVisitorPrediction task."""
+
+    def test_select_cutoffs(self):
+
+        dates = pd.date_range(start=dt.date(2020, 1, 1), periods=20)
+        task = BacktestVisitorPrediction(
+            days_to_predict=2, cutoff_step=2, n_cutoffs=3)
+        self.assertEqual(
+            list(dates[[17, 15, 13]]),
+            task.select_cutoffs(dates))
+
+        # the earliest cutoff leaves 10 days to train knn_10
+        task = BacktestVisitorPrediction(
+            days_to_predict=2, cutoff_step=2, n_cutoffs=12)
+        self.assertEqual(
+            list(dates[[17, 15, 13, 11, 9]]),
+            task.select_cutoffs(dates))
+
+
+class TestEvaluateModel(DatabaseTestCase):
+    """Tests the evaluate_model() function."""
+
+    def test_metrics(self):
+
+        entries = preprocessed_entries(10)
+
+        result = evaluate_model(
+            'knn_1', KNeighborsRegressor(n_neighbors=1),
+            entries, entries['entries'],
+            pd.Timestamp(2020, 1, 6), 2)
+
+        # both days are predicted like the last training day (50 entries)
+        self.assertEqual('knn_1', result['model'])
+        self.assertEqual(dt.date(2020, 1, 6), result['cutoff_date'])
+        self.assertEqual(2, result['days_to_predict'])
+        self.assertAlmostEqual(15, result['mae'])
+        self.assertAlmostEqual(np.sqrt((10 ** 2 + 20 ** 2) / 2),
+                               result['rmse'])
+        self.assertGreaterEqual(result['fit_cpu_seconds'], 0)
+        self.assertGreaterEqual(result['predict_cpu_seconds'], 0)
+
+    def test_no_future_leak(self):
+
+        entries = preprocessed_entries(20)
+        future_entries = entries.copy()
+        future_entries.loc['2020-01-09':, ['entries',
+                                           'exhibition_popularity']] *= 100
+
+        results = [
+            evaluate_model(
+                'ridge', Ridge(),
+                all_entries, all_entries['entries'],
+                pd.Timestamp(2020, 1, 6), 2)
+            for all_entries in [entries, future_entries]
+        ]
+
+        # days after the predicted ones must not affect the scalers
+        self.assertEqual(results[0]['mae'], results[1]['mae'])
+        self.assertEqual(results[0]['rmse'], results[1]['rmse'])